@@ -0,0 +1,286 @@
+# als_recommender.py
+import os
+import time
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from collaborative_filtering import CollaborativeFilteringRecommender, _allowed_items, _new_model_version
+
+# Dense score scratch per scoring step: blocks of users or items are scored as
+# many rows at a time as fit, so memory stays flat however large the catalog
+DENSE_BLOCK_BYTES = 64 << 20
+
+def _dense_chunks(n_rows, n_cols):
+    """Row slices of a block whose dense scores (and argpartition indices) fit DENSE_BLOCK_BYTES"""
+    step = max(DENSE_BLOCK_BYTES // (16 * max(n_cols, 1)), 1)
+    return [slice(start, start + step) for start in range(0, max(n_rows, 1), step)]
+
+def _top_n_dense(scores, n):
+    """Top-n column indices and scores of every row of a dense score block, best first"""
+    n = min(n, scores.shape[1])
+    if n <= 0:
+        return np.zeros((scores.shape[0], 0), dtype=int), np.zeros((scores.shape[0], 0))
+    
+    part = np.argpartition(-scores, n - 1, axis=1)[:, :n]
+    part_scores = np.take_along_axis(scores, part, axis=1)
+    order = np.argsort(-part_scores, axis=1, kind='stable')
+    return np.take_along_axis(part, order, axis=1), np.take_along_axis(part_scores, order, axis=1)
+
+class ALSRecommender:
+    """
+    Implicit-feedback matrix factorization trained with alternating least squares
+    
+    Uses the weighted user-item matrix of a CollaborativeFilteringRecommender,
+    treating each interaction weight w as confidence 1 + alpha * w (Hu, Koren
+    & Volinsky, 2008), and shares its id mappings.
+    """
+    
+    def __init__(self, collaborative, factors=64, regularization=0.1, alpha=10.0,
+                 iterations=15, n_threads=None, block_bytes=32 << 20, random_state=42):
+        self.collaborative = collaborative
+        self.factors = factors
+        self.regularization = regularization
+        self.alpha = alpha
+        self.iterations = iterations
+        self.n_threads = n_threads or os.cpu_count()
+        # Scratch bytes per solve block, mostly its (rows, factors, factors) normal equations
+        self.block_bytes = block_bytes
+        self.random_state = random_state
+        
+        self.user_factors = None
+        self.item_factors = None
+        # Item factors scaled to unit length, so dot products are cosine similarities
+        self.item_unit = None
+        self.model_version = None
+    
+    @property
+    def nbytes(self):
+        """Memory held by the factor matrices"""
+        return self.user_factors.nbytes + self.item_factors.nbytes + self.item_unit.nbytes
+    
+    def fit(self):
+        """Train user and item factors on the CF model's user-item matrix"""
+        print(f"Training ALS ({self.factors} factors, {self.iterations} iterations)...")
+        
+        matrix = self.collaborative.user_item_matrix.tocsr().astype(float)
+        rng = np.random.default_rng(self.random_state)
+        self.user_factors = rng.normal(0, 0.01, (matrix.shape[0], self.factors))
+        self.item_factors = rng.normal(0, 0.01, (matrix.shape[1], self.factors))
+        
+        item_user = matrix.T.tocsr()
+        with ThreadPoolExecutor(max_workers=self.n_threads) as executor:
+            for _ in range(self.iterations):
+                self.user_factors = self._solve(matrix, self.item_factors, executor)
+                self.item_factors = self._solve(item_user, self.user_factors, executor)
+        
+        norms = np.linalg.norm(self.item_factors, axis=1)
+        self.item_unit = np.divide(self.item_factors, norms[:, None], out=np.zeros_like(self.item_factors),
+                                   where=norms[:, None] > 0)
+        
+        self.model_version = _new_model_version()
+        print("ALS training complete")
+        return self
+    
+    def _solve(self, matrix, fixed, executor):
+        """Solve for the factors of every row of matrix with the other side held fixed"""
+        gram = fixed.T @ fixed + self.regularization * np.eye(self.factors)
+        result = np.zeros((matrix.shape[0], self.factors))
+        
+        # Bucket rows by length (powers of two) so padding at most doubles the
+        # work, and size every block so its float64 scratch, the normal
+        # equations (factors x factors per row) plus two padded copies of the
+        # fixed factors (width x factors per row), stays within block_bytes
+        lengths = np.diff(matrix.indptr)
+        buckets = np.ceil(np.log2(np.maximum(lengths, 1))).astype(int)
+        blocks = []
+        for bucket in np.unique(buckets):
+            rows = np.flatnonzero(buckets == bucket)
+            width = max(lengths[rows].max(), 1)
+            row_bytes = 8 * self.factors * (self.factors + 2 * width)
+            per_block = max(self.block_bytes // row_bytes, 1)
+            blocks.extend(rows[i:i + per_block] for i in range(0, len(rows), per_block))
+        
+        def solve_block(rows):
+            # Pad each row's interactions to the block width
+            width = max(lengths[rows].max(), 1)
+            valid = np.arange(width)[None, :] < lengths[rows][:, None]
+            positions = np.where(valid, matrix.indptr[rows][:, None] + np.arange(width)[None, :], 0)
+            confidence = np.where(valid, self.alpha * matrix.data[positions], 0.0)
+            y = fixed[matrix.indices[positions]] * valid[:, :, None]
+            
+            # A_u = YtY + Y_u^T (C_u - I) Y_u + lambda I,  b_u = Y_u^T C_u p_u
+            a = gram + np.matmul((y * confidence[:, :, None]).transpose(0, 2, 1), y)
+            b = np.matmul(((1.0 + confidence) * valid)[:, None, :], y)
+            
+            result[rows] = np.linalg.solve(a, b.transpose(0, 2, 1))[:, :, 0]
+        
+        list(executor.map(solve_block, blocks))
+        return result
+    
+    def _user_index(self, user_id):
+        user_idx = self.collaborative.users.index(user_id)
+        if user_idx is None or user_idx >= len(self.user_factors):
+            return None
+        return user_idx
+    
+    def _score_users(self, user_idx, num_recommendations, allowed=None):
+        """
+        Top-N of the dense dot-product scores for a block of users, seen and filtered-out items masked out
+        
+        The block is scored in row chunks (see _dense_chunks), so only one
+        chunk of users x items scores is held at a time.
+        """
+        n_items = len(self.item_factors)
+        excluded = None if allowed is None else ~_allowed_items(allowed, np.arange(n_items))
+        results = []
+        for chunk in _dense_chunks(len(user_idx), n_items):
+            scores = self.user_factors[user_idx[chunk]] @ self.item_factors.T
+            if excluded is not None:
+                scores[:, excluded] = -np.inf
+            
+            user_rows = self.collaborative.user_rows(user_idx[chunk])
+            rows = np.repeat(np.arange(len(scores)), np.diff(user_rows.indptr))
+            seen = user_rows.indices < n_items
+            scores[rows[seen], user_rows.indices[seen]] = -np.inf
+            results.append(_top_n_dense(scores, num_recommendations))
+        
+        return np.concatenate([r[0] for r in results]), np.concatenate([r[1] for r in results])
+    
+    def score_users(self, user_idx, num_recommendations=10):
+        """
+        Top-N item indices and scores for an array of user indices, as (users, N) arrays
+        
+        Rows with fewer than N scored items are padded with index -1 and
+        score -inf, as with CollaborativeFilteringRecommender.score_users.
+        """
+        item_idx, scores = self._score_users(user_idx, num_recommendations)
+        top_idx = np.full((len(user_idx), num_recommendations), -1, dtype=np.int64)
+        top_scores = np.full((len(user_idx), num_recommendations), -np.inf)
+        found = np.isfinite(scores)
+        top_idx[:, :item_idx.shape[1]] = np.where(found, item_idx, -1)
+        top_scores[:, :scores.shape[1]] = scores
+        return top_idx, top_scores
+    
+    def _similar_items(self, item_idx, num_recommendations):
+        """Top-N of the factor cosine similarities for a block of items, scored in row chunks"""
+        unit = self.item_unit
+        results = []
+        for chunk in _dense_chunks(len(item_idx), len(unit)):
+            scores = unit[item_idx[chunk]] @ unit.T
+            scores[np.arange(len(scores)), item_idx[chunk]] = -np.inf
+            results.append(_top_n_dense(scores, num_recommendations))
+        return np.concatenate([r[0] for r in results]), np.concatenate([r[1] for r in results])
+    
+    def top_n_for_user(self, user_id, num_recommendations=10, allowed=None):
+        """Top-N unseen items for a user as (product_ids, scores) arrays, optionally filtered by allowed"""
+        user_idx = self._user_index(user_id)
+        if user_idx is None:
+            return np.array([], dtype=str), np.array([])
+        
+        item_idx, scores = self._score_users(np.array([user_idx]), num_recommendations, allowed)
+        keep = np.isfinite(scores[0])
+        return self.collaborative.item_ids[item_idx[0][keep]], scores[0][keep]
+    
+    def top_n_similar_items(self, product_id, num_recommendations=10, allowed=None):
+        """Top-N items by cosine similarity of their factors, optionally filtered by allowed"""
+        item_idx = self.collaborative.items.index(product_id)
+        if item_idx is None or item_idx >= len(self.item_factors):
+            return np.array([], dtype=str), np.array([])
+        
+        scores = self.item_unit @ self.item_unit[item_idx]
+        scores[item_idx] = -np.inf
+        if allowed is not None:
+            scores[~_allowed_items(allowed, np.arange(len(scores)))] = -np.inf
+        
+        top_idx, top_scores = _top_n_dense(scores[None, :], num_recommendations)
+        keep = np.isfinite(top_scores[0])
+        return self.collaborative.item_ids[top_idx[0][keep]], top_scores[0][keep]
+    
+    def iter_top_n_for_users(self, user_ids, num_recommendations=10, block_size=1000):
+        """Yield (user_id, product_ids, scores) for many users, scoring a block at a time"""
+        user_ids = list(user_ids)
+        
+        for start in range(0, len(user_ids), block_size):
+            block_ids = user_ids[start:start + block_size]
+            block_idx = self.collaborative.users.lookup(block_ids)
+            is_known = (block_idx >= 0) & (block_idx < len(self.user_factors))
+            item_idx, scores = self._score_users(block_idx[is_known], num_recommendations)
+            
+            row = 0
+            for user_id, known in zip(block_ids, is_known.tolist()):
+                if not known:
+                    yield user_id, np.array([], dtype=str), np.array([])
+                    continue
+                keep = np.isfinite(scores[row])
+                yield user_id, self.collaborative.item_ids[item_idx[row][keep]], scores[row][keep]
+                row += 1
+    
+    def iter_top_n_similar_items(self, product_ids, num_recommendations=10, block_size=1000):
+        """Yield (product_id, product_ids, similarities) for many items, scoring a block at a time"""
+        product_ids = list(product_ids)
+        
+        for start in range(0, len(product_ids), block_size):
+            block_ids = product_ids[start:start + block_size]
+            block_idx = self.collaborative.items.lookup(block_ids)
+            is_known = (block_idx >= 0) & (block_idx < len(self.item_factors))
+            item_idx = block_idx[is_known]
+            
+            top_idx, top_scores = self._similar_items(item_idx, num_recommendations)
+            
+            row = 0
+            for product_id, known in zip(block_ids, is_known.tolist()):
+                if not known:
+                    yield product_id, np.array([], dtype=str), np.array([])
+                    continue
+                keep = np.isfinite(top_scores[row])
+                yield product_id, self.collaborative.item_ids[top_idx[row][keep]], top_scores[row][keep]
+                row += 1
+    
+    def recommend_for_users(self, user_ids, num_recommendations=10, block_size=1000):
+        """Recommend items for many users at once, keyed by user id"""
+        return {
+            user_id: [
+                {'product_id': pid, 'score': float(score)}
+                for pid, score in zip(product_ids.tolist(), scores)
+            ]
+            for user_id, product_ids, scores in self.iter_top_n_for_users(
+                user_ids, num_recommendations, block_size)
+        }
+    
+    def recommend_for_user(self, user_id, num_recommendations=10, allowed=None):
+        """Recommend items for a user from the factor model"""
+        product_ids, scores = self.top_n_for_user(user_id, num_recommendations, allowed)
+        return [
+            {'product_id': pid, 'score': float(score)}
+            for pid, score in zip(product_ids.tolist(), scores)
+        ]
+    
+    def recommend_similar_items(self, product_id, num_recommendations=10, allowed=None):
+        """Find similar items by item factor cosine similarity"""
+        product_ids, scores = self.top_n_similar_items(product_id, num_recommendations, allowed)
+        return [
+            {'product_id': pid, 'similarity': float(score)}
+            for pid, score in zip(product_ids.tolist(), scores)
+        ]
+
+# Compare the factor model with item-item CF on the same data
+if __name__ == '__main__':
+    cf_recommender = CollaborativeFilteringRecommender()
+    cf_recommender.build_matrix().compute_item_similarity()
+    
+    als = ALSRecommender(cf_recommender).fit()
+    
+    similarity = cf_recommender.item_similarity
+    knn_bytes = similarity.data.nbytes + similarity.indices.nbytes + similarity.indptr.nbytes
+    print(f"\nItem-item index: {knn_bytes / 1e6:.2f} MB | ALS factors: {als.nbytes / 1e6:.2f} MB")
+    
+    users = list(cf_recommender.users)
+    for name, model in (('item_knn', cf_recommender), ('als', als)):
+        start = time.perf_counter()
+        model.recommend_for_users(users, 10)
+        elapsed = time.perf_counter() - start
+        print(f"{name}: {len(users) / elapsed:.0f} users/sec (batched)")
+    
+    user_id = 'USER00001'
+    print(f"\n=== ALS Recommendations for {user_id} ===\n")
+    for i, rec in enumerate(als.recommend_for_user(user_id, 10), 1):
+        print(f"{i}. {rec['product_id']} (Score: {rec['score']:.4f})")
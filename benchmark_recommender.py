@@ -0,0 +1,404 @@
+# benchmark_recommender.py
+import argparse
+import json
+import os
+import platform
+import re
+import sys
+import tempfile
+import time
+import tracemalloc
+from collections import defaultdict
+from datetime import datetime, timezone
+import numpy as np
+import scipy
+from collaborative_filtering import CollaborativeFilteringRecommender
+from hybrid_recommender import HybridRecommender
+from interaction_store import InteractionLog
+
+# Benchmark grids as (users, items, density) cases, where density is the
+# number of interactions per cell of the user-item matrix
+GRIDS = {
+    'smoke': [(500, 200, 0.02)],
+    'small': [(n_users, n_items, density)
+              for n_users, n_items in ((1000, 500), (5000, 1000))
+              for density in (0.005, 0.02)],
+    'medium': [(n_users, n_items, density)
+               for n_users, n_items in ((20000, 2000), (50000, 5000))
+               for density in (0.001, 0.005)],
+    'large': [(n_users, n_items, density)
+              for n_users, n_items in ((200000, 20000), (500000, 50000))
+              for density in (0.0002, 0.001)]
+}
+
+# Committed baseline that runs are compared against by default
+BASELINE_FILE = 'benchmark_baseline.json'
+
+# Metrics compared against the baseline, with the absolute change below
+# which a slowdown is treated as noise
+COMPARED_METRICS = {
+    'wall_s': 0.01,
+    'peak_mb': 1.0,
+    'p50_ms': 0.05,
+    'p95_ms': 0.1,
+    'p99_ms': 0.2
+}
+
+# Environment recorded with every run; timings are only compared between
+# runs whose environments match on all of these
+ENVIRONMENT_KEYS = ('python', 'numpy', 'scipy', 'machine', 'processor', 'cpu_count')
+
+CATEGORIES = ['Electronics', 'Clothing', 'Home & Kitchen', 'Books', 'Sports',
+              'Beauty', 'Toys', 'Grocery', 'Automotive', 'Garden']
+BRANDS = ['Acme', 'Globex', 'Initech', 'Umbrella', 'Hooli', 'Stark', 'Wayne', 'Wonka']
+
+def synthetic_catalog(n_items, seed=42):
+    """Products with the fields the recommenders read, item i in category i % len(CATEGORIES)"""
+    rng = np.random.default_rng(seed)
+    brands = rng.integers(0, len(BRANDS), n_items)
+    prices = np.round(rng.uniform(5, 500, n_items), 2)
+    ratings = np.round(rng.uniform(1, 5, n_items), 1)
+    popularity = np.round(rng.uniform(0, 100, n_items), 2)
+    sales = rng.integers(0, 1000, n_items)
+    
+    products = []
+    for i in range(n_items):
+        category = CATEGORIES[i % len(CATEGORIES)]
+        brand = BRANDS[brands[i]]
+        products.append({
+            'id': f'PROD{i:06d}',
+            'title': f'{brand} {category} item {i}',
+            'description': f'A {category.lower()} product from {brand}',
+            'category': category,
+            'brand': brand,
+            'price': float(prices[i]),
+            'rating': float(ratings[i]),
+            'num_reviews': int(sales[i] // 3),
+            'popularity_score': float(popularity[i]),
+            'sales_last_30_days': int(sales[i]),
+            'discount_percent': 0,
+            'in_stock': True,
+            'tags': [category.lower(), brand.lower()]
+        })
+    return products
+
+def synthetic_log(n_users, n_items, density, seed=42):
+    """
+    Random interaction log with skewed item popularity and category affinity
+    
+    Items are drawn from a Zipf-like popularity curve, and 80% of each
+    user's events land in their favourite category, so item co-occurrence
+    has the structure item-item CF relies on.
+    """
+    rng = np.random.default_rng(seed)
+    n_events = max(int(n_users * n_items * density), n_users)
+    n_categories = min(len(CATEGORIES), n_items)
+    
+    popularity = 1.0 / np.arange(1, n_items + 1) ** 0.8
+    user_codes = rng.integers(0, n_users, n_events)
+    item_codes = rng.choice(n_items, n_events, p=popularity / popularity.sum())
+    
+    # Move affinity events to the same popularity rank within the user's category
+    favourite = rng.integers(0, n_categories, n_users)[user_codes]
+    affinity = rng.random(n_events) < 0.8
+    moved = item_codes - item_codes % n_categories + favourite
+    item_codes = np.where(affinity & (moved < n_items), moved, item_codes)
+    
+    type_codes = rng.choice(4, n_events, p=[0.5, 0.3, 0.15, 0.05])
+    now = int(time.time())
+    timestamps = now - rng.integers(0, 90 * 86400, n_events)
+    
+    return InteractionLog(
+        [f'USER{i:06d}' for i in range(n_users)],
+        [f'PROD{i:06d}' for i in range(n_items)],
+        [f'SESS{i:06d}' for i in range(n_users)],
+        user_codes, item_codes, user_codes, type_codes, timestamps
+    )
+
+class StubSolrClient:
+    """
+    In-process stand-in for SolrClient over a fixed catalog
+    
+    Answers the query shapes the recommenders send (id lookups, terms
+    multi-gets, MoreLikeThis and sorted filter queries) from memory, so
+    benchmarks run offline and measure the recommender, not the network.
+    """
+    
+    def __init__(self, products):
+        self.products = products
+        self.by_id = {p['id']: p for p in products}
+        self.by_category = defaultdict(list)
+        for p in products:
+            self.by_category[p['category']].append(p)
+        self.queries = 0
+    
+    def select(self, params):
+        """Answer a /select query with a Solr-shaped response"""
+        self.queries += 1
+        query = params.get('q', '*:*')
+        rows = int(params.get('rows', 10))
+        more_like_this = {}
+        
+        if query.startswith('{!terms f=id}'):
+            ids = query[len('{!terms f=id}'):].split(',')
+            docs = [self.by_id[pid] for pid in ids if pid in self.by_id]
+        elif query.startswith('id:'):
+            pid = query[3:]
+            docs = [self.by_id[pid]] if pid in self.by_id else []
+            if params.get('mlt') == 'true' and docs:
+                # Same-category products stand in for MoreLikeThis matches
+                similar = [p for p in self.by_category[docs[0]['category']][:rows + 1] if p['id'] != pid]
+                more_like_this[pid] = {'docs': [dict(p, score=1.0) for p in similar[:rows]]}
+        else:
+            docs = self._filter(params)
+        
+        docs = docs[:rows]
+        if 'fl' in params:
+            fields = params['fl'].split(',')
+            docs = [{k: doc[k] for k in fields if k in doc} for doc in docs]
+        else:
+            docs = [dict(doc) for doc in docs]
+        
+        return {'response': {'numFound': len(docs), 'docs': docs}, 'moreLikeThis': more_like_this}
+    
+    def _filter(self, params):
+        """Apply field:"value" and -id: filters and a multi-key descending sort"""
+        docs = self.products
+        fq = params.get('fq', '')
+        for field, value in re.findall(r'(\w+):"([^"]+)"', fq):
+            docs = [p for p in docs if p.get(field) == value]
+        for excluded in re.findall(r'-id:(\S+)', fq):
+            docs = [p for p in docs if p['id'] != excluded]
+        
+        keys = [part.split()[0] for part in params.get('sort', '').split(',') if part.strip()]
+        if keys:
+            docs = sorted(docs, key=lambda p: tuple(p.get(k, 0) for k in keys), reverse=True)
+        return docs
+    
+    def search(self, params):
+        """Answer a /select query and return the matching docs"""
+        return self.select(params)['response']['docs']
+    
+    def close(self):
+        pass
+
+def _processor():
+    """CPU model name, from /proc/cpuinfo where available"""
+    try:
+        with open('/proc/cpuinfo', 'r') as f:
+            for line in f:
+                if line.startswith('model name'):
+                    return line.split(':', 1)[1].strip()
+    except OSError:
+        pass
+    return platform.processor()
+
+def environment():
+    """Interpreter, library and hardware details the timings of a run depend on"""
+    return {
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'scipy': scipy.__version__,
+        'machine': platform.machine(),
+        'processor': _processor(),
+        'cpu_count': os.cpu_count()
+    }
+
+def environment_differences(results, baseline):
+    """(key, baseline value, current value) for every environment detail that differs"""
+    current, previous = results.get('environment', {}), baseline.get('environment', {})
+    return [(key, previous.get(key), current.get(key))
+            for key in ENVIRONMENT_KEYS if previous.get(key) != current.get(key)]
+
+def measure(fn, *args, **kwargs):
+    """
+    Wall time in seconds and peak traced memory in MB of one call
+    
+    The call runs twice: once untraced for the wall time, since tracing
+    slows allocation, then under tracemalloc for the peak.
+    """
+    start = time.perf_counter()
+    fn(*args, **kwargs)
+    wall_s = time.perf_counter() - start
+    
+    tracemalloc.start()
+    try:
+        fn(*args, **kwargs)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    
+    return {'wall_s': wall_s, 'peak_mb': peak / 1e6}
+
+def latency(fn, arguments, warmup=10):
+    """Per-call latency distribution in milliseconds of fn over a list of argument tuples"""
+    for args in arguments[:warmup]:
+        fn(*args)
+    
+    samples = np.empty(len(arguments))
+    for i, args in enumerate(arguments):
+        start = time.perf_counter()
+        fn(*args)
+        samples[i] = (time.perf_counter() - start) * 1000
+    
+    return {
+        'calls': len(samples),
+        'mean_ms': float(samples.mean()),
+        'p50_ms': float(np.percentile(samples, 50)),
+        'p95_ms': float(np.percentile(samples, 95)),
+        'p99_ms': float(np.percentile(samples, 99))
+    }
+
+def case_name(n_users, n_items, density):
+    return f'users={n_users},items={n_items},density={density:g}'
+
+def run_case(n_users, n_items, density, calls=500, top_k=100, seed=42):
+    """Benchmark the model build and the serving hot paths on one synthetic dataset"""
+    log = synthetic_log(n_users, n_items, density, seed)
+    products = synthetic_catalog(n_items, seed)
+    result = {
+        'users': n_users,
+        'items': n_items,
+        'density': density,
+        'interactions': len(log)
+    }
+    
+    model = CollaborativeFilteringRecommender(log)
+    result['build_matrix'] = measure(model.build_matrix)
+    result['compute_item_similarity'] = measure(model.compute_item_similarity, top_k=top_k)
+    result['nnz'] = int(model.user_item_matrix.nnz)
+    result['similarity_nnz'] = int(model.item_similarity.nnz)
+    
+    # Requests for users and products drawn in proportion to their traffic
+    rng = np.random.default_rng(seed + 1)
+    sample = rng.integers(0, len(log), calls)
+    user_ids = log.user_ids[log.user_codes[sample]].tolist()
+    product_ids = log.item_ids[log.item_codes[sample]].tolist()
+    
+    result['recommend_for_user'] = latency(
+        model.recommend_for_user, [(user_id, 10) for user_id in user_ids])
+    result['recommend_similar_items'] = latency(
+        model.recommend_similar_items, [(product_id, 10) for product_id in product_ids])
+    
+    # The hybrid path over the local content engine and trending index, with Solr stubbed out
+    with tempfile.TemporaryDirectory() as tmp:
+        catalog_file = os.path.join(tmp, 'products.json')
+        with open(catalog_file, 'w') as f:
+            json.dump(products, f)
+        
+        solr = StubSolrClient(products)
+        hybrid = HybridRecommender(collaborative=model, solr_client=solr,
+                                   catalog_file=catalog_file, trending_refresh_interval=None)
+    try:
+        result['hybrid_recommend'] = latency(
+            hybrid.hybrid_recommend,
+            [(product_id, user_id, 10) for product_id, user_id in zip(product_ids, user_ids)])
+    finally:
+        hybrid.close()
+    
+    return result
+
+def compare(results, baseline, tolerance=0.2):
+    """List (case, entry point, metric, baseline, current) for every metric slower than the baseline allows"""
+    regressions = []
+    for case, current in results['cases'].items():
+        previous = baseline.get('cases', {}).get(case)
+        if previous is None:
+            continue
+        
+        for entry_point, metrics in current.items():
+            if not isinstance(metrics, dict) or entry_point not in previous:
+                continue
+            for metric, min_delta in COMPARED_METRICS.items():
+                if metric not in metrics or metric not in previous[entry_point]:
+                    continue
+                old, new = previous[entry_point][metric], metrics[metric]
+                if new > old * (1 + tolerance) and new - old > min_delta:
+                    regressions.append((case, entry_point, metric, old, new))
+    return regressions
+
+def print_case(name, result):
+    print(f"\n=== {name} ({result['interactions']} interactions, {result['nnz']} nonzeros) ===")
+    for entry_point in ('build_matrix', 'compute_item_similarity'):
+        metrics = result[entry_point]
+        print(f"{entry_point}: {metrics['wall_s']:.3f}s | peak {metrics['peak_mb']:.1f} MB")
+    for entry_point in ('recommend_for_user', 'recommend_similar_items', 'hybrid_recommend'):
+        metrics = result[entry_point]
+        print(f"{entry_point}: p50 {metrics['p50_ms']:.3f} | p95 {metrics['p95_ms']:.3f} | "
+              f"p99 {metrics['p99_ms']:.3f} ms")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Scalability benchmarks for the CF and hybrid recommenders')
+    parser.add_argument('--grid', choices=sorted(GRIDS), default='small')
+    parser.add_argument('--calls', type=int, default=500, help='latency samples per entry point')
+    parser.add_argument('--top-k', type=int, default=100)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', default='benchmark_results.json')
+    parser.add_argument('--baseline', default=BASELINE_FILE, help='results file to compare against')
+    parser.add_argument('--save-baseline', nargs='?', const=BASELINE_FILE,
+                        help='also merge the results into this baseline, keeping cases of other grids')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='allowed relative slowdown before a metric is flagged')
+    parser.add_argument('--ignore-environment', action='store_true',
+                        help='compare against a baseline recorded on a different environment')
+    args = parser.parse_args()
+    
+    results = {
+        'created_at': datetime.now(timezone.utc).isoformat(),
+        'grid': args.grid,
+        'calls': args.calls,
+        'top_k': args.top_k,
+        'environment': environment(),
+        'cases': {}
+    }
+    
+    for n_users, n_items, density in GRIDS[args.grid]:
+        name = case_name(n_users, n_items, density)
+        results['cases'][name] = run_case(n_users, n_items, density, args.calls, args.top_k, args.seed)
+        print_case(name, results['cases'][name])
+    
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f"\nResults written to {args.output}")
+    
+    if args.save_baseline:
+        cases = {}
+        if os.path.exists(args.save_baseline):
+            with open(args.save_baseline, 'r') as f:
+                previous = json.load(f)
+            # Cases timed on another environment are not comparable with this run's
+            if environment_differences(results, previous):
+                print(f"Environment differs from {args.save_baseline}; replacing its cases")
+            else:
+                cases = previous.get('cases', {})
+        baseline = {key: value for key, value in results.items() if key != 'grid'}
+        baseline['cases'] = {**cases, **results['cases']}
+        with open(args.save_baseline, 'w') as f:
+            json.dump(baseline, f, indent=2)
+        print(f"Baseline updated in {args.save_baseline}")
+    elif not os.path.exists(args.baseline):
+        print(f"\nNo baseline at {args.baseline}; save one with --save-baseline")
+    else:
+        with open(args.baseline, 'r') as f:
+            baseline = json.load(f)
+        
+        differences = environment_differences(results, baseline)
+        if differences:
+            print(f"\nEnvironment differs from {args.baseline}:")
+            for key, old, new in differences:
+                print(f"  {key}: {old} -> {new}")
+            if not args.ignore_environment:
+                print("Timings are not comparable; skipping the comparison "
+                      "(--ignore-environment compares anyway, --save-baseline records a new baseline)")
+                sys.exit(0)
+        
+        missing = [case for case in results['cases'] if case not in baseline.get('cases', {})]
+        if missing:
+            print(f"\nNot in {args.baseline}, not compared: {', '.join(missing)}")
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            print(f"\n{len(regressions)} regression(s) against {args.baseline}:")
+            for case, entry_point, metric, old, new in regressions:
+                print(f"  {case} {entry_point} {metric}: {old:.4f} -> {new:.4f} (+{(new / old - 1) * 100:.0f}%)")
+            sys.exit(1)
+        print(f"\nNo regressions against {args.baseline} (tolerance {args.tolerance:.0%})")
@@ -1,141 +1,842 @@
 # collaborative_filtering.py
 import json
+import os
+import re
+import shutil
+import sys
+import threading
 import numpy as np
+from datetime import datetime, timezone
 from collections import defaultdict
-from scipy.sparse import csr_matrix
-from sklearn.metrics.pairwise import cosine_similarity
+from scipy.sparse import csr_matrix, vstack
+from interaction_store import InteractionLog
+import metrics
+from model_precision import (compact_interactions, dequantize_rows, quantize_similarity,
+                             SIMILARITY_PRECISIONS)
+from vocabulary import Vocabulary
+from delta_matrix import DeltaMatrix, add_csr
+
+SNAPSHOT_FORMAT_VERSION = 1
+
+# Versioned snapshot directories kept per path: the live one and the previous
+# one, which processes that resolved the link just before a swap may still be loading
+SNAPSHOTS_KEPT = 2
+
+def _snapshot_versions(path):
+    """Versioned snapshot directories written by save() for path, oldest first"""
+    parent, name = os.path.split(os.path.abspath(path))
+    return sorted(
+        os.path.join(parent, entry) for entry in os.listdir(parent)
+        if entry.startswith(f'{name}.') and re.fullmatch(r'\d{8}T\d{12}Z', entry[len(name) + 1:])
+    )
+
+def _link_snapshot(path, version_path):
+    """
+    Point path at the finished snapshot directory version_path in one atomic step
+    
+    The symlink is created next to path and moved over it with os.replace,
+    so path always names a complete snapshot. Versions beyond SNAPSHOTS_KEPT
+    are removed afterwards.
+    """
+    link_path = f"{path}.link-{os.getpid()}"
+    if os.path.lexists(link_path):
+        os.remove(link_path)
+    os.symlink(os.path.basename(version_path), link_path)
+    legacy_path = None
+    if os.path.isdir(path) and not os.path.islink(path):
+        # A plain snapshot directory from before versioned snapshots; moved aside once
+        legacy_path = f"{path}.old-{os.getpid()}"
+        os.rename(path, legacy_path)
+    os.replace(link_path, path)
+    
+    if legacy_path:
+        shutil.rmtree(legacy_path, ignore_errors=True)
+    for old_path in _snapshot_versions(path)[:-SNAPSHOTS_KEPT]:
+        if old_path != version_path:
+            shutil.rmtree(old_path, ignore_errors=True)
+
+def _sorted_contains(sorted_values, values):
+    """Whether each of values is in the sorted array sorted_values"""
+    values = np.asarray(values)
+    if not len(sorted_values):
+        return np.zeros(len(values), dtype=bool)
+    pos = np.minimum(np.searchsorted(sorted_values, values), len(sorted_values) - 1)
+    return sorted_values[pos] == values
+
+def _rank_rows(row_ids, cols, data, n_rows, top_k=None):
+    """Order COO entries by row then descending value, keeping top_k per row"""
+    order = np.lexsort((-data, row_ids))
+    row_ids, cols, data = row_ids[order], cols[order], data[order]
+    
+    if top_k is not None:
+        row_starts = np.searchsorted(row_ids, np.arange(n_rows))
+        rank = np.arange(len(row_ids)) - row_starts[row_ids]
+        keep = rank < top_k
+        row_ids, cols, data = row_ids[keep], cols[keep], data[keep]
+    
+    return row_ids, cols, data
+
+def _top_k_rows(matrix, top_k=None, min_similarity=0.0, row_items=None):
+    """
+    Prune each row of a CSR block to its top_k entries above min_similarity
+    
+    row_items gives the item index of every row, so self-similarity can be dropped.
+    """
+    matrix = matrix.tocsr()
+    n_rows = matrix.shape[0]
+    row_ids = np.repeat(np.arange(n_rows), np.diff(matrix.indptr))
+    cols = matrix.indices
+    data = matrix.data
+    
+    # Drop self-similarity and anything below the threshold
+    keep = (data > 0) & (data >= min_similarity)
+    if row_items is not None:
+        keep &= cols != row_items[row_ids]
+    row_ids, cols, data = _rank_rows(row_ids[keep], cols[keep], data[keep], n_rows, top_k)
+    
+    return csr_matrix((data, (row_ids, cols)), shape=matrix.shape)
+
+def _similarity_block(item_user_matrix, item_norms, rows, top_k=None, min_similarity=0.0,
+                      user_item_matrix=None):
+    """
+    Cosine similarities of the given item rows against all items, pruned to top_k
+    
+    user_item_matrix is the transpose of item_user_matrix in CSR form; pass
+    it when computing many blocks so it is not rebuilt for each one.
+    """
+    if user_item_matrix is None:
+        user_item_matrix = item_user_matrix.T.tocsr()
+    return _cosine_rows(item_user_matrix[rows], user_item_matrix, item_norms, rows, top_k, min_similarity)
+
+def _cosine_rows(block, user_item_matrix, item_norms, rows, top_k=None, min_similarity=0.0, cols=None):
+    """
+    Cosine similarities of items from their item-user rows in block, pruned to top_k
+    
+    rows gives the item index of every block row; user_item_matrix only needs
+    the users of block's columns, in the same order. cols, when given, is the
+    item index of every column of user_item_matrix, so it can hold just the
+    items those users reach.
+    """
+    dots = (block @ user_item_matrix).tocsr()
+    if cols is not None:
+        dots = csr_matrix((dots.data, cols[dots.indices], dots.indptr), shape=(len(rows), len(item_norms)))
+    
+    # Normalise the raw dot products into cosine similarities
+    row_ids = np.repeat(np.arange(len(rows)), np.diff(dots.indptr))
+    denom = item_norms[rows][row_ids] * item_norms[dots.indices]
+    dots.data = np.divide(dots.data, denom, out=np.zeros_like(dots.data, dtype=float), where=denom > 0)
+    
+    return _top_k_rows(dots, top_k, min_similarity, row_items=rows)
+
+def _new_model_version():
+    return datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%S%fZ')
+
+def _top_n(indices, scores, n):
+    """Select the n highest scores with a partial sort, best first"""
+    if n <= 0:
+        return indices[:0], scores[:0]
+    
+    if len(scores) > n:
+        part = np.argpartition(-scores, n - 1)[:n]
+        indices, scores = indices[part], scores[part]
+    
+    order = np.argsort(-scores, kind='stable')
+    return indices[order], scores[order]
+
+def _allowed_items(allowed, item_idx):
+    """Whether each item index passes a filter mask; items newer than the mask never do"""
+    if allowed is None:
+        return np.ones(len(item_idx), dtype=bool)
+    inside = item_idx < len(allowed)
+    return inside & allowed[np.where(inside, item_idx, 0)]
 
 class CollaborativeFilteringRecommender:
-    def __init__(self, interactions_file='interactions.json'):
-        self.interactions = self._load_interactions(interactions_file)
-        self.user_item_matrix = None
-        self.item_similarity = None
-        self.user_to_idx = {}
-        self.idx_to_user = {}
-        self.item_to_idx = {}
-        self.idx_to_item = {}
+    def __init__(self, interactions_file='interactions.json', similarity_precision='float64',
+                 compact=False):
+        if similarity_precision not in SIMILARITY_PRECISIONS:
+            raise ValueError(f"Unknown similarity precision: {similarity_precision}")
         
+        self.interactions = self._load_interactions(interactions_file) if interactions_file else None
+        self.model_version = None
+        # The user-item matrix and neighbor index as DeltaMatrix objects, so online
+        # updates replace rows instead of copying them; the neighbor index carries
+        # the per-row scale of 8-bit codes
+        self._user_item = None
+        self._similarity = None
+        self.item_norms = None
+        # Growable buffer the item norms are a view of once online updates start
+        self._norms_buffer = None
+        # Storage precision of the neighbor index (see model_precision), and
+        # whether interaction weights use the narrowest int type
+        self.similarity_precision = similarity_precision
+        self.compact = compact
+        self.users = Vocabulary()
+        self.items = Vocabulary()
+        self.similarity_params = {}
+        # Users whose rows and items whose neighbor rows online updates have
+        # changed since the model was built or loaded, as sorted index arrays
+        self.updated_users = np.empty(0, dtype=np.int64)
+        self.updated_items = np.empty(0, dtype=np.int64)
+        self._popularity = (None, None)
+        self._item_user = (None, None)
+        # Serialises online updates, and guards swapping the matrices they produce
+        self._update_lock = threading.Lock()
+        self._swap_lock = threading.Lock()
+    
+    @property
+    def item_ids(self):
+        """Product id of every item index"""
+        return self.items.ids
+    
+    @property
+    def user_item_matrix(self):
+        """The user-item matrix as one CSR matrix, online updates merged in"""
+        return self._user_item.tocsr() if self._user_item is not None else None
+    
+    @property
+    def item_similarity(self):
+        """The neighbor index as one CSR matrix, online updates merged in"""
+        return self._similarity.tocsr() if self._similarity is not None else None
+    
+    @property
+    def similarity_scale(self):
+        """Per-row scale of 8-bit neighbor codes, None at other precisions"""
+        return self._similarity.merged()[1] if self._similarity is not None else None
+    
     def _load_interactions(self, filename):
-        """Load interaction data"""
-        with open(filename, 'r') as f:
-            return json.load(f)
+        """Load interaction data (JSON, JSONL or the compact .npz store), or take a loaded log"""
+        if isinstance(filename, InteractionLog):
+            return filename
+        return InteractionLog.load(filename)
     
     def build_matrix(self):
         """Build user-item interaction matrix"""
         
-        # Create mappings
-        users = list(set(i['user_id'] for i in self.interactions))
-        items = list(set(i['product_id'] for i in self.interactions))
-        
-        self.user_to_idx = {u: idx for idx, u in enumerate(users)}
-        self.idx_to_user = {idx: u for u, idx in self.user_to_idx.items()}
-        self.item_to_idx = {i: idx for idx, i in enumerate(items)}
-        self.idx_to_item = {idx: i for i, idx in self.item_to_idx.items()}
-        
-        # Weight different interaction types
-        interaction_weights = {
-            'view': 1,
-            'click': 2,
-            'add_to_cart': 3,
-            'purchase': 5
-        }
-        
-        # Build matrix
-        rows = []
-        cols = []
-        data = []
+        log = self.interactions
         
-        for interaction in self.interactions:
-            user_idx = self.user_to_idx[interaction['user_id']]
-            item_idx = self.item_to_idx[interaction['product_id']]
-            weight = interaction_weights[interaction['interaction_type']]
-            
-            rows.append(user_idx)
-            cols.append(item_idx)
-            data.append(weight)
+        # Interned codes from the log are the matrix indices
+        self.users = Vocabulary(log.user_ids)
+        self.items = Vocabulary(log.item_ids)
         
-        self.user_item_matrix = csr_matrix(
-            (data, (rows, cols)),
-            shape=(len(users), len(items))
+        # Build matrix, weighting each interaction by its type
+        user_item_matrix = csr_matrix(
+            (log.weights, (log.user_codes, log.item_codes)),
+            shape=(len(self.users), len(self.items))
         )
+        if self.compact:
+            user_item_matrix = compact_interactions(user_item_matrix)
+        self._user_item = DeltaMatrix(user_item_matrix)
         
-        print(f"Built matrix: {len(users)} users × {len(items)} items")
+        print(f"Built matrix: {len(self.users)} users × {len(self.items)} items")
         
         return self
     
-    def compute_item_similarity(self):
-        """Compute item-item similarity matrix"""
+    def compute_item_similarity(self, top_k=100, min_similarity=0.0, block_size=1000, workers=1,
+                                work_dir=None):
+        """
+        Compute the item-item neighbor index
+        
+        Each row keeps only the top_k most similar items (all of them when
+        top_k is None) with similarity >= min_similarity. Rows are computed
+        in blocks of block_size items so peak memory is bounded by the block,
+        not by n_items². With workers > 1 (or None for one per core) the
+        blocks are built out of core in a process pool, see similarity_build.
+        """
         print("Computing item-item similarity...")
         
         # Transpose to get item-user matrix
-        item_user_matrix = self.user_item_matrix.T
+        item_user_matrix = self.user_item_matrix.T.tocsr().astype(float)
+        n_items = item_user_matrix.shape[0]
+        
+        self.item_norms = np.sqrt(np.asarray(item_user_matrix.multiply(item_user_matrix).sum(axis=1)).ravel())
+        
+        workers = workers or os.cpu_count()
+        if workers > 1 and n_items:
+            # Imported here: similarity_build uses this module's block helpers
+            from similarity_build import build_item_similarity
+            item_similarity = build_item_similarity(item_user_matrix, self.item_norms, top_k,
+                                                    min_similarity, block_size, workers, work_dir)
+        else:
+            # Compute cosine similarity block by block, pruning as we go
+            user_item_matrix = item_user_matrix.T.tocsr()
+            blocks = []
+            for start in range(0, n_items, block_size):
+                stop = min(start + block_size, n_items)
+                blocks.append(_similarity_block(item_user_matrix, self.item_norms, np.arange(start, stop),
+                                                top_k, min_similarity, user_item_matrix))
+            
+            item_similarity = vstack(blocks, format='csr') if blocks else csr_matrix((n_items, n_items))
+        
+        row_scale = None
+        if self.similarity_precision != 'float64':
+            item_similarity, row_scale = quantize_similarity(item_similarity, self.similarity_precision)
+        self._similarity = DeltaMatrix(item_similarity, row_scale)
+        self.similarity_params = {'top_k': top_k, 'min_similarity': min_similarity}
+        self.updated_users = self.updated_items = np.empty(0, dtype=np.int64)
         
-        # Compute cosine similarity
-        self.item_similarity = cosine_similarity(item_user_matrix, dense_output=False)
+        self.model_version = _new_model_version()
         
-        print("Item similarity computed")
+        print(f"Item similarity computed: {item_similarity.nnz} neighbor pairs")
         return self
     
-    def recommend_for_user(self, user_id, num_recommendations=10):
-        """Recommend items for a user based on their history"""
+    def add_interactions(self, events):
+        """
+        Fold new interaction events into the model without a full rebuild
+        
+        New users and items are appended to the vocabularies, the rows of the
+        touched users and the item norms are updated, and only the neighbor
+        rows of items that co-occur with the updated users are recomputed.
+        Stored similarities to items whose norm changed are rescaled in the
+        rows that hold them, so their values stay exact; their top-K
+        membership is refreshed at the next full rebuild. Changed rows go
+        into the DeltaMatrix objects and the norms are written in place into
+        a growable buffer, so the work follows the size of the update rather
+        than the model.
+        """
+        with self._update_lock, metrics.stage('collaborative', 'incremental_update'):
+            log = InteractionLog.from_records(events)
+            if not len(log):
+                return self
+            
+            # Grow the vocabularies (new ids only become visible after the swap below)
+            users = self.users.extend(log.user_ids)
+            items = self.items.extend(log.item_ids)
+            
+            user_idx = users.lookup(log.user_ids)[log.user_codes]
+            item_idx = items.lookup(log.item_ids)[log.item_codes]
+            n_users, n_items = len(users), len(items)
+            new_users, new_items = n_users - len(self.users), n_items - len(self.items)
+            
+            user_item, similarity = self._model_matrices()
+            user_item = user_item.resize((n_users, n_items))
+            item_user = self._item_user_matrix().resize((n_items, n_users))
+            
+            # Add the events to the rows of the touched users only
+            touched_users, local_users = np.unique(user_idx, return_inverse=True)
+            delta = csr_matrix((log.weights, (local_users, item_idx)), shape=(len(touched_users), n_items))
+            old_rows, _ = user_item.take(touched_users)
+            new_rows = add_csr(old_rows, delta)
+            dtype = compact_interactions(new_rows).dtype if self.compact else new_rows.dtype
+            new_rows = new_rows.astype(np.result_type(user_item.dtype, dtype))
+            user_item = user_item.replace(touched_users, new_rows)
+            
+            # Same for the item-user copy, in the rows of the items that got events
+            touched_items, local_items = np.unique(item_idx, return_inverse=True)
+            item_delta = csr_matrix((log.weights, (local_items, user_idx)), shape=(len(touched_items), n_users))
+            item_rows, _ = item_user.take(touched_items)
+            item_user = item_user.replace(touched_items, add_csr(item_rows, item_delta).astype(float))
+            
+            # Item norms only change in the columns of the touched users' rows
+            norm_items, inverse = np.unique(np.concatenate([new_rows.indices, old_rows.indices]),
+                                            return_inverse=True)
+            split = len(new_rows.indices)
+            sq_delta = (np.bincount(inverse[:split], weights=new_rows.data.astype(float) ** 2,
+                                    minlength=len(norm_items))
+                        - np.bincount(inverse[split:], weights=old_rows.data.astype(float) ** 2,
+                                      minlength=len(norm_items)))
+            old_count = len(self.item_norms)
+            old_norms = np.zeros(len(norm_items))
+            existing = norm_items < old_count
+            old_norms[existing] = self.item_norms[norm_items[existing]]
+            norms = np.sqrt(old_norms ** 2 + sq_delta)
+            ratio = np.divide(old_norms, norms, out=np.ones_like(norms), where=norms > 0)
+            changed, changed_ratio = norm_items[ratio != 1], ratio[ratio != 1]
+            
+            item_norms = self._grow_norms(n_items)
+            previous = item_norms[norm_items]
+            item_norms[norm_items] = norms
+            try:
+                # Recompute the rows of every item that co-occurs with a touched user,
+                # from the item-user rows of those items and the user rows they reach
+                top_k = self.similarity_params.get('top_k')
+                min_similarity = self.similarity_params.get('min_similarity', 0.0)
+                affected = np.unique(new_rows.indices)
+                block, _ = item_user.take(affected)
+                block_users = np.unique(block.indices)
+                block = csr_matrix((block.data, np.searchsorted(block_users, block.indices), block.indptr),
+                                   shape=(len(affected), len(block_users)))
+                user_rows, _ = user_item.take(block_users)
+                reached = np.unique(user_rows.indices)
+                user_rows = csr_matrix((user_rows.data.astype(float), np.searchsorted(reached, user_rows.indices),
+                                        user_rows.indptr), shape=(len(block_users), len(reached)))
+                fresh = _cosine_rows(block, user_rows, item_norms, affected, top_k, min_similarity, cols=reached)
+                
+                # Similarities to an item whose norm changed can only be stored in the
+                # rows of items that share a user with it; rescale the rows that have one
+                similarity = similarity.resize((n_items, n_items))
+                changed_users = np.unique(item_user.take(changed)[0].indices)
+                candidates = np.setdiff1d(np.unique(user_item.take(changed_users)[0].indices), affected,
+                                          assume_unique=True)
+                rescaled = dequantize_rows(*similarity.take(candidates)).astype(float)
+                hit_nonzeros = np.isin(rescaled.indices, changed)
+                rescaled.data[hit_nonzeros] *= changed_ratio[np.searchsorted(changed, rescaled.indices[hit_nonzeros])]
+                row_ids = np.repeat(np.arange(len(candidates)), np.diff(rescaled.indptr))
+                hit = np.unique(row_ids[hit_nonzeros])
+                
+                # Replace the recomputed and rescaled rows, stored at the model's precision
+                rows = np.concatenate([affected, candidates[hit]])
+                order = np.argsort(rows)
+                block = vstack([fresh, rescaled[hit]], format='csr')[order]
+                block_scale = None
+                if self.similarity_precision != 'float64':
+                    block, block_scale = quantize_similarity(block, self.similarity_precision)
+                similarity = similarity.replace(rows[order], block, block_scale)
+            except BaseException:
+                item_norms[norm_items] = previous
+                raise
+            
+            # Readers look ids up before taking the lock for the matrices, and
+            # translate results after, so both see a consistent model
+            updated_users = np.union1d(self.updated_users, touched_users)
+            updated_items = np.union1d(self.updated_items, rows)
+            with self._swap_lock:
+                self.users = users
+                self.items = items
+                self._user_item = user_item
+                self._similarity = similarity
+                self.item_norms = item_norms
+                self.updated_users = updated_users
+                self.updated_items = updated_items
+                self.model_version = _new_model_version()
+            self._item_user = (user_item, item_user)
+            
+            print(f"Added {len(log)} interactions: {new_users} new users, "
+                  f"{new_items} new items, {len(affected)} neighbor rows updated")
+            return self
+    
+    def _grow_norms(self, n_items):
+        """
+        The item norms as a writable view of n_items entries, new items at 0
+        
+        The norms are copied into a buffer with spare room on the first
+        update after a rebuild or load, and again only when it fills up, so
+        updates write them in place at amortised constant cost per item.
+        Only updates (under the update lock) and save() read the norms.
+        """
+        buffer, size = self._norms_buffer, len(self.item_norms)
+        if buffer is None or self.item_norms.base is not buffer or n_items > len(buffer):
+            buffer = np.empty(max(2 * n_items, 1024))
+            buffer[:size] = self.item_norms
+            self._norms_buffer = buffer
+        buffer[size:n_items] = 0
+        return buffer[:n_items]
+    
+    def _item_user_matrix(self):
+        """
+        Float item-user copy of the user-item matrix for online updates
+        
+        Built by the first update after a rebuild, load or quantize, then
+        kept in step by add_interactions, so later updates never transpose
+        the whole matrix.
+        """
+        user_item, item_user = self._item_user
+        if user_item is not self._user_item:
+            item_user = DeltaMatrix(self.user_item_matrix.T.tocsr().astype(float))
+            self._item_user = (self._user_item, item_user)
+        return item_user
+    
+    def _model_matrices(self):
+        """The user-item matrix and neighbor index DeltaMatrix objects as one consistent pair"""
+        with self._swap_lock:
+            return self._user_item, self._similarity
+    
+    def user_updated(self, user_id):
+        """
+        Whether online updates changed a user's scores since the model was built or loaded
+        
+        That is the case when the user got events or when the neighbor row
+        of an item in the user's history was recomputed or rescaled.
+        """
+        user_idx = self.users.index(user_id)
+        if user_idx is None:
+            return False
+        with self._swap_lock:
+            user_item, updated_users, updated_items = self._user_item, self.updated_users, self.updated_items
+        if _sorted_contains(updated_users, [user_idx])[0]:
+            return True
+        return bool(_sorted_contains(updated_items, user_item.take([user_idx])[0].indices).any())
+    
+    def item_updated(self, product_id):
+        """Whether online updates changed an item's neighbor row since the model was built or loaded"""
+        item_idx = self.items.index(product_id)
+        return item_idx is not None and bool(_sorted_contains(self.updated_items, [item_idx])[0])
+    
+    def user_rows(self, user_idx):
+        """Interaction rows of an array of user indices as a CSR matrix, without merging online updates"""
+        user_item, _ = self._model_matrices()
+        return user_item.take(user_idx)[0]
+    
+    def _full_similarity(self):
+        """The neighbor index as float64 values, whatever its storage precision"""
+        _, similarity = self._model_matrices()
+        return dequantize_rows(*similarity.merged()).astype(float)
+    
+    @property
+    def similarity_nbytes(self):
+        """Bytes held by the neighbor index and its row scales"""
+        return self._similarity.nbytes
+    
+    def quantize(self, similarity_precision='float32', compact=True):
+        """
+        Convert the model to a storage precision, see model_precision
         
-        if user_id not in self.user_to_idx:
-            return []
+        The neighbor index is re-stored from its float64 values at
+        similarity_precision, and with compact the interaction weights
+        take the narrowest integer type that holds them. Scores computed
+        from a reduced-precision index are close to, but not exactly, the
+        full-precision ones; model_precision reports the top-N agreement.
+        The converted model gets a new model_version, so it is saved as a
+        snapshot of its own and caches keyed on the version start over.
+        """
+        if similarity_precision not in SIMILARITY_PRECISIONS:
+            raise ValueError(f"Unknown similarity precision: {similarity_precision}")
         
-        user_idx = self.user_to_idx[user_id]
+        with self._update_lock:
+            similarity = DeltaMatrix(*quantize_similarity(self._full_similarity(), similarity_precision))
+            user_item = DeltaMatrix(compact_interactions(self.user_item_matrix)) if compact else self._user_item
+            with self._swap_lock:
+                self._similarity = similarity
+                self._user_item = user_item
+                self.similarity_precision = similarity_precision
+                self.compact = compact
+                self.model_version = _new_model_version()
+        return self
+    
+    def save(self, path):
+        """
+        Write a model snapshot to the directory at path
         
-        # Get user's interactions
-        user_interactions = self.user_item_matrix[user_idx].toarray().flatten()
+        Every array goes into its own .npy file so load() can memory-map it.
+        The snapshot is written to a directory named after the model version
+        next to path, and path is a symlink switched to it with one atomic
+        os.replace, so path always names a complete snapshot, even if the
+        process dies mid-save. Older versions beyond SNAPSHOTS_KEPT are removed.
+        Online updates are held off while the arrays are written.
+        """
+        with self._update_lock:
+            return self._save(path)
+    
+    def _save(self, path):
+        user_item, similarity = self._model_matrices()
+        user_item_matrix = user_item.tocsr()
+        item_similarity, row_scale = similarity.merged()
+        arrays = {
+            'user_ids': self.users.ids,
+            'item_ids': self.items.ids,
+            'item_norms': self.item_norms,
+        }
+        if row_scale is not None:
+            arrays['similarity_scale'] = row_scale
+        for name, matrix in (('user_item', user_item_matrix), ('item_similarity', item_similarity)):
+            arrays[f'{name}_data'] = matrix.data
+            arrays[f'{name}_indices'] = matrix.indices
+            arrays[f'{name}_indptr'] = matrix.indptr
         
-        # Get items user hasn't interacted with
-        interacted_items = set(np.where(user_interactions > 0)[0])
+        manifest = {
+            'format_version': SNAPSHOT_FORMAT_VERSION,
+            'model_version': self.model_version,
+            'user_item_shape': list(user_item_matrix.shape),
+            'item_similarity_shape': list(item_similarity.shape),
+            'similarity_params': self.similarity_params,
+            'similarity_precision': self.similarity_precision,
+            'compact': self.compact,
+            'arrays': sorted(arrays)
+        }
         
-        # Compute scores for all items
-        scores = self.item_similarity.T.dot(user_interactions)
+        path = path.rstrip(os.sep)
+        version_path = f"{path}.{self.model_version}"
+        if not os.path.exists(version_path):
+            tmp_path = f"{version_path}.tmp-{os.getpid()}"
+            shutil.rmtree(tmp_path, ignore_errors=True)
+            os.makedirs(tmp_path)
+            for name, array in arrays.items():
+                np.save(os.path.join(tmp_path, f'{name}.npy'), array)
+            with open(os.path.join(tmp_path, 'manifest.json'), 'w') as f:
+                json.dump(manifest, f, indent=2)
+            os.rename(tmp_path, version_path)
+        _link_snapshot(path, version_path)
         
-        # Get top recommendations (excluding already interacted)
-        recommendations = []
-        for item_idx in np.argsort(scores)[::-1]:
-            if item_idx not in interacted_items:
-                recommendations.append({
-                    'product_id': self.idx_to_item[item_idx],
-                    'score': scores[item_idx]
-                })
-            
-            if len(recommendations) >= num_recommendations:
+        print(f"Saved model {self.model_version} to {path}")
+        return self
+    
+    @classmethod
+    def load(cls, path, mmap=True):
+        """
+        Load a model snapshot written by save()
+        
+        With mmap=True the arrays are memory-mapped read-only, so worker
+        processes on one host share the same physical pages.
+        """
+        # Resolve the link once, so a save() swapping it mid-load cannot mix versions
+        path = os.path.realpath(path)
+        with open(os.path.join(path, 'manifest.json'), 'r') as f:
+            manifest = json.load(f)
+        
+        if manifest['format_version'] != SNAPSHOT_FORMAT_VERSION:
+            raise ValueError(f"Unsupported snapshot format {manifest['format_version']}")
+        
+        mmap_mode = 'r' if mmap else None
+        arrays = {
+            name: np.load(os.path.join(path, f'{name}.npy'), mmap_mode=mmap_mode)
+            for name in manifest['arrays']
+        }
+        
+        def matrix(name):
+            return csr_matrix(
+                (arrays[f'{name}_data'], arrays[f'{name}_indices'], arrays[f'{name}_indptr']),
+                shape=tuple(manifest[f'{name}_shape']),
+                copy=False
+            )
+        
+        model = cls(interactions_file=None,
+                    similarity_precision=manifest.get('similarity_precision', 'float64'),
+                    compact=manifest.get('compact', False))
+        model.users = Vocabulary(arrays['user_ids'])
+        model.items = Vocabulary(arrays['item_ids'])
+        model._user_item = DeltaMatrix(matrix('user_item'))
+        model._similarity = DeltaMatrix(matrix('item_similarity'), arrays.get('similarity_scale'))
+        model.item_norms = arrays['item_norms']
+        model.similarity_params = manifest.get('similarity_params', {})
+        model.model_version = manifest['model_version']
+        
+        return model
+    
+    def top_n_for_user(self, user_id, num_recommendations=10, allowed=None):
+        """
+        Top-N unseen items for a user as (product_ids, scores) arrays
+        
+        allowed is an optional boolean mask over item indices (see
+        item_filters); excluded items are dropped before selection.
+        """
+        
+        user_idx = self.users.index(user_id)
+        if user_idx is None:
+            return np.array([], dtype=str), np.array([])
+        
+        with metrics.stage('collaborative', 'user_scoring'):
+            item_idx, scores = self._score_user(user_idx, num_recommendations, allowed)
+        return self.item_ids[item_idx], scores
+    
+    def top_n_similar_items(self, product_id, num_recommendations=10, allowed=None):
+        """Top-N neighbors of an item as (product_ids, similarities) arrays, optionally filtered by allowed"""
+        
+        item_idx = self.items.index(product_id)
+        if item_idx is None:
+            return np.array([], dtype=str), np.array([])
+        
+        # The neighbor row is already pruned, so only its nonzeros are candidates
+        with metrics.stage('collaborative', 'similar_items'):
+            _, similarity = self._model_matrices()
+            row, row_scale = similarity.take([item_idx])
+            data = row.data if row_scale is None else row.data * row_scale[0]
+            keep = _allowed_items(allowed, row.indices)
+            neighbors, scores = _top_n(row.indices[keep], data[keep], num_recommendations)
+            if allowed is not None:
+                neighbors, scores = self._backfill(neighbors, scores, num_recommendations, allowed,
+                                                   exclude=[item_idx])
+        return self.item_ids[neighbors], scores
+    
+    def _score_user(self, user_idx, num_recommendations, allowed=None):
+        """Score candidate items for one user and select the top N"""
+        
+        # Only items that neighbor the user's history get a nonzero score
+        user_item, similarity = self._model_matrices()
+        user_row, _ = user_item.take([user_idx])
+        rows, row_scale = similarity.take(user_row.indices)
+        weights = user_row.data.astype(float)
+        if row_scale is not None:
+            # 8-bit codes: fold each neighbor row's scale into its weight
+            weights = weights * row_scale
+        
+        # Sum the neighbor rows of the user's items by column; a 1 x N sparse
+        # product would allocate and scan an N-wide mask on every call
+        contributions = rows.data * np.repeat(weights, np.diff(rows.indptr))
+        candidates, inverse = np.unique(rows.indices, return_inverse=True)
+        scores = np.bincount(inverse, weights=contributions, minlength=len(candidates))
+        
+        # Exclusion mask straight from the user's CSR row, plus the filter
+        keep = ~np.isin(candidates, user_row.indices, assume_unique=True)
+        keep &= _allowed_items(allowed, candidates)
+        item_idx, top_scores = _top_n(candidates[keep], scores[keep], num_recommendations)
+        if allowed is not None:
+            item_idx, top_scores = self._backfill(item_idx, top_scores, num_recommendations, allowed,
+                                                  exclude=user_row.indices)
+        return item_idx, top_scores
+    
+    def _popular_order(self):
+        """Item indices by total interaction weight, most popular first"""
+        user_item, _ = self._model_matrices()
+        matrix, order = self._popularity
+        if matrix is not user_item:
+            order = np.argsort(-user_item.column_sums(), kind='stable')
+            self._popularity = (user_item, order)
+        return order
+    
+    def _backfill(self, item_idx, scores, num_recommendations, allowed, exclude=()):
+        """
+        Pad a filtered page that came up short with the most popular allowed items
+        
+        Filters can leave fewer scored candidates than requested; the padding
+        items score 0 and never repeat a result or an excluded item.
+        """
+        missing = num_recommendations - len(item_idx)
+        if missing <= 0:
+            return item_idx, scores
+        
+        order = self._popular_order()
+        taken = np.concatenate([item_idx, np.asarray(exclude, dtype=item_idx.dtype)])
+        chunk_size = max(4 * num_recommendations, 1024)
+        fill = []
+        for start in range(0, len(order), chunk_size):
+            chunk = order[start:start + chunk_size]
+            chunk = chunk[_allowed_items(allowed, chunk) & ~np.isin(chunk, taken)][:missing]
+            fill.append(chunk)
+            missing -= len(chunk)
+            if not missing:
                 break
         
-        return recommendations
+        fill = np.concatenate(fill) if fill else item_idx[:0]
+        return np.concatenate([item_idx, fill]), np.concatenate([scores, np.zeros(len(fill))])
     
-    def recommend_similar_items(self, product_id, num_recommendations=10):
-        """Find similar items based on collaborative filtering"""
+    def iter_top_n_for_users(self, user_ids, num_recommendations=10, block_size=1000):
+        """
+        Yield (user_id, product_ids, scores) for many users
         
-        if product_id not in self.item_to_idx:
-            return []
+        Users are scored block_size at a time with one sparse-sparse multiply
+        per block, so peak memory is bounded by the block's candidate set.
+        Unknown users yield empty arrays.
+        """
+        user_ids = list(user_ids)
         
-        item_idx = self.item_to_idx[product_id]
+        for start in range(0, len(user_ids), block_size):
+            block_ids = user_ids[start:start + block_size]
+            block_idx = self.users.lookup(block_ids)
+            known = (block_idx >= 0).tolist()
+            user_idx = block_idx[block_idx >= 0]
+            
+            with metrics.stage('collaborative', 'batch_scoring'):
+                row_ids, item_idx, scores = self._score_users(user_idx, num_recommendations)
+            bounds = np.searchsorted(row_ids, np.arange(len(user_idx) + 1))
+            
+            row = 0
+            for user_id, is_known in zip(block_ids, known):
+                if not is_known:
+                    yield user_id, np.array([], dtype=str), np.array([])
+                    continue
+                lo, hi = bounds[row], bounds[row + 1]
+                row += 1
+                yield user_id, self.item_ids[item_idx[lo:hi]], scores[lo:hi]
+    
+    def iter_top_n_similar_items(self, product_ids, num_recommendations=10, block_size=1000):
+        """
+        Yield (product_id, product_ids, similarities) for many items
         
-        # Get similarity scores for this item
-        similarity_scores = self.item_similarity[item_idx].toarray().flatten()
+        Neighbor rows are sliced and ranked block_size items at a time.
+        Unknown items yield empty arrays.
+        """
+        product_ids = list(product_ids)
         
-        # Get top similar items (excluding itself)
-        recommendations = []
-        for similar_idx in np.argsort(similarity_scores)[::-1][1:]:  # Skip first (itself)
-            recommendations.append({
-                'product_id': self.idx_to_item[similar_idx],
-                'similarity': similarity_scores[similar_idx]
-            })
+        for start in range(0, len(product_ids), block_size):
+            block_ids = product_ids[start:start + block_size]
+            block_idx = self.items.lookup(block_ids)
+            known = (block_idx >= 0).tolist()
+            item_idx = block_idx[block_idx >= 0]
             
-            if len(recommendations) >= num_recommendations:
-                break
+            with metrics.stage('collaborative', 'batch_similar_items'):
+                _, similarity = self._model_matrices()
+                rows = dequantize_rows(*similarity.take(item_idx))
+                row_ids = np.repeat(np.arange(len(item_idx)), np.diff(rows.indptr))
+                row_ids, neighbors, scores = _rank_rows(row_ids, rows.indices, rows.data,
+                                                        len(item_idx), num_recommendations)
+            bounds = np.searchsorted(row_ids, np.arange(len(item_idx) + 1))
+            
+            row = 0
+            for product_id, is_known in zip(block_ids, known):
+                if not is_known:
+                    yield product_id, np.array([], dtype=str), np.array([])
+                    continue
+                lo, hi = bounds[row], bounds[row + 1]
+                row += 1
+                yield product_id, self.item_ids[neighbors[lo:hi]], scores[lo:hi]
+    
+    def recommend_for_users(self, user_ids, num_recommendations=10, block_size=1000):
+        """Recommend items for many users at once, keyed by user id"""
+        
+        return {
+            user_id: [
+                {'product_id': pid, 'score': float(score)}
+                for pid, score in zip(product_ids.tolist(), scores)
+            ]
+            for user_id, product_ids, scores in self.iter_top_n_for_users(
+                user_ids, num_recommendations, block_size)
+        }
+    
+    def score_users(self, user_idx, num_recommendations=10):
+        """
+        Top-N item indices and scores for an array of user indices, as (users, N) arrays
+        
+        Rows with fewer than N scored items are padded with index -1 and
+        score -inf. Users are scored in one block, see iter_top_n_for_users.
+        """
+        row_ids, item_idx, scores = self._score_users(user_idx, num_recommendations)
+        rank = np.arange(len(row_ids)) - np.searchsorted(row_ids, row_ids)
+        top_idx = np.full((len(user_idx), num_recommendations), -1, dtype=np.int64)
+        top_scores = np.full((len(user_idx), num_recommendations), -np.inf)
+        top_idx[row_ids, rank] = item_idx
+        top_scores[row_ids, rank] = scores
+        return top_idx, top_scores
+    
+    def _score_users(self, user_idx, num_recommendations):
+        """Score a block of users and select the top N per row"""
+        
+        user_item, similarity = self._model_matrices()
+        user_rows, _ = user_item.take(user_idx)
+        # Only the neighbor rows of items in the block's histories take part
+        # (8-bit codes are dequantized for just those rows)
+        touched, local = np.unique(user_rows.indices, return_inverse=True)
+        rows = dequantize_rows(*similarity.take(touched))
+        history = csr_matrix((user_rows.data.astype(rows.dtype), local, user_rows.indptr),
+                             shape=(len(user_idx), len(touched)))
+        scores = (history @ rows).tocsr()
+        
+        # Mask everything each user has already seen in one sparse operation
+        seen = user_rows.copy()
+        seen.data = np.ones_like(seen.data, dtype=scores.dtype)
+        scores = (scores - scores.multiply(seen)).tocsr()
+        scores.eliminate_zeros()
+        
+        row_ids = np.repeat(np.arange(len(user_idx)), np.diff(scores.indptr))
+        return _rank_rows(row_ids, scores.indices, scores.data, len(user_idx), num_recommendations)
+    
+    def recommend_for_user(self, user_id, num_recommendations=10, allowed=None):
+        """Recommend items for a user based on their history"""
+        
+        product_ids, scores = self.top_n_for_user(user_id, num_recommendations, allowed)
         
-        return recommendations
+        return [
+            {'product_id': pid, 'score': float(score)}
+            for pid, score in zip(product_ids.tolist(), scores)
+        ]
+    
+    def recommend_similar_items(self, product_id, num_recommendations=10, allowed=None):
+        """Find similar items based on collaborative filtering"""
+        
+        product_ids, scores = self.top_n_similar_items(product_id, num_recommendations, allowed)
+        
+        return [
+            {'product_id': pid, 'similarity': float(score)}
+            for pid, score in zip(product_ids.tolist(), scores)
+        ]
 
 # Test collaborative filtering
 if __name__ == '__main__':
     cf_recommender = CollaborativeFilteringRecommender()
     cf_recommender.build_matrix()
-    cf_recommender.compute_item_similarity()
+    cf_recommender.compute_item_similarity(workers=None)
+    
+    # Optionally write a snapshot for the API workers to load
+    if len(sys.argv) > 1:
+        cf_recommender.save(sys.argv[1])
     
     # Test user recommendations
     user_id = 'USER00001'
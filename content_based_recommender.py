@@ -1,48 +1,86 @@
 # content_based_recommender.py
-import requests
 import json
+import os
 from collections import defaultdict
+from content_engine import LocalContentEngine
+import metrics
+from solr_client import SOLR_URL, SolrClient
 
-SOLR_URL = "http://localhost:8983/solr/products"
+# Fields returned to API clients for product details
+PRODUCT_FIELDS = [
+    'id', 'title', 'description', 'category', 'brand', 'price', 'rating',
+    'num_reviews', 'popularity_score', 'discount_percent', 'in_stock', 'tags'
+]
 
 class ContentBasedRecommender:
-    def __init__(self, solr_url=SOLR_URL):
+    def __init__(self, solr_url=SOLR_URL, client=None, similarity_source='local',
+                 catalog_file='products_enriched.json', trending_index=None, index_dir=None):
         self.solr_url = solr_url
+        self.client = client or SolrClient(solr_url)
+        
+        # Pre-sorted category/brand rankings; when unset these queries go to Solr
+        self.trending_index = trending_index
+        
+        # Serve similar products from the in-process engine, or from Solr MoreLikeThis;
+        # the engine's index is kept in index_dir (a model snapshot) when given
+        if similarity_source not in ('local', 'solr'):
+            raise ValueError(f"Unknown similarity source: {similarity_source}")
+        self.similarity_source = similarity_source
+        self.content_engine = None
+        if similarity_source == 'local' and catalog_file and os.path.exists(catalog_file):
+            self.content_engine = LocalContentEngine.from_file(catalog_file).build_or_load(index_dir)
     
     def get_product(self, product_id):
         """Get product details"""
-        url = f"{self.solr_url}/select"
         params = {
-            'q': f'id:{product_id}',
-            'wt': 'json'
+            'q': f'id:{product_id}'
         }
-        response = requests.get(url, params=params)
-        docs = response.json()['response']['docs']
+        docs = self.client.search(params)
         return docs[0] if docs else None
     
-    def recommend_similar_products(self, product_id, num_recommendations=10):
-        """Recommend products similar to given product"""
-        
-        # Get source product
-        source_product = self.get_product(product_id)
-        if not source_product:
+    def get_products(self, product_ids, fields=PRODUCT_FIELDS):
+        """Get details for many products in one query, in the given order"""
+        product_ids = list(product_ids)
+        if not product_ids:
             return []
         
-        # Build More Like This query
-        url = f"{self.solr_url}/select"
-        
         params = {
-            'q': f'id:{product_id}',
-            'mlt': 'true',
-            'mlt.fl': 'title,description,category,brand',
-            'mlt.mindf': 1,
-            'mlt.mintf': 1,
-            'rows': num_recommendations,
-            'wt': 'json'
+            'q': '{!terms f=id}' + ','.join(product_ids),
+            'fl': ','.join(fields),
+            'rows': len(product_ids)
         }
+        with metrics.stage('content', 'get_products'):
+            docs = {doc['id']: doc for doc in self.client.search(params)}
+        
+        # Solr returns docs in index order; restore the ranking order
+        return [docs[pid] for pid in product_ids if pid in docs]
+    
+    def recommend_similar_products(self, product_id, num_recommendations=10):
+        """Recommend products similar to given product"""
         
-        response = requests.get(url, params=params)
-        result = response.json()
+        # Answer from memory when the local engine knows the product
+        if self.content_engine and product_id in self.content_engine.vocabulary:
+            with metrics.stage('content', 'local_similar'):
+                return self.content_engine.similar(product_id, num_recommendations, PRODUCT_FIELDS)
+        
+        # Otherwise fall back to Solr MoreLikeThis
+        with metrics.stage('content', 'solr_similar'):
+            # Get source product
+            source_product = self.get_product(product_id)
+            if not source_product:
+                return []
+            
+            # Build More Like This query
+            params = {
+                'q': f'id:{product_id}',
+                'mlt': 'true',
+                'mlt.fl': 'title,description,category,brand',
+                'mlt.mindf': 1,
+                'mlt.mintf': 1,
+                'rows': num_recommendations
+            }
+            
+            result = self.client.select(params)
         
         # Get similar products from MLT response
         similar_products = result.get('moreLikeThis', {}).get(product_id, {}).get('docs', [])
@@ -52,7 +90,8 @@ class ContentBasedRecommender:
     def recommend_by_category(self, category, exclude_id=None, num_recommendations=10):
         """Recommend top products in a category"""
         
-        url = f"{self.solr_url}/select"
+        if self.trending_index:
+            return self.trending_index.top_by_category(category, exclude_id, num_recommendations)
         
         # Build filter query
         fq = f'category:"{category}"'
@@ -63,19 +102,18 @@ class ContentBasedRecommender:
             'q': '*:*',
             'fq': fq,
             'sort': 'popularity_score desc, rating desc',
-            'rows': num_recommendations,
-            'wt': 'json'
+            'rows': num_recommendations
         }
         
-        response = requests.get(url, params=params)
-        docs = response.json()['response']['docs']
+        docs = self.client.search(params)
         
         return docs
     
     def recommend_by_brand(self, brand, exclude_id=None, num_recommendations=10):
         """Recommend products from same brand"""
         
-        url = f"{self.solr_url}/select"
+        if self.trending_index:
+            return self.trending_index.top_by_brand(brand, exclude_id, num_recommendations)
         
         fq = f'brand:"{brand}"'
         if exclude_id:
@@ -85,12 +123,10 @@ class ContentBasedRecommender:
             'q': '*:*',
             'fq': fq,
             'sort': 'popularity_score desc',
-            'rows': num_recommendations,
-            'wt': 'json'
+            'rows': num_recommendations
         }
         
-        response = requests.get(url, params=params)
-        return response.json()['response']['docs']
+        return self.client.search(params)
 
 # Test the recommender
 if __name__ == '__main__':
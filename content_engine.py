@@ -0,0 +1,168 @@
+# content_engine.py
+import hashlib
+import json
+import os
+import shutil
+import numpy as np
+from scipy.sparse import csr_matrix, diags, hstack, vstack
+from sklearn.feature_extraction.text import TfidfVectorizer
+from collaborative_filtering import _similarity_block, _top_n
+from vocabulary import Vocabulary
+
+# Relative weight of each text field in the product representation
+FIELD_WEIGHTS = {
+    'title': 2.0,
+    'description': 1.0,
+    'category': 1.5,
+    'brand': 1.0
+}
+
+CONTENT_INDEX_FORMAT_VERSION = 1
+
+class LocalContentEngine:
+    """
+    In-memory content similarity over the product catalog
+    
+    Each product is a field-weighted TF-IDF vector over the same fields the
+    Solr MoreLikeThis query uses. The top_k content neighbors of every
+    product are precomputed, so a lookup is a slice of one sparse row.
+    The neighbor index can be saved into a model snapshot directory and
+    memory-mapped back from it, keyed on the catalog and parameters.
+    """
+    
+    def __init__(self, products, field_weights=FIELD_WEIGHTS, top_k=50, block_size=1000,
+                 catalog_digest=None):
+        self.products = products
+        self.vocabulary = Vocabulary([p['id'] for p in products])
+        self.field_weights = field_weights
+        self.top_k = top_k
+        self.block_size = block_size
+        # SHA-256 of the catalog the index is built from; keys saved indexes
+        self.catalog_digest = catalog_digest
+        self.neighbors = None
+    
+    @classmethod
+    def from_file(cls, filename='products_enriched.json', **kwargs):
+        with open(filename, 'rb') as f:
+            data = f.read()
+        return cls(json.loads(data), catalog_digest=hashlib.sha256(data).hexdigest(), **kwargs)
+    
+    def index_path(self, directory):
+        """Directory under directory holding the neighbor index of this catalog and these parameters"""
+        if self.catalog_digest is None:
+            self.catalog_digest = hashlib.sha256(json.dumps(self.products, sort_keys=True).encode()).hexdigest()
+        key = json.dumps([self.catalog_digest, self.top_k, self.field_weights], sort_keys=True)
+        return os.path.join(directory, f"content-{hashlib.sha256(key.encode()).hexdigest()[:16]}")
+    
+    def save(self, directory):
+        """
+        Write the neighbor index under directory, usually the versioned model snapshot
+        
+        The index is written to a temporary directory and renamed into
+        place, so a concurrent writer of the same index loses the rename
+        harmlessly and readers only ever see a complete index.
+        """
+        path = self.index_path(directory)
+        tmp_path = f"{path}.tmp-{os.getpid()}"
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        os.makedirs(tmp_path)
+        for part in ('data', 'indices', 'indptr'):
+            np.save(os.path.join(tmp_path, f'neighbors_{part}.npy'), getattr(self.neighbors, part))
+        manifest = {
+            'format_version': CONTENT_INDEX_FORMAT_VERSION,
+            'catalog_digest': self.catalog_digest,
+            'top_k': self.top_k,
+            'field_weights': self.field_weights,
+            'shape': list(self.neighbors.shape)
+        }
+        with open(os.path.join(tmp_path, 'manifest.json'), 'w') as f:
+            json.dump(manifest, f, indent=2)
+        
+        try:
+            os.rename(tmp_path, path)
+        except OSError:
+            if not os.path.exists(path):
+                raise
+            shutil.rmtree(tmp_path, ignore_errors=True)
+        return self
+    
+    def load(self, directory, mmap=True):
+        """Take the neighbor index saved under directory for this catalog, if any; returns whether one was found"""
+        path = self.index_path(directory)
+        try:
+            with open(os.path.join(path, 'manifest.json'), 'r') as f:
+                manifest = json.load(f)
+        except FileNotFoundError:
+            return False
+        
+        if manifest['format_version'] != CONTENT_INDEX_FORMAT_VERSION:
+            raise ValueError(f"Unsupported content index format {manifest['format_version']}")
+        
+        mmap_mode = 'r' if mmap else None
+        parts = [np.load(os.path.join(path, f'neighbors_{part}.npy'), mmap_mode=mmap_mode)
+                 for part in ('data', 'indices', 'indptr')]
+        self.neighbors = csr_matrix(tuple(parts), shape=tuple(manifest['shape']), copy=False)
+        
+        print(f"Loaded content index: {self.neighbors.nnz} neighbor pairs")
+        return True
+    
+    def build_or_load(self, directory=None):
+        """
+        Load the neighbor index saved under directory, or build it and save it there
+        
+        Without a directory the index is simply built. A directory that
+        cannot be written to only costs the rebuild at the next start.
+        """
+        if directory and self.load(directory):
+            return self
+        self.build()
+        if directory:
+            try:
+                self.save(directory)
+            except OSError as e:
+                print(f"Could not save the content index to {directory}: {e}")
+        return self
+    
+    def build(self):
+        """Vectorize the catalog and precompute each product's content neighbors"""
+        print(f"Building content index for {len(self.products)} products...")
+        
+        # One TF-IDF block per field, scaled by the field weight
+        blocks = []
+        for field, weight in self.field_weights.items():
+            vectorizer = TfidfVectorizer()
+            texts = [str(p.get(field, '')) for p in self.products]
+            blocks.append(vectorizer.fit_transform(texts) * weight)
+        
+        vectors = hstack(blocks, format='csr')
+        norms = np.sqrt(np.asarray(vectors.multiply(vectors).sum(axis=1)).ravel())
+        vectors = (diags(np.divide(1.0, norms, out=np.zeros_like(norms), where=norms > 0)) @ vectors).tocsr()
+        
+        # Rows are unit length, so dot products are cosine similarities
+        unit_norms = (norms > 0).astype(float)
+        rows = []
+        for start in range(0, vectors.shape[0], self.block_size):
+            stop = min(start + self.block_size, vectors.shape[0])
+            rows.append(_similarity_block(vectors, unit_norms, np.arange(start, stop), self.top_k))
+        
+        self.neighbors = vstack(rows, format='csr')
+        
+        print(f"Content index built: {self.neighbors.nnz} neighbor pairs")
+        return self
+    
+    def similar(self, product_id, num_recommendations=10, fields=None):
+        """Content neighbors of a product as docs with a 'score', best first"""
+        idx = self.vocabulary.index(product_id)
+        if idx is None:
+            return []
+        
+        row = self.neighbors[idx]
+        neighbor_idx, scores = _top_n(row.indices, row.data, num_recommendations)
+        
+        results = []
+        for i, score in zip(neighbor_idx, scores):
+            product = self.products[i]
+            doc = {k: product[k] for k in fields if k in product} if fields else dict(product)
+            doc['score'] = float(score)
+            results.append(doc)
+        return results
@@ -1,63 +1,171 @@
 # create_interaction_data.py
+import argparse
 import json
-import random
-from datetime import datetime, timedelta
+from datetime import datetime
+import numpy as np
+from create_product_data import id_width, iso_timestamps, write_records
+from interaction_store import INTERACTION_TYPES, InteractionLog, iter_records
 
-# Load products
-with open('products.json', 'r') as f:
-    products = json.load(f)
+# Relative frequency of each interaction type, in INTERACTION_TYPES order
+TYPE_PROBABILITIES = np.array([50, 30, 15, 5]) / 100
 
-product_ids = [p['id'] for p in products]
+# Share of each user's interactions drawn from their preferred categories
+PREFERRED_SHARE = 0.8
 
-def generate_user_interactions(num_users=500, interactions_per_user=20):
-    """Generate realistic user interaction data"""
-    interactions = []
+HISTORY_DAYS = 90
+
+def load_catalog(filename='products.json'):
+    """Product ids and category codes from a JSON or JSONL product file, plus the category names"""
+    product_ids, product_categories = [], []
+    for product in iter_records(filename):
+        product_ids.append(product['id'])
+        product_categories.append(product['category'])
+    
+    categories, category_codes = np.unique(product_categories, return_inverse=True)
+    return np.array(product_ids), category_codes.ravel(), categories
+
+def iter_interaction_chunks(category_codes, num_users=500, interactions_per_user=20,
+                            num_sessions=10000, seed=None, chunk_size=1000000):
+    """
+    Generate realistic user interactions as columnar chunks
     
-    for user_id in range(1, num_users + 1):
+    Each user prefers one to three categories and draws 80% of their
+    interactions uniformly from products in those categories, the rest
+    from the whole catalog. Chunks hold about chunk_size interactions for
+    whole users, as arrays of user and product indices, type codes,
+    session indices and seconds before now (up to 90 days).
+    """
+    rng = np.random.default_rng(seed)
+    num_products = len(category_codes)
+    num_categories = int(category_codes.max()) + 1
+    
+    # Products grouped by category, so a category's products are one slice
+    by_category = np.argsort(category_codes, kind='stable')
+    counts = np.bincount(category_codes, minlength=num_categories)
+    starts = np.cumsum(counts) - counts
+    
+    users_per_chunk = max(chunk_size // interactions_per_user, 1)
+    for first_user in range(0, num_users, users_per_chunk):
+        n_chunk_users = min(users_per_chunk, num_users - first_user)
+        size = n_chunk_users * interactions_per_user
+        
         # Each user has preferences (categories they like)
-        preferred_categories = random.sample(['Electronics', 'Books', 'Clothing', 
-                                              'Home & Kitchen', 'Sports'], 
-                                            k=random.randint(1, 3))
+        num_preferred = rng.integers(1, min(3, num_categories) + 1, n_chunk_users)
+        shuffled = np.argsort(rng.random((n_chunk_users, num_categories)), axis=1)
+        preferred = np.zeros((n_chunk_users, num_categories), dtype=bool)
+        np.put_along_axis(preferred, shuffled,
+                          np.arange(num_categories)[None, :] < num_preferred[:, None], axis=1)
         
-        # Get products in preferred categories
-        preferred_products = [p['id'] for p in products 
-                             if p['category'] in preferred_categories]
+        # Cumulative product counts over preferred categories; a uniform draw
+        # below a user's total picks a category in proportion to its size
+        cumulative = np.cumsum(preferred * counts, axis=1)
+        local_users = np.repeat(np.arange(n_chunk_users), interactions_per_user)
+        user_cumulative = cumulative[local_users]
+        total = user_cumulative[:, -1]
+        
+        draw = rng.random(size) * total
+        category = np.minimum((user_cumulative <= draw[:, None]).sum(axis=1), num_categories - 1)
+        offset = (rng.random(size) * counts[category]).astype(np.int64)
+        preferred_product = by_category[starts[category] + offset]
         
         # Generate interactions (80% from preferred, 20% random)
-        for _ in range(interactions_per_user):
-            if random.random() < 0.8 and preferred_products:
-                product_id = random.choice(preferred_products)
-            else:
-                product_id = random.choice(product_ids)
-            
-            # Interaction type
-            interaction_type = random.choices(
-                ['view', 'click', 'add_to_cart', 'purchase'],
-                weights=[50, 30, 15, 5]
-            )[0]
-            
-            # Timestamp (last 90 days)
-            days_ago = random.randint(0, 90)
-            timestamp = (datetime.now() - timedelta(days=days_ago)).isoformat() + 'Z'
-            
-            interaction = {
-                'user_id': f'USER{user_id:05d}',
+        from_preferred = rng.random(size) < PREFERRED_SHARE
+        product = np.where(from_preferred, preferred_product, rng.integers(0, num_products, size))
+        
+        yield {
+            'user': local_users + first_user,
+            'product': product,
+            'type': rng.choice(len(INTERACTION_TYPES), size, p=TYPE_PROBABILITIES).astype(np.int8),
+            'session': rng.integers(0, num_sessions, size),
+            'seconds_ago': rng.integers(0, HISTORY_DAYS * 86400 + 1, size)
+        }
+
+def chunk_records(chunks, product_ids, num_users, num_sessions, now):
+    """Turn columnar chunks into lists of interaction dicts"""
+    user_width = id_width(num_users)
+    session_width = id_width(num_sessions)
+    
+    for chunk in chunks:
+        products = product_ids[chunk['product']].tolist()
+        timestamps = iso_timestamps(now, chunk['seconds_ago'])
+        columns = zip(chunk['user'].tolist(), products, chunk['type'].tolist(),
+                      timestamps, chunk['session'].tolist())
+        
+        yield [
+            {
+                'user_id': f'USER{user + 1:0{user_width}d}',
                 'product_id': product_id,
-                'interaction_type': interaction_type,
+                'interaction_type': INTERACTION_TYPES[interaction_type],
                 'timestamp': timestamp,
-                'session_id': f'SESSION{random.randint(1, 10000):05d}'
+                'session_id': f'SESSION{session + 1:0{session_width}d}'
             }
-            
-            interactions.append(interaction)
-    
-    return interactions
+            for user, product_id, interaction_type, timestamp, session in columns
+        ]
 
-# Generate interactions
-interactions = generate_user_interactions(500, 20)
+def chunks_to_log(chunks, product_ids, num_users, num_sessions, now):
+    """
+    Collect columnar chunks into an InteractionLog
+    
+    The item vocabulary is the whole catalog, including products nobody
+    interacted with.
+    """
+    columns = {name: [] for name in ('user', 'product', 'type', 'session', 'seconds_ago')}
+    for chunk in chunks:
+        for name, values in chunk.items():
+            columns[name].append(values)
+    columns = {name: np.concatenate(parts) for name, parts in columns.items()}
+    
+    user_width = id_width(num_users)
+    session_width = id_width(num_sessions)
+    now_seconds = now.astype('datetime64[s]').astype(np.int64)
+    
+    return InteractionLog(
+        [f'USER{u:0{user_width}d}' for u in range(1, num_users + 1)],
+        product_ids,
+        [f'SESSION{s:0{session_width}d}' for s in range(1, num_sessions + 1)],
+        columns['user'], columns['product'], columns['session'],
+        columns['type'], now_seconds - columns['seconds_ago']
+    )
 
-# Save as JSON
-with open('interactions.json', 'w') as f:
-    json.dump(interactions, f, indent=2)
+def generate_interactions(products_file, output, num_users=500, interactions_per_user=20,
+                          num_sessions=None, seed=None, chunk_size=1000000):
+    """
+    Generate interactions for the products in products_file and stream them to output
+    
+    Writes a JSON array, JSON Lines (.jsonl) or the compact .npz store.
+    num_sessions defaults to one session per five interactions, at least
+    10000. Returns the number of interactions written.
+    """
+    product_ids, category_codes, _ = load_catalog(products_file)
+    num_sessions = num_sessions or max(10000, num_users * interactions_per_user // 5)
+    now = np.datetime64(datetime.now(), 'us')
+    
+    chunks = iter_interaction_chunks(category_codes, num_users, interactions_per_user,
+                                     num_sessions, seed, chunk_size)
+    
+    if output.endswith('.npz'):
+        log = chunks_to_log(chunks, product_ids, num_users, num_sessions, now)
+        log.save(output)
+        return len(log)
+    
+    return write_records(chunk_records(chunks, product_ids, num_users, num_sessions, now), output)
 
-print(f"Generated {len(interactions)} interactions")
-print(f"Sample interaction: {json.dumps(interactions[0], indent=2)}")
\ No newline at end of file
+# Generate interactions
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Generate synthetic user interactions')
+    parser.add_argument('--products', default='products.json')
+    parser.add_argument('--output', default='interactions.json', help='.json, .jsonl or .npz')
+    parser.add_argument('--num-users', type=int, default=500)
+    parser.add_argument('--interactions-per-user', type=int, default=20)
+    parser.add_argument('--num-sessions', type=int, default=None)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--chunk-size', type=int, default=1000000)
+    args = parser.parse_args()
+    
+    count = generate_interactions(args.products, args.output, args.num_users,
+                                  args.interactions_per_user, args.num_sessions,
+                                  args.seed, args.chunk_size)
+    
+    print(f"Generated {count} interactions")
+    if not args.output.endswith('.npz'):
+        print(f"Sample interaction: {json.dumps(next(iter_records(args.output)), indent=2)}")
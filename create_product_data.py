@@ -1,7 +1,8 @@
 # create_product_data.py
+import argparse
 import json
-import random
-from datetime import datetime, timedelta
+from datetime import datetime
+import numpy as np
 
 categories = ['Electronics', 'Books', 'Clothing', 'Home & Kitchen', 'Sports']
 brands = ['BrandA', 'BrandB', 'BrandC', 'BrandD', 'BrandE']
@@ -19,58 +20,130 @@ product_types = {
     'Sports': sports_products
 }
 
-def generate_products(n=1000):
-    products = []
+discounts = np.array([0, 5, 10, 15, 20, 25, 30])
+all_tags = ['bestseller', 'new', 'trending', 'premium', 'budget-friendly']
+
+def id_width(n):
+    """Zero-padded id width: five digits, or wider when n needs more"""
+    return max(5, len(str(n)))
+
+def iso_timestamps(now, seconds_ago):
+    """ISO 8601 strings with a Z suffix, seconds_ago before now (a datetime64[us])"""
+    times = now - (np.asarray(seconds_ago) * 1000000).astype('timedelta64[us]')
+    return [t + 'Z' for t in np.datetime_as_string(times, unit='us').tolist()]
+
+def iter_product_chunks(n=1000, seed=None, chunk_size=100000):
+    """
+    Generate n products as lists of dicts, chunk_size at a time
+    
+    Every attribute of a chunk is drawn with one vectorized call, so the
+    cost per product is building its dict.
+    """
+    rng = np.random.default_rng(seed)
+    now = np.datetime64(datetime.now(), 'us')
+    width = id_width(n)
+    type_names = np.array([product_types[c] for c in categories])
     
-    for i in range(1, n + 1):
-        category = random.choice(categories)
-        product_type = random.choice(product_types[category])
-        brand = random.choice(brands)
+    for start in range(1, n + 1, chunk_size):
+        size = min(chunk_size, n + 1 - start)
+        
+        category = rng.integers(0, len(categories), size)
+        product_type = type_names[category, rng.integers(0, type_names.shape[1], size)]
+        brand = rng.integers(0, len(brands), size)
         
         # Generate realistic data
-        price = round(random.uniform(10, 1000), 2)
-        rating = round(random.uniform(2.5, 5.0), 1)
-        num_reviews = random.randint(0, 5000)
-        view_count = random.randint(100, 50000)
+        price = np.round(rng.uniform(10, 1000, size), 2)
+        rating = np.round(rng.uniform(2.5, 5.0, size), 1)
+        num_reviews = rng.integers(0, 5001, size)
+        view_count = rng.integers(100, 50001, size)
         
         # Sales data
-        sales_last_30_days = random.randint(0, 1000)
+        sales_last_30_days = rng.integers(0, 1001, size)
         
         # Release date (last 3 years)
-        days_ago = random.randint(0, 1095)
-        release_date = (datetime.now() - timedelta(days=days_ago)).isoformat() + 'Z'
+        release_date = iso_timestamps(now, rng.integers(0, 1096, size) * 86400)
         
-        # Discount
-        discount = random.choice([0, 5, 10, 15, 20, 25, 30])
+        discount = discounts[rng.integers(0, len(discounts), size)]
+        in_stock = rng.random(size) < 0.75  # 75% in stock
         
-        product = {
-            'id': f'PROD{i:05d}',
-            'title': f'{brand} {product_type} - Model {i}',
-            'description': f'High quality {product_type.lower()} from {brand}. Perfect for everyday use.',
-            'category': category,
-            'brand': brand,
-            'price': price,
-            'rating': rating,
-            'num_reviews': num_reviews,
-            'view_count': view_count,
-            'sales_last_30_days': sales_last_30_days,
-            'release_date': release_date,
-            'discount_percent': discount,
-            'in_stock': random.choice([True, True, True, False]),  # 75% in stock
-            'tags': random.sample(['bestseller', 'new', 'trending', 'premium', 'budget-friendly'], 
-                                   k=random.randint(0, 3))
-        }
+        # Up to three distinct tags in random order
+        tag_order = np.argsort(rng.random((size, len(all_tags))), axis=1)
+        num_tags = rng.integers(0, 4, size)
         
-        products.append(product)
-    
-    return products
+        columns = zip(
+            range(start, start + size), category.tolist(), product_type.tolist(), brand.tolist(),
+            price.tolist(), rating.tolist(), num_reviews.tolist(), view_count.tolist(),
+            sales_last_30_days.tolist(), release_date, discount.tolist(), in_stock.tolist(),
+            tag_order.tolist(), num_tags.tolist()
+        )
+        
+        chunk = []
+        for i, c, ptype, b, p, r, reviews, views, sales, released, d, stock, order, k in columns:
+            brand_name = brands[b]
+            chunk.append({
+                'id': f'PROD{i:0{width}d}',
+                'title': f'{brand_name} {ptype} - Model {i}',
+                'description': f'High quality {ptype.lower()} from {brand_name}. Perfect for everyday use.',
+                'category': categories[c],
+                'brand': brand_name,
+                'price': p,
+                'rating': r,
+                'num_reviews': reviews,
+                'view_count': views,
+                'sales_last_30_days': sales,
+                'release_date': released,
+                'discount_percent': d,
+                'in_stock': stock,
+                'tags': [all_tags[t] for t in order[:k]]
+            })
+        
+        yield chunk
 
-# Generate products
-products = generate_products(1000)
+def generate_products(n=1000, seed=None):
+    """Generate n products in memory"""
+    return [product for chunk in iter_product_chunks(n, seed) for product in chunk]
 
-# Save as JSON
-with open('products.json', 'w') as f:
-    json.dump(products, f, indent=2)
+def write_records(chunks, filename):
+    """
+    Stream chunks of records to a JSON array, or JSON Lines for a .jsonl file
+    
+    Returns the number of records written.
+    """
+    count = 0
+    with open(filename, 'w') as f:
+        if filename.endswith('.jsonl'):
+            for chunk in chunks:
+                f.write(''.join(json.dumps(record) + '\n' for record in chunk))
+                count += len(chunk)
+            return count
+        
+        f.write('[')
+        for chunk in chunks:
+            if not chunk:
+                continue
+            f.write(',\n' if count else '\n')
+            f.write(',\n'.join(json.dumps(record) for record in chunk))
+            count += len(chunk)
+        f.write('\n]\n')
+    return count
 
-print(f"Generated {len(products)} products")
-print(f"Sample product: {json.dumps(products[0], indent=2)}")
\ No newline at end of file
+# Generate products
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Generate a synthetic product catalog')
+    parser.add_argument('--num-products', type=int, default=1000)
+    parser.add_argument('--output', default='products.json', help='.json or .jsonl')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--chunk-size', type=int, default=100000)
+    args = parser.parse_args()
+    
+    sample = []
+    def chunks():
+        for chunk in iter_product_chunks(args.num_products, args.seed, args.chunk_size):
+            sample.extend(chunk[:1 - len(sample)])
+            yield chunk
+    
+    count = write_records(chunks(), args.output)
+    
+    print(f"Generated {count} products")
+    if sample:
+        print(f"Sample product: {json.dumps(sample[0], indent=2)}")
@@ -0,0 +1,187 @@
+# delta_matrix.py
+import numpy as np
+from scipy.sparse import csr_matrix, vstack
+
+# Replaced rows stay apart from the base matrix until they hold this many
+# nonzeros, then are merged into a new base, so an online update never
+# copies the whole matrix and merges are amortised over many updates
+MERGE_NNZ = 1 << 16
+
+def grow_csr(matrix, shape):
+    """Pad a CSR matrix with empty rows and columns up to shape"""
+    extra_rows = shape[0] - matrix.shape[0]
+    indptr = np.concatenate([matrix.indptr, np.full(extra_rows, matrix.indptr[-1], dtype=matrix.indptr.dtype)])
+    return csr_matrix((matrix.data, matrix.indices, indptr), shape=shape)
+
+def replace_csr_rows(matrix, rows, block):
+    """
+    CSR matrix with the given rows (sorted, unique) replaced by the rows of block
+    
+    Runs of untouched rows are copied as whole slices, so the cost is one
+    copy of the arrays, with no sparse sum or sort over the matrix.
+    """
+    indptr = matrix.indptr
+    lengths = np.diff(indptr).astype(np.int64)
+    lengths[rows] = np.diff(block.indptr)
+    total = int(lengths.sum())
+    index_type = np.result_type(matrix.indices.dtype, indptr.dtype)
+    if total >= 2 ** 31:
+        index_type = np.int64
+    new_indptr = np.zeros(len(indptr), dtype=index_type)
+    np.cumsum(lengths, out=new_indptr[1:])
+    
+    data, indices = [], []
+    run_start = 0
+    for i, row in enumerate(rows.tolist()):
+        lo, hi = indptr[run_start], indptr[row]
+        block_lo, block_hi = block.indptr[i], block.indptr[i + 1]
+        data += [matrix.data[lo:hi], block.data[block_lo:block_hi]]
+        indices += [matrix.indices[lo:hi], block.indices[block_lo:block_hi].astype(index_type)]
+        run_start = row + 1
+    data.append(matrix.data[indptr[run_start]:])
+    indices.append(matrix.indices[indptr[run_start]:])
+    
+    return csr_matrix((np.concatenate(data), np.concatenate(indices).astype(index_type, copy=False), new_indptr),
+                      shape=matrix.shape)
+
+def add_csr(a, b):
+    """
+    Sum of two CSR matrices of the same shape
+    
+    Adds the nonzeros by (row, column) key, so the cost follows their count;
+    scipy's sum of non-canonical matrices scans a column-wide array. Like
+    scipy's sum, entries that cancel out are dropped.
+    """
+    n_cols = a.shape[1]
+    rows = np.concatenate([np.repeat(np.arange(a.shape[0]), np.diff(a.indptr)),
+                           np.repeat(np.arange(b.shape[0]), np.diff(b.indptr))])
+    keys = rows * n_cols + np.concatenate([a.indices, b.indices]).astype(np.int64)
+    keys, inverse = np.unique(keys, return_inverse=True)
+    sums = np.bincount(inverse, weights=np.concatenate([a.data, b.data]), minlength=len(keys))
+    keys, sums = keys[sums != 0], sums[sums != 0]
+    return csr_matrix((sums.astype(np.result_type(a.dtype, b.dtype)), (keys // n_cols, keys % n_cols)),
+                      shape=a.shape)
+
+class DeltaMatrix:
+    """
+    Sparse matrix as a CSR base plus a small set of replaced rows
+    
+    replace() returns a new DeltaMatrix that shares the base and rebuilds
+    only the replaced rows, so an online update costs the size of those
+    rows, not the matrix; past MERGE_NNZ replaced nonzeros they are merged
+    into a new base. Every DeltaMatrix is immutable, so a reader holding
+    one sees a consistent matrix. take() gathers rows from the base and
+    the replaced rows without merging; tocsr() merges once for
+    whole-matrix work. An optional per-row scale (the scales of 8-bit
+    similarity codes) travels with the rows.
+    """
+    
+    def __init__(self, base, row_scale=None, shape=None, rows=None, delta=None, delta_scale=None):
+        self.base = base
+        self.base_scale = row_scale
+        self.shape = tuple(shape or base.shape)
+        # Replaced row indices (sorted) and their rows, in the same order
+        self.rows = rows if rows is not None else np.empty(0, dtype=np.int64)
+        self.delta = delta if delta is not None else csr_matrix((0, self.shape[1]), dtype=base.dtype)
+        self.delta_scale = delta_scale
+        if delta_scale is None and row_scale is not None:
+            self.delta_scale = np.empty(0, dtype=row_scale.dtype)
+        self._merged = None
+    
+    @property
+    def dtype(self):
+        return np.result_type(self.base.dtype, self.delta.dtype)
+    
+    @property
+    def nbytes(self):
+        """Bytes held by the base, the replaced rows and their scales"""
+        nbytes = sum(m.data.nbytes + m.indices.nbytes + m.indptr.nbytes for m in (self.base, self.delta))
+        for scale in (self.base_scale, self.delta_scale):
+            nbytes += scale.nbytes if scale is not None else 0
+        return nbytes
+    
+    def _locate(self, idx):
+        """Where each row lives: (in_delta, delta position, in_base, start, length)"""
+        pos = np.searchsorted(self.rows, idx)
+        in_delta = pos < len(self.rows)
+        in_delta[in_delta] = self.rows[pos[in_delta]] == idx[in_delta]
+        in_base = ~in_delta & (idx < self.base.shape[0])
+        
+        starts = np.zeros(len(idx), dtype=np.int64)
+        lengths = np.zeros(len(idx), dtype=np.int64)
+        for mask, matrix, at in ((in_base, self.base, idx), (in_delta, self.delta, pos)):
+            starts[mask] = matrix.indptr[at[mask]]
+            lengths[mask] = matrix.indptr[at[mask] + 1] - starts[mask]
+        return in_delta, pos, in_base, starts, lengths
+    
+    def take(self, idx):
+        """Rows idx as a CSR matrix, with their scales (None without a row scale)"""
+        idx = np.asarray(idx, dtype=np.int64)
+        in_delta, pos, in_base, starts, lengths = self._locate(idx)
+        
+        # Gather the nonzeros of every row straight from the CSR arrays
+        indptr = np.zeros(len(idx) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=indptr[1:])
+        source = np.repeat(starts - indptr[:-1], lengths) + np.arange(indptr[-1])
+        from_delta = np.repeat(in_delta, lengths)
+        data = np.empty(indptr[-1], dtype=self.dtype)
+        indices = np.empty(indptr[-1], dtype=np.int64)
+        for mask, matrix in ((~from_delta, self.base), (from_delta, self.delta)):
+            data[mask] = matrix.data[source[mask]]
+            indices[mask] = matrix.indices[source[mask]]
+        block = csr_matrix((data, indices, indptr), shape=(len(idx), self.shape[1]))
+        
+        scale = None
+        if self.base_scale is not None:
+            scale = np.zeros(len(idx), dtype=self.base_scale.dtype)
+            scale[in_base] = self.base_scale[idx[in_base]]
+            scale[in_delta] = self.delta_scale[pos[in_delta]]
+        return block, scale
+    
+    def column_sums(self):
+        """Sum of every column, without merging the replaced rows in"""
+        kept = np.ones(self.base.shape[0], dtype=bool)
+        kept[self.rows[self.rows < len(kept)]] = False
+        kept = np.repeat(kept, np.diff(self.base.indptr))
+        return (np.bincount(self.base.indices[kept], weights=self.base.data[kept], minlength=self.shape[1])
+                + np.bincount(self.delta.indices, weights=self.delta.data, minlength=self.shape[1]))
+    
+    def resize(self, shape):
+        """The same matrix padded with empty rows and columns up to shape"""
+        if tuple(shape) == self.shape:
+            return self
+        delta = csr_matrix((self.delta.data, self.delta.indices, self.delta.indptr),
+                           shape=(self.delta.shape[0], shape[1]))
+        return DeltaMatrix(self.base, self.base_scale, shape, self.rows, delta, self.delta_scale)
+    
+    def replace(self, rows, block, block_scale=None):
+        """DeltaMatrix with rows (sorted, unique) replaced by the rows of block"""
+        keep = np.flatnonzero(~np.isin(self.rows, rows, assume_unique=True))
+        all_rows = np.concatenate([self.rows[keep], rows])
+        order = np.argsort(all_rows, kind='stable')
+        block = csr_matrix((block.data, block.indices, block.indptr), shape=(block.shape[0], self.shape[1]))
+        delta = vstack([self.delta[keep], block], format='csr')[order]
+        delta_scale = None
+        if self.base_scale is not None:
+            delta_scale = np.concatenate([self.delta_scale[keep], block_scale])[order]
+        
+        replaced = DeltaMatrix(self.base, self.base_scale, self.shape, all_rows[order], delta, delta_scale)
+        if delta.nnz > MERGE_NNZ:
+            return DeltaMatrix(*replaced.merged())
+        return replaced
+    
+    def merged(self):
+        """The whole matrix as one CSR matrix and its row scale, merged once and kept"""
+        if self._merged is None:
+            matrix, row_scale = self.base, self.base_scale
+            if len(self.rows) or matrix.shape != self.shape:
+                matrix = replace_csr_rows(grow_csr(matrix, self.shape), self.rows, self.delta)
+                if row_scale is not None:
+                    row_scale = np.concatenate([row_scale, np.zeros(self.shape[0] - len(row_scale),
+                                                                    dtype=row_scale.dtype)])
+                    row_scale[self.rows] = self.delta_scale
+            self._merged = (matrix, row_scale)
+        return self._merged
+    
+    def tocsr(self):
+        return self.merged()[0]
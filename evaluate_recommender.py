@@ -1,105 +1,188 @@
 # evaluate_recommender.py
-import json
+import argparse
+import multiprocessing
+import os
+import time
 import numpy as np
-from collections import defaultdict
-from hybrid_recommender import HybridRecommender
+from concurrent.futures import ProcessPoolExecutor
+from als_recommender import ALSRecommender
+from collaborative_filtering import CollaborativeFilteringRecommender
+from interaction_store import InteractionLog, TYPE_CODES
 
-class RecommenderEvaluator:
-    def __init__(self, interactions_file='interactions.json'):
-        with open(interactions_file, 'r') as f:
-            self.interactions = json.load(f)
-        
-        self.recommender = HybridRecommender()
-    
-    def split_data(self, test_ratio=0.2):
-        """Split interactions into train/test"""
-        
-        # Group by user
-        user_interactions = defaultdict(list)
-        for interaction in self.interactions:
-            if interaction['interaction_type'] in ['purchase', 'add_to_cart']:
-                user_interactions[interaction['user_id']].append(interaction['product_id'])
-        
-        train_data = {}
-        test_data = {}
-        
-        for user, products in user_interactions.items():
-            if len(products) < 2:
-                continue
-            
-            split_point = int(len(products) * (1 - test_ratio))
-            train_data[user] = products[:split_point]
-            test_data[user] = products[split_point:]
-            return train_data, test_data
+# Model and ground truth shared with forked evaluation workers
+_EVAL_STATE = {}
 
-def precision_at_k(self, recommended, relevant, k=10):
-    """Calculate Precision@K"""
-    recommended_k = recommended[:k]
-    relevant_set = set(relevant)
-    
-    hits = len([r for r in recommended_k if r in relevant_set])
-    return hits / k if k > 0 else 0
+def _user_latencies(model, user_ids, k):
+    """Wall time of one top_n_for_user call per user, as the API serves a request"""
+    latency = np.empty(len(user_ids))
+    for i, user_id in enumerate(user_ids):
+        start = time.perf_counter()
+        model.top_n_for_user(user_id, k)
+        latency[i] = time.perf_counter() - start
+    return latency
 
-def recall_at_k(self, recommended, relevant, k=10):
-    """Calculate Recall@K"""
-    recommended_k = recommended[:k]
-    relevant_set = set(relevant)
-    
-    hits = len([r for r in recommended_k if r in relevant_set])
-    return hits / len(relevant_set) if len(relevant_set) > 0 else 0
+def precision_at_k(hits, k):
+    """Precision@K for every user from a (users, k) boolean hit matrix"""
+    return hits.sum(axis=1) / k
 
-def ndcg_at_k(self, recommended, relevant, k=10):
-    """Calculate NDCG@K"""
-    recommended_k = recommended[:k]
-    relevant_set = set(relevant)
-    
-    # Binary relevance (1 if relevant, 0 otherwise)
-    relevance_scores = [1 if r in relevant_set else 0 for r in recommended_k]
-    
-    # DCG
-    dcg = sum([rel / np.log2(i + 2) for i, rel in enumerate(relevance_scores)])
-    
-    # IDCG (perfect ranking)
-    ideal_scores = sorted(relevance_scores, reverse=True)
-    idcg = sum([rel / np.log2(i + 2) for i, rel in enumerate(ideal_scores)])
+def recall_at_k(hits, num_relevant):
+    """Recall@K for every user"""
+    return hits.sum(axis=1) / np.maximum(num_relevant, 1)
+
+def ndcg_at_k(hits, num_relevant):
+    """NDCG@K for every user with binary relevance"""
+    k = hits.shape[1]
+    discounts = 1.0 / np.log2(np.arange(k) + 2)
+    dcg = (hits * discounts).sum(axis=1)
     
-    return dcg / idcg if idcg > 0 else 0
+    # Ideal DCG places all relevant items (up to k) at the top
+    ideal = np.concatenate([[0.0], np.cumsum(discounts)])
+    idcg = ideal[np.minimum(num_relevant, k)]
+    return np.divide(dcg, idcg, out=np.zeros_like(dcg), where=idcg > 0)
 
-def evaluate(self, k=10):
-    """Evaluate recommender system"""
+def _evaluate_shard(user_idx, k, block_size):
+    """Score one shard of test users block by block; returns per-user metrics"""
+    model = _EVAL_STATE['model']
+    test_keys = _EVAL_STATE['test_keys']
+    num_relevant = _EVAL_STATE['num_relevant']
+    n_items = _EVAL_STATE['n_items']
     
-    train_data, test_data = self.split_data()
+    precision, recall, ndcg = [], [], []
+    for start in range(0, len(user_idx), block_size):
+        block = user_idx[start:start + block_size]
+        recs, _ = model.score_users(block, k)
+        
+        # A recommendation is a hit when its (user, item) key is in the test set
+        keys = block[:, None] * n_items + recs
+        pos = np.minimum(np.searchsorted(test_keys, keys), len(test_keys) - 1)
+        hits = (recs >= 0) & (test_keys[pos] == keys)
+        
+        relevant = num_relevant[block]
+        precision.append(precision_at_k(hits, k))
+        recall.append(recall_at_k(hits, relevant))
+        ndcg.append(ndcg_at_k(hits, relevant))
     
-    precisions = []
-    recalls = []
-    ndcgs = []
+    return np.concatenate(precision), np.concatenate(recall), np.concatenate(ndcg)
+
+class RecommenderEvaluator:
+    def __init__(self, interactions_file='interactions.json', relevant_types=('purchase', 'add_to_cart')):
+        self.log = InteractionLog.load(interactions_file)
+        self.relevant_types = np.array([TYPE_CODES[t] for t in relevant_types], dtype=np.int8)
     
-    for user_id, test_products in test_data.items():
-        # Get recommendations
-        recs = self.recommender.personalized_recommendations(user_id, k)
-        recommended_ids = [r['id'] for r in recs]
-        
-        # Calculate metrics
-        p = self.precision_at_k(recommended_ids, test_products, k)
-        r = self.recall_at_k(recommended_ids, test_products, k)
-        n = self.ndcg_at_k(recommended_ids, test_products, k)
-        
-        precisions.append(p)
-        recalls.append(r)
-        ndcgs.append(n)
+    def split_data(self, test_ratio=0.2, min_interactions=2):
+        """
+        Temporal per-user split of the interaction log
+        
+        Each user's events are ordered by time and the latest test_ratio of
+        them are held out. Returns boolean train/test masks over the log.
+        """
+        log = self.log
+        order = np.lexsort((log.timestamps, log.user_codes))
+        users = log.user_codes[order]
+        
+        counts = np.bincount(users, minlength=len(log.user_ids))
+        starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+        rank = np.arange(len(order)) - starts[users]
+        split_point = np.floor(counts * (1 - test_ratio)).astype(int)
+        
+        is_test = (rank >= split_point[users]) & (counts[users] >= min_interactions)
+        test = np.zeros(len(log), dtype=bool)
+        test[order[is_test]] = True
+        return ~test, test
     
-    print(f"\n=== Evaluation Results @ {k} ===")
-    print(f"Precision@{k}: {np.mean(precisions):.4f}")
-    print(f"Recall@{k}: {np.mean(recalls):.4f}")
-    print(f"NDCG@{k}: {np.mean(ndcgs):.4f}")
-    print(f"Users evaluated: {len(precisions)}")
+    def train(self, train_mask, backend='item_knn', **params):
+        """Fit a CF model on the training events only"""
+        collaborative = CollaborativeFilteringRecommender(self.log.subset(train_mask))
+        collaborative.build_matrix().compute_item_similarity(**params)
+        
+        if backend == 'als':
+            return ALSRecommender(collaborative).fit()
+        return collaborative
     
-    return {
-        'precision': np.mean(precisions),
-        'recall': np.mean(recalls),
-        'ndcg': np.mean(ndcgs)
-    }
+    def evaluate(self, k=10, test_ratio=0.2, backend='item_knn', block_size=256,
+                 workers=None, shard_size=5000, latency_sample=1000, seed=0):
+        """
+        Evaluate a model trained on the temporal train split against held-out relevant items
+        
+        Throughput comes from block scoring over all test users; latency
+        percentiles time single-user scoring on a random sample of
+        latency_sample of them, one call at a time after the blocks finish.
+        """
+        train_mask, test_mask = self.split_data(test_ratio)
+        model = self.train(train_mask, backend)
+        log = self.log
+        
+        # Translate the log's codes into the model's index space through its vocabularies
+        collaborative = model.collaborative if isinstance(model, ALSRecommender) else model
+        users = collaborative.users.lookup(log.user_ids)[log.user_codes]
+        items = collaborative.items.lookup(log.item_ids)[log.item_codes]
+        n_items = len(collaborative.items)
+        
+        # Ground truth: relevant held-out items the user had not already seen in training
+        relevant = test_mask & np.isin(log.type_codes, self.relevant_types)
+        train_keys = np.unique(users[train_mask] * n_items + items[train_mask])
+        test_keys = np.unique(users[relevant] * n_items + items[relevant])
+        test_keys = test_keys[~np.isin(test_keys, train_keys)]
+        
+        num_relevant = np.bincount(test_keys // n_items, minlength=len(collaborative.users))
+        test_users = np.flatnonzero(num_relevant)
+        if not len(test_users):
+            print("No test users with held-out relevant items")
+            return {}
+        
+        _EVAL_STATE.update(model=model, test_keys=test_keys, num_relevant=num_relevant, n_items=n_items)
+        
+        start = time.perf_counter()
+        shards = [test_users[i:i + shard_size] for i in range(0, len(test_users), shard_size)]
+        workers = workers or os.cpu_count()
+        if len(shards) > 1 and workers > 1:
+            # Forked workers inherit the trained model and ground truth
+            context = multiprocessing.get_context('fork')
+            with ProcessPoolExecutor(max_workers=workers, mp_context=context) as executor:
+                results = list(executor.map(_evaluate_shard, shards, [k] * len(shards), [block_size] * len(shards)))
+        else:
+            results = [_evaluate_shard(shard, k, block_size) for shard in shards]
+        elapsed = time.perf_counter() - start
+        
+        precision, recall, ndcg = (np.concatenate(parts) for parts in zip(*results))
+        
+        rng = np.random.default_rng(seed)
+        sample = rng.choice(test_users, min(latency_sample, len(test_users)), replace=False)
+        latency_ms = _user_latencies(model, collaborative.users.ids[sample].tolist(), k) * 1000
+        
+        report = {
+            'precision': float(precision.mean()),
+            'recall': float(recall.mean()),
+            'ndcg': float(ndcg.mean()),
+            'users': int(len(test_users)),
+            'users_per_sec': len(test_users) / elapsed,
+            'latency_sample': int(len(sample)),
+            'latency_ms_p50': float(np.percentile(latency_ms, 50)),
+            'latency_ms_p95': float(np.percentile(latency_ms, 95)),
+            'latency_ms_p99': float(np.percentile(latency_ms, 99))
+        }
+        
+        print(f"\n=== Evaluation Results @ {k} ({backend}) ===")
+        print(f"Precision@{k}: {report['precision']:.4f}")
+        print(f"Recall@{k}: {report['recall']:.4f}")
+        print(f"NDCG@{k}: {report['ndcg']:.4f}")
+        print(f"Users evaluated: {report['users']}")
+        print(f"Throughput: {report['users_per_sec']:.0f} users/sec")
+        print(f"Per-user latency (ms, {report['latency_sample']} sampled users): "
+              f"p50 {report['latency_ms_p50']:.3f} | p95 {report['latency_ms_p95']:.3f} | "
+              f"p99 {report['latency_ms_p99']:.3f}")
+        
+        return report
 
-    if name == 'main':
-        evaluator = RecommenderEvaluator()
-        results = evaluator.evaluate(k=10)
\ No newline at end of file
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Offline evaluation of the CF recommenders')
+    parser.add_argument('--interactions', default='interactions.json')
+    parser.add_argument('--k', type=int, default=10)
+    parser.add_argument('--test-ratio', type=float, default=0.2)
+    parser.add_argument('--backend', choices=['item_knn', 'als'], default='item_knn')
+    parser.add_argument('--workers', type=int, default=None)
+    args = parser.parse_args()
+    
+    evaluator = RecommenderEvaluator(args.interactions)
+    results = evaluator.evaluate(k=args.k, test_ratio=args.test_ratio,
+                                 backend=args.backend, workers=args.workers)
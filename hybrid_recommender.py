@@ -1,89 +1,319 @@
 # hybrid_recommender.py
-import requests
+import contextvars
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from als_recommender import ALSRecommender
 from collaborative_filtering import CollaborativeFilteringRecommender
 from content_based_recommender import ContentBasedRecommender
+from interaction_store import InteractionLog
+from item_filters import ItemFilterIndex
+from materialized_store import MaterializedStore
+from session_recommender import SessionRecommender
+from trending_index import TrendingIndex
+import metrics
 import numpy as np
 
 class HybridRecommender:
-    def __init__(self, solr_url="http://localhost:8983/solr/products"):
-        self.content_based = ContentBasedRecommender(solr_url)
-        self.collaborative = CollaborativeFilteringRecommender()
-        self.collaborative.build_matrix().compute_item_similarity()
+    def __init__(self, solr_url="http://localhost:8983/solr/products", model_path=None, max_workers=16,
+                 backend='item_knn', content_source='local', catalog_file='products_enriched.json',
+                 trending_refresh_interval=300, trending_half_life_days=None,
+                 collaborative=None, solr_client=None, max_sessions=100000, materialized_path=None,
+                 similarity_precision=None, interactions_file='interactions.json'):
+        # Runs the independent retrieval stages of a request side by side
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='hybrid')
+        
+        # Use a prebuilt model, load the configured snapshot, or build from raw
+        # interactions when none is configured; a configured but missing snapshot
+        # is an error rather than a silent rebuild
+        snapshot_path = None
+        if collaborative is not None:
+            self.collaborative = collaborative
+        elif model_path:
+            if not os.path.exists(model_path):
+                raise FileNotFoundError(f"No model snapshot at {model_path}")
+            # Resolved once, so the content index is kept with the same model version
+            snapshot_path = os.path.realpath(model_path)
+            self.collaborative = CollaborativeFilteringRecommender.load(snapshot_path)
+        else:
+            self.collaborative = CollaborativeFilteringRecommender(interactions_file)
+            self.collaborative.build_matrix().compute_item_similarity()
+        
+        # Optionally hold the model at reduced precision (float32 or int8, see model_precision)
+        if similarity_precision:
+            self.collaborative.quantize(similarity_precision)
+        
+        # The local content index is memory-mapped from the model snapshot, built
+        # and saved there by the first start that finds none
+        self.content_based = ContentBasedRecommender(solr_url, client=solr_client,
+                                                     similarity_source=content_source,
+                                                     catalog_file=catalog_file, index_dir=snapshot_path)
+        
+        # Trending and category/brand rankings served from memory, refreshed in the background,
+        # and attribute bitmaps for filtered requests
+        self.trending_index = None
+        self.item_filters = None
+        if catalog_file and os.path.exists(catalog_file):
+            # Decayed trending needs the interaction log, which snapshots do not carry
+            interactions = self.collaborative.interactions
+            if trending_half_life_days and interactions is None:
+                if not interactions_file or not os.path.exists(interactions_file):
+                    raise FileNotFoundError(f"Decayed trending needs an interaction log, "
+                                            f"none found at {interactions_file}")
+                interactions = InteractionLog.load(interactions_file)
+            
+            self.item_filters = ItemFilterIndex.from_file(catalog_file)
+            self.trending_index = TrendingIndex.from_file(
+                catalog_file,
+                refresh_interval=trending_refresh_interval,
+                interactions=interactions,
+                half_life_days=trending_half_life_days
+            ).start()
+            self.content_based.trending_index = self.trending_index
+        
+        # CF engine used for scoring: the item-item index or an ALS factor model on the same matrix
+        self.backend = backend
+        if backend == 'item_knn':
+            self.cf_engine = self.collaborative
+        elif backend == 'als':
+            self.cf_engine = ALSRecommender(self.collaborative).fit()
+        else:
+            raise ValueError(f"Unknown CF backend: {backend}")
+        
+        # Version as built or loaded; online updates advance model_version only
+        self.loaded_version = self.model_version
+        
+        # Precomputed top-N lists of the loaded model, served for users and items
+        # that online updates have not touched; a configured but missing store is an error
+        self.materialized = None
+        if materialized_path:
+            if not os.path.exists(materialized_path):
+                raise FileNotFoundError(f"No materialized store at {materialized_path}")
+            self.materialized = MaterializedStore.load(materialized_path)
+            if self.materialized.model_version != self.loaded_version:
+                print(f"Materialized store is for model {self.materialized.model_version}, "
+                      f"not {self.loaded_version}; scoring live")
+        
+        # Rolling per-session event buffers, scored against the item neighbor index
+        self.sessions = SessionRecommender(self.collaborative, max_sessions=max_sessions)
+        
         self.solr_url = solr_url
     
+    def close(self):
+        """Stop the background trending refresh and the stage executor"""
+        if self.trending_index:
+            self.trending_index.stop()
+        self._executor.shutdown(wait=False)
+    
+    @property
+    def model_version(self):
+        """Version of the CF model currently used for scoring"""
+        return self.cf_engine.model_version
+    
+    def _timed(self, stage, fn, *args):
+        """Run one stage, recording it in the stage metrics; returns the result and wall time in milliseconds"""
+        with metrics.stage('hybrid', stage) as timer:
+            result = fn(*args)
+        return result, timer.elapsed * 1000
+    
+    def _allowed(self, filters):
+        """Filter mask over the CF item indices, or None when nothing is filtered"""
+        if not filters:
+            return None
+        if self.item_filters is None:
+            raise ValueError("Filtering needs the product catalog")
+        return self.item_filters.mask(filters, self.collaborative.items)
+    
+    def _materialized(self, allowed):
+        """The materialized store when it was built from the loaded model and the request is unfiltered, else None"""
+        store = self.materialized
+        if store is None or allowed is not None or store.model_version != self.loaded_version:
+            return None
+        return store
+    
+    def similar_items(self, product_id, num_recommendations=10, allowed=None):
+        """Item-CF neighbors, looked up in the materialized store when it covers the request"""
+        store = self._materialized(allowed)
+        # Items whose neighbor rows online updates changed are scored live
+        if store is not None and not self.collaborative.item_updated(product_id):
+            with metrics.stage('materialized', 'similar_items'):
+                found = store.top_n_similar_items(product_id, num_recommendations)
+            if found is not None:
+                return [
+                    {'product_id': pid, 'similarity': float(score)}
+                    for pid, score in zip(found[0].tolist(), found[1])
+                ]
+        return self.cf_engine.recommend_similar_items(product_id, num_recommendations, allowed)
+    
+    def user_items(self, user_id, num_recommendations=10, allowed=None):
+        """User-CF recommendations, looked up in the materialized store when it covers the request"""
+        store = self._materialized(allowed)
+        # Users whose history or its neighbor rows online updates changed are scored live
+        if store is not None and not self.collaborative.user_updated(user_id):
+            with metrics.stage('materialized', 'user_items'):
+                found = store.top_n_for_user(user_id, num_recommendations)
+            if found is not None:
+                return [
+                    {'product_id': pid, 'score': float(score)}
+                    for pid, score in zip(found[0].tolist(), found[1])
+                ]
+        return self.cf_engine.recommend_for_user(user_id, num_recommendations, allowed)
+    
+    def _submit(self, stage, fn, *args):
+        """Run a timed stage on the executor, in a copy of the caller's context so profiling sees it"""
+        return self._executor.submit(contextvars.copy_context().run, self._timed, stage, fn, *args)
+    
     def hybrid_recommend(self, product_id, user_id=None, num_recommendations=10, 
-                        content_weight=0.5, collab_weight=0.5):
+                        content_weight=0.5, collab_weight=0.5, timings=None, filters=None):
         """
         Hybrid recommendation combining content-based and collaborative filtering
+        
+        The content, item-CF and user-CF retrievals run concurrently and are
+        merged once all have returned. Pass a dict as timings to receive the
+        per-stage wall times in milliseconds. filters (see item_filters)
+        restricts every retrieval to matching products.
         """
+        start = time.perf_counter()
+        allowed = self._allowed(filters)
+        
+        # Start the independent retrieval stages
+        content_future = self._submit('content', self.content_based.recommend_similar_products, product_id, 20)
+        collab_future = self._submit('item_cf', self.similar_items, product_id, 20, allowed)
+        user_future = None
+        if user_id:
+            user_future = self._submit('user_cf', self.user_items, user_id, 20, allowed)
+        
+        stage_ms = {}
+        content_recs, stage_ms['content'] = content_future.result()
+        collab_recs, stage_ms['item_cf'] = collab_future.result()
+        user_recs = []
+        if user_future:
+            user_recs, stage_ms['user_cf'] = user_future.result()
+        stage_ms['retrieval'] = (time.perf_counter() - start) * 1000
+        metrics.record_stage('hybrid', 'retrieval', stage_ms['retrieval'] / 1000)
+        
+        # Content neighbors come from outside the CF model, so filter them by id
+        if allowed is not None and content_recs:
+            passes = self.item_filters.allows(filters, [rec['id'] for rec in content_recs])
+            content_recs = [rec for rec, ok in zip(content_recs, passes.tolist()) if ok]
         
         recommendations = {}
         
-        # Get content-based recommendations
-        content_recs = self.content_based.recommend_similar_products(product_id, 20)
+        # Merge content-based recommendations
         for rec in content_recs:
             pid = rec['id']
             recommendations[pid] = recommendations.get(pid, 0) + content_weight * rec.get('score', 1.0)
         
-        # Get collaborative recommendations
-        collab_recs = self.collaborative.recommend_similar_items(product_id, 20)
+        # Merge collaborative recommendations
         for rec in collab_recs:
             pid = rec['product_id']
             recommendations[pid] = recommendations.get(pid, 0) + collab_weight * rec['similarity']
         
         # If user is provided, boost with user-based CF
-        if user_id:
-            user_recs = self.collaborative.recommend_for_user(user_id, 20)
-            for rec in user_recs:
-                pid = rec['product_id']
-                recommendations[pid] = recommendations.get(pid, 0) + 0.3 * rec['score']
+        for rec in user_recs:
+            pid = rec['product_id']
+            recommendations[pid] = recommendations.get(pid, 0) + 0.3 * rec['score']
         
         # Sort by combined score
         sorted_recs = sorted(recommendations.items(), key=lambda x: x[1], reverse=True)
         
-        # Fetch product details from Solr
-        result_products = []
-        for pid, score in sorted_recs[:num_recommendations]:
-            product = self.content_based.get_product(pid)
-            if product:
-                product['hybrid_score'] = score
-                result_products.append(product)
+        # Fetch product details from Solr in a single query
+        top_recs = sorted_recs[:num_recommendations]
+        result_products, stage_ms['details'] = self._timed(
+            'details', self.content_based.get_products, [pid for pid, _ in top_recs])
+        
+        scores = dict(top_recs)
+        for product in result_products:
+            product['hybrid_score'] = scores[product['id']]
+        
+        stage_ms['total'] = (time.perf_counter() - start) * 1000
+        metrics.record_stage('hybrid', 'total', stage_ms['total'] / 1000)
+        if timings is not None:
+            timings.update(stage_ms)
         
         return result_products
     
-    def personalized_recommendations(self, user_id, num_recommendations=10):
-        """Generate personalized recommendations for a user"""
+    def personalized_recommendations(self, user_id, num_recommendations=10, filters=None):
+        """Generate personalized recommendations for a user, optionally restricted by filters"""
         
         # Get user's recent interactions
-        user_recs = self.collaborative.recommend_for_user(user_id, num_recommendations)
+        user_recs = self.user_items(user_id, num_recommendations, self._allowed(filters))
         
-        # Fetch details
-        recommendations = []
-        for rec in user_recs:
-            product = self.content_based.get_product(rec['product_id'])
-            if product:
-                product['recommendation_score'] = rec['score']
-                recommendations.append(product)
+        # Fetch details in a single query
+        recommendations = self.content_based.get_products(rec['product_id'] for rec in user_recs)
+        
+        scores = {rec['product_id']: rec['score'] for rec in user_recs}
+        for product in recommendations:
+            product['recommendation_score'] = scores[product['id']]
         
         return recommendations
     
+    def session_recommendations(self, session_id, num_recommendations=10):
+        """
+        Recommendations for a live session from the events buffered for it
+        
+        Sessions with nothing buffered (new, idle or unknown items only) get
+        trending products instead.
+        """
+        session_recs = self.sessions.recommend_for_session(session_id, num_recommendations)
+        if not session_recs:
+            return self.trending_products(num_recommendations=num_recommendations)
+        
+        recommendations = self.content_based.get_products(rec['product_id'] for rec in session_recs)
+        
+        scores = {rec['product_id']: rec['score'] for rec in session_recs}
+        for product in recommendations:
+            product['session_score'] = scores[product['id']]
+        
+        return recommendations
+    
+    def iter_batch_recommendations(self, user_ids=(), product_ids=(), num_recommendations=10,
+                                   block_size=1000):
+        """
+        Yield one result dict per user id, then per product id, straight from the CF engine
+        
+        Users get their top unseen items and products their nearest
+        neighbors, scored block_size at a time, so a batch of any size holds
+        only one block of scores in memory. Product details are not fetched;
+        bulk consumers join them from the catalog.
+        """
+        for user_id, pids, scores in self.cf_engine.iter_top_n_for_users(
+                user_ids, num_recommendations, block_size):
+            yield {
+                'user_id': user_id,
+                'recommendations': [
+                    {'product_id': pid, 'score': float(score)}
+                    for pid, score in zip(pids.tolist(), scores.tolist())
+                ]
+            }
+        
+        for product_id, pids, scores in self.cf_engine.iter_top_n_similar_items(
+                product_ids, num_recommendations, block_size):
+            yield {
+                'product_id': product_id,
+                'recommendations': [
+                    {'product_id': pid, 'similarity': float(score)}
+                    for pid, score in zip(pids.tolist(), scores.tolist())
+                ]
+            }
+    
     def trending_products(self, category=None, num_recommendations=10):
         """Get trending products"""
         
-        url = f"{self.solr_url}/select"
+        if self.trending_index:
+            return self.trending_index.trending(category, num_recommendations)
         
         params = {
             'q': '*:*',
             'sort': 'sales_last_30_days desc, popularity_score desc',
-            'rows': num_recommendations,
-            'wt': 'json'
+            'rows': num_recommendations
         }
         
         if category:
             params['fq'] = f'category:"{category}"'
         
-        response = requests.get(url, params=params)
-        return response.json()['response']['docs']
+        # Reuse the content recommender's pooled Solr connections
+        return self.content_based.client.search(params)
 
 # Test hybrid recommender
 if __name__ == '__main__':
@@ -0,0 +1,273 @@
+# interaction_store.py
+import fcntl
+import json
+import os
+import sys
+import threading
+import time
+import numpy as np
+
+# Interaction types in code order, and the weight each one carries in the CF matrix
+INTERACTION_TYPES = ['view', 'click', 'add_to_cart', 'purchase']
+INTERACTION_WEIGHTS = np.array([1, 2, 3, 5])
+
+TYPE_CODES = {t: code for code, t in enumerate(INTERACTION_TYPES)}
+
+STORE_FORMAT_VERSION = 1
+
+# Records buffered between conversions to arrays; the buffer holds a few
+# short strings per record, not the record dicts
+CHUNK_SIZE = 100000
+
+def _iter_json_array(f, chunk_size=1 << 20):
+    """Yield the elements of a top-level JSON array without loading the whole file"""
+    decoder = json.JSONDecoder()
+    buf = f.read(chunk_size)
+    idx = len(buf) - len(buf.lstrip())
+    
+    if buf[idx:idx + 1] != '[':
+        raise ValueError("Expected a JSON array of interactions")
+    idx += 1
+    
+    while True:
+        # Skip separators, refilling the buffer when it runs dry
+        while idx < len(buf) and buf[idx] in ' \t\r\n,':
+            idx += 1
+        if idx >= len(buf):
+            more = f.read(chunk_size)
+            if not more:
+                raise ValueError("Unterminated JSON array")
+            buf, idx = buf[idx:] + more, 0
+            continue
+        
+        if buf[idx] == ']':
+            return
+        
+        try:
+            obj, end = decoder.raw_decode(buf, idx)
+        except json.JSONDecodeError:
+            more = f.read(chunk_size)
+            if not more:
+                raise
+            buf, idx = buf[idx:] + more, 0
+            continue
+        
+        yield obj
+        idx = end
+        
+        # Drop consumed text so the buffer stays around one chunk
+        if idx > chunk_size:
+            buf, idx = buf[idx:], 0
+
+def iter_records(filename):
+    """Stream records from a JSON array or JSON Lines file"""
+    with open(filename, 'r') as f:
+        if filename.endswith('.jsonl'):
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+        else:
+            yield from _iter_json_array(f)
+
+def iter_interactions(filename):
+    """Stream interaction records from a JSON array or JSON Lines file"""
+    return iter_records(filename)
+
+def _intern(values, vocab):
+    """Map a chunk of string ids to integer codes, growing vocab with new ids"""
+    uniq, inverse = np.unique(np.asarray(values, dtype=str), return_inverse=True)
+    codes = np.fromiter((vocab.setdefault(v, len(vocab)) for v in uniq.tolist()),
+                        dtype=np.int32, count=len(uniq))
+    return codes[inverse.ravel()]
+
+def _sorted_vocabulary(vocab, codes):
+    """Sort an interned vocabulary by id and remap its codes to match"""
+    ids = np.array(list(vocab), dtype=str)
+    order = np.argsort(ids, kind='stable')
+    rank = np.empty(len(order), dtype=np.int32)
+    rank[order] = np.arange(len(order), dtype=np.int32)
+    return ids[order], rank[codes]
+
+class InteractionLog:
+    """Columnar interaction data: interned user/item/session codes, type codes and timestamps"""
+    
+    def __init__(self, user_ids, item_ids, session_ids, user_codes, item_codes,
+                 session_codes, type_codes, timestamps):
+        self.user_ids = np.asarray(user_ids, dtype=str)
+        self.item_ids = np.asarray(item_ids, dtype=str)
+        self.session_ids = np.asarray(session_ids, dtype=str)
+        self.user_codes = np.asarray(user_codes, dtype=np.int32)
+        self.item_codes = np.asarray(item_codes, dtype=np.int32)
+        self.session_codes = np.asarray(session_codes, dtype=np.int32)
+        self.type_codes = np.asarray(type_codes, dtype=np.int8)
+        # Seconds since the epoch (UTC)
+        self.timestamps = np.asarray(timestamps, dtype=np.int64)
+    
+    def __len__(self):
+        return len(self.user_codes)
+    
+    @property
+    def weights(self):
+        """Interaction weight of every event"""
+        return INTERACTION_WEIGHTS[self.type_codes]
+    
+    def subset(self, mask):
+        """Events selected by a boolean mask, keeping the same id vocabularies"""
+        return InteractionLog(
+            self.user_ids, self.item_ids, self.session_ids,
+            self.user_codes[mask], self.item_codes[mask], self.session_codes[mask],
+            self.type_codes[mask], self.timestamps[mask]
+        )
+    
+    @classmethod
+    def from_records(cls, records, chunk_size=CHUNK_SIZE):
+        """
+        Build a log from an iterable of interaction dicts, one chunk at a time
+        
+        Only the fields used are kept from each record, in per-field buffers
+        converted to arrays every chunk_size records. Ids are interned as
+        they stream in, then sorted, so the codes do not depend on the order
+        of the records.
+        """
+        users, items, sessions = {}, {}, {}
+        columns = {name: [] for name in ('user', 'item', 'session', 'type', 'timestamp')}
+        
+        chunk = {name: [] for name in columns}
+        def flush():
+            if not chunk['user']:
+                return
+            columns['user'].append(_intern(chunk['user'], users))
+            columns['item'].append(_intern(chunk['item'], items))
+            columns['session'].append(_intern(chunk['session'], sessions))
+            columns['type'].append(np.array(chunk['type'], dtype=np.int8))
+            timestamps = np.array(chunk['timestamp'], dtype='datetime64[s]')
+            columns['timestamp'].append(timestamps.astype(np.int64))
+            for values in chunk.values():
+                values.clear()
+        
+        for record in records:
+            chunk['user'].append(record['user_id'])
+            chunk['item'].append(record['product_id'])
+            chunk['session'].append(record.get('session_id', ''))
+            chunk['type'].append(TYPE_CODES[record['interaction_type']])
+            chunk['timestamp'].append(record['timestamp'].rstrip('Z'))
+            if len(chunk['user']) >= chunk_size:
+                flush()
+        flush()
+        
+        def concat(parts, dtype):
+            return np.concatenate(parts) if parts else np.array([], dtype=dtype)
+        
+        user_ids, user_codes = _sorted_vocabulary(users, concat(columns['user'], np.int32))
+        item_ids, item_codes = _sorted_vocabulary(items, concat(columns['item'], np.int32))
+        session_ids, session_codes = _sorted_vocabulary(sessions, concat(columns['session'], np.int32))
+        
+        return cls(
+            user_ids, item_ids, session_ids,
+            user_codes, item_codes, session_codes,
+            concat(columns['type'], np.int8),
+            concat(columns['timestamp'], np.int64)
+        )
+    
+    @classmethod
+    def load(cls, filename):
+        """Load a log from a compact .npz store, or stream it from JSON/JSONL"""
+        if not filename.endswith('.npz'):
+            return cls.from_records(iter_interactions(filename))
+        
+        with np.load(filename) as store:
+            version = int(store['format_version'])
+            if version != STORE_FORMAT_VERSION:
+                raise ValueError(f"Unsupported interaction store version {version}")
+            
+            return cls(
+                store['user_ids'], store['item_ids'], store['session_ids'],
+                store['user_codes'], store['item_codes'], store['session_codes'],
+                store['type_codes'], store['timestamps']
+            )
+    
+    def save(self, filename):
+        """Write the log as a compact columnar .npz store"""
+        np.savez(
+            filename,
+            format_version=np.int32(STORE_FORMAT_VERSION),
+            user_ids=self.user_ids,
+            item_ids=self.item_ids,
+            session_ids=self.session_ids,
+            user_codes=self.user_codes,
+            item_codes=self.item_codes,
+            session_codes=self.session_codes,
+            type_codes=self.type_codes,
+            timestamps=self.timestamps
+        )
+
+class EventLog:
+    """
+    Append-only JSONL log of posted events shared by the processes of a server
+    
+    Each process appends the batches posted to it and reads the log from its
+    own offset on, so every process applies every batch once, whichever one
+    received it. Only complete lines are read; a batch still being appended
+    is picked up by the next read.
+    """
+    
+    def __init__(self, path):
+        self.path = path
+        self.offset = 0
+        self._lock = threading.Lock()
+    
+    def append(self, events):
+        """Append one batch of events as a single line"""
+        line = (json.dumps(events) + '\n').encode()
+        fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            while line:
+                line = line[os.write(fd, line):]
+        finally:
+            os.close(fd)
+    
+    def catch_up(self, apply):
+        """Pass every event appended since the last call to apply() in one list; returns their count"""
+        with self._lock:
+            try:
+                with open(self.path, 'rb') as f:
+                    f.seek(self.offset)
+                    data = f.read()
+            except FileNotFoundError:
+                return 0
+            
+            end = data.rfind(b'\n') + 1
+            events = [event for line in data[:end].splitlines() for event in json.loads(line)]
+            # Move past the batches first, so one that fails to apply is not retried forever
+            self.offset += end
+            if events:
+                apply(events)
+            return len(events)
+    
+    def follow(self, apply, interval=1.0):
+        """Catch up every interval seconds in a background thread"""
+        def run():
+            while True:
+                time.sleep(interval)
+                try:
+                    self.catch_up(apply)
+                except Exception as e:
+                    print(f"Applying logged events failed: {e}", file=sys.stderr)
+        threading.Thread(target=run, name='event-log', daemon=True).start()
+        return self
+
+def convert_interactions(source, destination, chunk_size=CHUNK_SIZE):
+    """Convert a JSON/JSONL interaction file into the compact .npz store"""
+    log = InteractionLog.from_records(iter_interactions(source), chunk_size)
+    log.save(destination)
+    return log
+
+# Convert interactions.json to the compact store
+if __name__ == '__main__':
+    source = sys.argv[1] if len(sys.argv) > 1 else 'interactions.json'
+    destination = sys.argv[2] if len(sys.argv) > 2 else 'interactions.npz'
+    
+    log = convert_interactions(source, destination)
+    print(f"Converted {len(log)} interactions "
+          f"({len(log.user_ids)} users, {len(log.item_ids)} items) to {destination}")
@@ -0,0 +1,177 @@
+# item_filters.py
+import json
+import threading
+from collections import OrderedDict
+import numpy as np
+from vocabulary import Vocabulary
+
+# Filterable attributes with a bitmap per distinct value
+BITMAP_FIELDS = ('category', 'brand', 'tags')
+
+def normalize_filters(filters):
+    """
+    Hashable form of a filter dict, or None when it filters nothing
+    
+    Accepts in_stock (bool), category / brand (a value or list of values,
+    any of which matches), tags (a value or list, all of which must be
+    present) and min_price / max_price.
+    """
+    if not filters:
+        return None
+    
+    key = []
+    if filters.get('in_stock') is not None:
+        key.append(('in_stock', bool(filters['in_stock'])))
+    for field in BITMAP_FIELDS:
+        values = filters.get(field)
+        if values:
+            values = [values] if isinstance(values, str) else values
+            key.append((field, tuple(sorted(set(map(str, values))))))
+    for bound in ('min_price', 'max_price'):
+        if filters.get(bound) is not None:
+            key.append((bound, float(filters[bound])))
+    return tuple(key) or None
+
+class ItemFilterIndex:
+    """
+    Attribute bitmaps over the product catalog for filtering at scoring time
+    
+    Every category, brand and tag value, and in_stock, has a packed bitmap
+    with one bit per catalog product; prices are one float array. A filter
+    is evaluated by ANDing bitmaps (ORing the values of one attribute),
+    then translated to a boolean mask over any item vocabulary, such as
+    the CF model's, so recommenders can drop excluded items before top-N
+    selection. Masks are cached per filter.
+    """
+    
+    def __init__(self, products, max_cached=256):
+        self.products = Vocabulary([p['id'] for p in products])
+        self.max_cached = max_cached
+        n = len(products)
+        
+        self.prices = np.array([p.get('price', np.nan) for p in products], dtype=float)
+        self.bitmaps = {'in_stock': {True: np.packbits([bool(p.get('in_stock')) for p in products])}}
+        for field in BITMAP_FIELDS:
+            members = {}
+            for i, product in enumerate(products):
+                values = product.get(field)
+                for value in ([values] if isinstance(values, str) else values or []):
+                    members.setdefault(str(value), []).append(i)
+            self.bitmaps[field] = {}
+            for value, rows in members.items():
+                bits = np.zeros(n, dtype=bool)
+                bits[rows] = True
+                self.bitmaps[field][value] = np.packbits(bits)
+        
+        self._catalog_masks = OrderedDict()
+        self._item_masks = OrderedDict()
+        self._aligned = (None, None)
+        self._lock = threading.Lock()
+    
+    @classmethod
+    def from_file(cls, filename='products_enriched.json', **kwargs):
+        with open(filename, 'r') as f:
+            return cls(json.load(f), **kwargs)
+    
+    @property
+    def nbytes(self):
+        bitmaps = sum(b.nbytes for values in self.bitmaps.values() for b in values.values())
+        return bitmaps + self.prices.nbytes + self.products.nbytes
+    
+    def _bitmap(self, field, value):
+        bitmap = self.bitmaps[field].get(value)
+        if bitmap is None:
+            return np.zeros((len(self.products) + 7) // 8, dtype=np.uint8)
+        return bitmap
+    
+    def _evaluate(self, key):
+        """Boolean mask over the catalog for a normalized filter"""
+        n = len(self.products)
+        packed = np.full((n + 7) // 8, 0xFF, dtype=np.uint8)
+        price_ok = None
+        
+        for field, value in key:
+            if field == 'in_stock':
+                in_stock = self._bitmap('in_stock', True)
+                packed &= in_stock if value else ~in_stock
+            elif field == 'tags':
+                for tag in value:
+                    packed &= self._bitmap(field, tag)
+            elif field in BITMAP_FIELDS:
+                any_of = np.zeros_like(packed)
+                for v in value:
+                    any_of |= self._bitmap(field, v)
+                packed &= any_of
+            elif field == 'min_price':
+                price_ok = (self.prices >= value) if price_ok is None else price_ok & (self.prices >= value)
+            elif field == 'max_price':
+                price_ok = (self.prices <= value) if price_ok is None else price_ok & (self.prices <= value)
+        
+        mask = np.unpackbits(packed, count=n).view(bool)
+        return mask & price_ok if price_ok is not None else mask
+    
+    def _cache(self, cache, key, compute):
+        with self._lock:
+            mask = cache.get(key)
+            if mask is not None:
+                cache.move_to_end(key)
+                return mask
+        
+        mask = compute()
+        with self._lock:
+            cache[key] = mask
+            while len(cache) > self.max_cached:
+                cache.popitem(last=False)
+        return mask
+    
+    def catalog_mask(self, filters):
+        """Boolean mask over catalog products, or None when filters is empty"""
+        key = normalize_filters(filters)
+        if key is None:
+            return None
+        return self._cache(self._catalog_masks, key, lambda: self._evaluate(key))
+    
+    def _alignment(self, items):
+        """Catalog index of every item of a vocabulary, -1 where it is not in the catalog"""
+        with self._lock:
+            vocabulary, alignment = self._aligned
+            if vocabulary is items:
+                return alignment
+        
+        alignment = self.products.lookup(items.ids)
+        with self._lock:
+            # A new vocabulary (after an online update) invalidates the item masks
+            self._aligned = (items, alignment)
+            self._item_masks.clear()
+        return alignment
+    
+    def mask(self, filters, items):
+        """Boolean mask over an item vocabulary; items missing from the catalog never pass"""
+        key = normalize_filters(filters)
+        if key is None:
+            return None
+        
+        alignment = self._alignment(items)
+        
+        def compute():
+            catalog = self.catalog_mask(filters)
+            return (alignment >= 0) & catalog[np.maximum(alignment, 0)]
+        return self._cache(self._item_masks, (key, len(alignment)), compute)
+    
+    def allows(self, filters, product_ids):
+        """Whether each of product_ids passes the filters"""
+        catalog = self.catalog_mask(filters)
+        idx = self.products.lookup(product_ids)
+        if catalog is None:
+            return idx >= 0
+        return (idx >= 0) & catalog[np.maximum(idx, 0)]
+
+# Show how much of the catalog some filters keep
+if __name__ == '__main__':
+    index = ItemFilterIndex.from_file()
+    print(f"Filter index: {len(index.products)} products, {index.nbytes / 1e3:.1f} KB")
+    
+    for filters in ({'in_stock': True}, {'category': 'Books'}, {'brand': ['BrandA', 'BrandB']},
+                    {'tags': ['bestseller', 'new']}, {'min_price': 100, 'max_price': 300},
+                    {'in_stock': True, 'category': 'Electronics', 'max_price': 500}):
+        print(f"{filters}: {int(index.catalog_mask(filters).sum())} products")
@@ -0,0 +1,188 @@
+# materialized_store.py
+import argparse
+import json
+import os
+import shutil
+import time
+import numpy as np
+from collaborative_filtering import CollaborativeFilteringRecommender, _link_snapshot, _new_model_version
+import metrics
+from vocabulary import Vocabulary
+
+STORE_FORMAT_VERSION = 1
+
+# Top-N lists kept per key: per-user recommendations and per-item neighbors
+SECTIONS = ('user', 'item')
+
+class _SectionWriter:
+    """Streams one section's top-N lists to raw files, then turns them into .npy arrays"""
+    
+    def __init__(self, directory, name, n_keys):
+        self.directory = directory
+        self.name = name
+        self.offsets = np.zeros(n_keys + 1, dtype=np.int64)
+        self._items = open(os.path.join(directory, f'{name}_items.raw'), 'wb')
+        self._scores = open(os.path.join(directory, f'{name}_scores.raw'), 'wb')
+        self._count = 0
+    
+    def write(self, key_idx, item_idx, scores):
+        self._items.write(np.asarray(item_idx, dtype=np.int32).tobytes())
+        self._scores.write(np.asarray(scores, dtype=np.float32).tobytes())
+        self._count += len(item_idx)
+        self.offsets[key_idx + 1] = self._count
+    
+    def close(self):
+        """Fill offsets of keys never written and convert the raw files, one array at a time"""
+        self._items.close()
+        self._scores.close()
+        np.maximum.accumulate(self.offsets, out=self.offsets)
+        np.save(os.path.join(self.directory, f'{self.name}_offsets.npy'), self.offsets)
+        
+        for part, dtype in (('items', np.int32), ('scores', np.float32)):
+            raw_path = os.path.join(self.directory, f'{self.name}_{part}.raw')
+            array = np.lib.format.open_memmap(os.path.join(self.directory, f'{self.name}_{part}.npy'),
+                                              mode='w+', dtype=dtype, shape=(self._count,))
+            if self._count:
+                array[:] = np.memmap(raw_path, dtype=dtype, mode='r', shape=(self._count,))
+            array.flush()
+            del array
+            os.remove(raw_path)
+        return self._count
+
+def materialize(cf_engine, path, num_recommendations=50, block_size=1000):
+    """
+    Write the top-N lists of every user and item of a CF engine to a store at path
+    
+    Users and items are scored block_size at a time through the engine's
+    batch methods and streamed to disk, so memory stays flat whatever the
+    vocabulary sizes. Like model snapshots, the store is written to a
+    versioned directory next to path and path is a symlink switched to it
+    with one atomic os.replace, so readers never see a partial store.
+    """
+    collaborative = getattr(cf_engine, 'collaborative', cf_engine)
+    users, items = collaborative.users, collaborative.items
+    start = time.perf_counter()
+    
+    path = path.rstrip(os.sep)
+    version_path = f"{path}.{_new_model_version()}"
+    tmp_path = f"{version_path}.tmp-{os.getpid()}"
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    os.makedirs(tmp_path)
+    
+    np.save(os.path.join(tmp_path, 'user_ids.npy'), users.ids)
+    np.save(os.path.join(tmp_path, 'item_ids.npy'), items.ids)
+    
+    counts = {}
+    for section, vocabulary, results in (
+        ('user', users, cf_engine.iter_top_n_for_users(users.ids, num_recommendations, block_size)),
+        ('item', items, cf_engine.iter_top_n_similar_items(items.ids, num_recommendations, block_size)),
+    ):
+        writer = _SectionWriter(tmp_path, section, len(vocabulary))
+        for key_idx, (_, product_ids, scores) in enumerate(results):
+            writer.write(key_idx, items.lookup(product_ids), scores)
+        counts[section] = writer.close()
+    
+    manifest = {
+        'format_version': STORE_FORMAT_VERSION,
+        'model_version': cf_engine.model_version,
+        'num_recommendations': num_recommendations,
+        'num_users': len(users),
+        'num_items': len(items),
+        'entries': counts,
+        'created_at': time.time()
+    }
+    with open(os.path.join(tmp_path, 'manifest.json'), 'w') as f:
+        json.dump(manifest, f, indent=2)
+    
+    # Swap the finished store into place
+    os.rename(tmp_path, version_path)
+    _link_snapshot(path, version_path)
+    
+    print(f"Materialized top-{num_recommendations} lists for {len(users)} users and {len(items)} items "
+          f"of model {cf_engine.model_version} in {time.perf_counter() - start:.1f}s")
+    return manifest
+
+class MaterializedStore:
+    """
+    Precomputed top-N recommendations served by direct lookup
+    
+    Each section (users, items) is an offset table over the vocabulary
+    indices plus flat int32 item index and float32 score arrays, all
+    memory-mapped, so a lookup is one id search and one slice. The store
+    belongs to the model version it was built from and only answers
+    requests for at most the num_recommendations it was built with.
+    """
+    
+    def __init__(self, manifest, users, items, arrays):
+        self.manifest = manifest
+        self.model_version = manifest['model_version']
+        self.num_recommendations = manifest['num_recommendations']
+        self.users = users
+        self.items = items
+        self.arrays = arrays
+    
+    @classmethod
+    def load(cls, path, mmap=True):
+        # Resolve the link once, so a materialize() swapping it mid-load cannot mix stores
+        path = os.path.realpath(path)
+        with open(os.path.join(path, 'manifest.json'), 'r') as f:
+            manifest = json.load(f)
+        
+        if manifest['format_version'] != STORE_FORMAT_VERSION:
+            raise ValueError(f"Unsupported materialized store format {manifest['format_version']}")
+        
+        mmap_mode = 'r' if mmap else None
+        def load_array(name):
+            return np.load(os.path.join(path, f'{name}.npy'), mmap_mode=mmap_mode)
+        
+        arrays = {
+            f'{section}_{part}': load_array(f'{section}_{part}')
+            for section in SECTIONS for part in ('offsets', 'items', 'scores')
+        }
+        return cls(manifest, Vocabulary(load_array('user_ids')), Vocabulary(load_array('item_ids')), arrays)
+    
+    @property
+    def nbytes(self):
+        return sum(array.nbytes for array in self.arrays.values()) + self.users.nbytes + self.items.nbytes
+    
+    def _lookup(self, section, vocabulary, key, num_recommendations):
+        """Stored (product_ids, scores) for a key, or None when the store cannot answer"""
+        idx = vocabulary.index(key)
+        if idx is None or num_recommendations > self.num_recommendations:
+            metrics.MATERIALIZED_LOOKUPS.labels(section, 'miss').inc()
+            return None
+        
+        offsets = self.arrays[f'{section}_offsets']
+        lo = int(offsets[idx])
+        hi = min(int(offsets[idx + 1]), lo + num_recommendations)
+        metrics.MATERIALIZED_LOOKUPS.labels(section, 'hit').inc()
+        item_idx = self.arrays[f'{section}_items'][lo:hi]
+        return self.items[item_idx], self.arrays[f'{section}_scores'][lo:hi].astype(float)
+    
+    def top_n_for_user(self, user_id, num_recommendations=10):
+        return self._lookup('user', self.users, user_id, num_recommendations)
+    
+    def top_n_similar_items(self, product_id, num_recommendations=10):
+        return self._lookup('item', self.items, product_id, num_recommendations)
+
+# Build a store from a model snapshot (or the raw interactions) for the API to serve
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Materialize top-N recommendations for every user and item')
+    parser.add_argument('--model', default=None, help='model snapshot directory (default: build from interactions)')
+    parser.add_argument('--output', default='materialized')
+    parser.add_argument('--top-n', type=int, default=50)
+    parser.add_argument('--block-size', type=int, default=1000)
+    args = parser.parse_args()
+    
+    if args.model:
+        cf_recommender = CollaborativeFilteringRecommender.load(args.model)
+    else:
+        cf_recommender = CollaborativeFilteringRecommender()
+        cf_recommender.build_matrix().compute_item_similarity(workers=None)
+    
+    materialize(cf_recommender, args.output, args.top_n, args.block_size)
+    
+    store = MaterializedStore.load(args.output)
+    print(f"Store size: {store.nbytes / 1e6:.2f} MB")
+    product_ids, scores = store.top_n_for_user(store.users[0], 5)
+    print(f"Top 5 for {store.users[0]}: {list(zip(product_ids.tolist(), np.round(scores, 4).tolist()))}")
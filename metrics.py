@@ -0,0 +1,400 @@
+# metrics.py
+import bisect
+import contextvars
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+# Latency buckets in seconds, from sub-millisecond cache hits to slow Solr calls
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Stage breakdown (milliseconds by "component.stage") of the request being profiled, if any
+_profile = contextvars.ContextVar('recommender_profile', default=None)
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _format_labels(names, values, extra=()):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in list(zip(names, values)) + list(extra)]
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class _Metric:
+    """A named metric with one child per combination of label values"""
+    
+    kind = None
+    
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+        self._lock = threading.Lock()
+    
+    def labels(self, *values):
+        """Child for one combination of label values, created on first use"""
+        child = self._children.get(values)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(values, self._new_child())
+        return child
+    
+    def collect(self):
+        """{label values: state} of every child, as plain values that can be merged and stored"""
+        with self._lock:
+            children = list(self._children.items())
+        return {values: self._state(child) for values, child in children}
+    
+    def reset(self):
+        with self._lock:
+            self._children = {}
+    
+    def render(self, samples=None):
+        samples = self.collect() if samples is None else samples
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+        for values, state in sorted(samples.items()):
+            lines.extend(self._render_child(values, state))
+        return lines
+
+class _CounterChild:
+    __slots__ = ('value', '_lock')
+    
+    def __init__(self):
+        self.value = 0
+        self._lock = threading.Lock()
+    
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+class Counter(_Metric):
+    """Monotonic count, e.g. requests served"""
+    
+    kind = 'counter'
+    
+    def _new_child(self):
+        return _CounterChild()
+    
+    def _state(self, child):
+        return child.value
+    
+    def merge(self, state, other):
+        return state + other
+    
+    def _render_child(self, values, value):
+        yield f'{self.name}{_format_labels(self.labelnames, values)} {_format_value(value)}'
+
+class _HistogramChild:
+    __slots__ = ('buckets', 'counts', 'sum', '_lock')
+    
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self._lock = threading.Lock()
+    
+    def observe(self, value):
+        slot = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[slot] += 1
+            self.sum += value
+
+class Histogram(_Metric):
+    """Distribution of observed values (latencies in seconds) over fixed buckets"""
+    
+    kind = 'histogram'
+    
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+    
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+    
+    def _state(self, child):
+        with child._lock:
+            return list(child.counts), child.sum
+    
+    def merge(self, state, other):
+        return [a + b for a, b in zip(state[0], other[0])], state[1] + other[1]
+    
+    def _render_child(self, values, state):
+        counts, total = state
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float('inf'),), counts):
+            cumulative += count
+            labels = _format_labels(self.labelnames, values, [('le', _format_value(bound))])
+            yield f'{self.name}_bucket{labels} {cumulative}'
+        labels = _format_labels(self.labelnames, values)
+        yield f'{self.name}_sum{labels} {_format_value(total)}'
+        yield f'{self.name}_count{labels} {cumulative}'
+
+class Registry:
+    """Collection of metrics rendered together in the Prometheus text format"""
+    
+    def __init__(self):
+        self._metrics = []
+    
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+    
+    def collect(self):
+        return {metric.name: metric.collect() for metric in self._metrics}
+    
+    def reset(self):
+        """Drop every recorded value, e.g. the parent's counts inherited by a forked worker"""
+        for metric in self._metrics:
+            metric.reset()
+    
+    def merge(self, parts):
+        """Sum the samples of several processes, as returned by collect()"""
+        metrics = {metric.name: metric for metric in self._metrics}
+        merged = {name: {} for name in metrics}
+        for samples in parts:
+            for name, children in samples.items():
+                if name not in metrics:
+                    continue
+                for values, state in children.items():
+                    current = merged[name].get(values)
+                    merged[name][values] = state if current is None else metrics[name].merge(current, state)
+        return merged
+    
+    def render(self, samples=None):
+        samples = self.collect() if samples is None else samples
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render(samples.get(metric.name, {})))
+        return '\n'.join(lines) + '\n'
+
+REGISTRY = Registry()
+
+REQUEST_SECONDS = REGISTRY.register(Histogram(
+    'recommender_request_duration_seconds', 'API request latency by endpoint', ('endpoint',)))
+REQUESTS = REGISTRY.register(Counter(
+    'recommender_requests_total', 'API requests by endpoint and HTTP status', ('endpoint', 'status')))
+STAGE_SECONDS = REGISTRY.register(Histogram(
+    'recommender_stage_duration_seconds', 'Latency of recommender stages', ('component', 'stage')))
+SOLR_QUERY_SECONDS = REGISTRY.register(Histogram(
+    'recommender_solr_query_duration_seconds', 'Solr query latency by query type', ('query_type',)))
+SOLR_QUERIES = REGISTRY.register(Counter(
+    'recommender_solr_queries_total', 'Solr queries by query type and outcome', ('query_type', 'outcome')))
+MATERIALIZED_LOOKUPS = REGISTRY.register(Counter(
+    'recommender_materialized_lookups_total', 'Materialized store lookups by section and outcome',
+    ('section', 'outcome')))
+
+def _add_to_profile(key, seconds):
+    stages = _profile.get()
+    if stages is not None:
+        stages[key] = stages.get(key, 0.0) + seconds * 1000
+
+class Timer:
+    """Context manager observing its wall time into a histogram and the active profile"""
+    
+    __slots__ = ('histogram', 'key', 'start', 'elapsed')
+    
+    def __init__(self, histogram, key):
+        self.histogram = histogram
+        self.key = key
+        self.elapsed = None
+    
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+    
+    def __exit__(self, *exc_info):
+        self.elapsed = time.perf_counter() - self.start
+        self.histogram.observe(self.elapsed)
+        _add_to_profile(self.key, self.elapsed)
+        return False
+
+def stage(component, name):
+    """Time one stage of a component, e.g. with stage('collaborative', 'user_scoring'):"""
+    return Timer(STAGE_SECONDS.labels(component, name), f'{component}.{name}')
+
+def record_stage(component, name, seconds):
+    """Record a stage timed by the caller"""
+    STAGE_SECONDS.labels(component, name).observe(seconds)
+    _add_to_profile(f'{component}.{name}', seconds)
+
+def solr_query(query_type):
+    """Time one Solr query of the given type"""
+    return Timer(SOLR_QUERY_SECONDS.labels(query_type), f'solr.{query_type}')
+
+def record_request(endpoint, status, seconds):
+    REQUEST_SECONDS.labels(endpoint).observe(seconds)
+    REQUESTS.labels(endpoint, str(status)).inc()
+
+@contextmanager
+def profile(enabled=True):
+    """
+    Collect the stages timed in this context into a dict of milliseconds
+    
+    Yields None when not enabled. Worker threads see the profile only when
+    they run in a copy of this context (contextvars.copy_context()).
+    """
+    if not enabled:
+        yield None
+        return
+    
+    stages = {}
+    token = _profile.set(stages)
+    try:
+        yield stages
+    finally:
+        _profile.reset(token)
+
+def current_profile():
+    """Stage breakdown of the request being profiled, or None"""
+    return _profile.get()
+
+# Directory shared by the processes of a preforked server (see serve.py), where
+# each one writes its samples; set in each worker by enable_multiprocess
+_multiprocess = {'directory': None}
+
+# Named stats of plain numbers (e.g. response cache counters) published alongside the metrics
+_stats_sources = {}
+
+# Summed samples of processes that have exited, kept so counters never go backwards
+RETIRED_FILE = 'retired.json'
+
+def register_stats(name, source, gauges=()):
+    """
+    Publish source(), a dict of numbers, as a named set of process stats
+    
+    combined_stats(name) sums them over the processes of a preforked
+    server. Keys in gauges describe a live process (such as a cache size)
+    and are dropped when it exits; the others are counters and keep the
+    exited process's last values.
+    """
+    _stats_sources[name] = (source, tuple(gauges))
+
+def _write_json(path, data):
+    tmp_path = f'{path}.tmp-{os.getpid()}'
+    with open(tmp_path, 'w') as f:
+        json.dump(data, f)
+    os.replace(tmp_path, path)
+
+def _encode(samples):
+    return {name: [[list(values), state] for values, state in children.items()]
+            for name, children in samples.items()}
+
+def _decode(samples):
+    return {name: {tuple(values): state for values, state in children} for name, children in samples.items()}
+
+def _process_samples():
+    stats = {}
+    for name, (source, gauges) in _stats_sources.items():
+        stats[name] = {'values': source(), 'gauges': list(gauges)}
+    return {'metrics': _encode(REGISTRY.collect()), 'stats': stats}
+
+def _numeric(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+def _add_stats(total, values, skip=()):
+    for key, value in values.items():
+        if _numeric(value) and key not in skip:
+            total[key] = total.get(key, 0) + value
+    return total
+
+def flush():
+    """Write this process's samples to the shared directory, if multiprocess mode is on"""
+    directory = _multiprocess['directory']
+    if directory is not None:
+        _write_json(os.path.join(directory, f'{os.getpid()}.json'), _process_samples())
+
+def enable_multiprocess(directory, interval=1.0):
+    """
+    Share this process's samples through directory, for rendering by any process
+    
+    Called in each worker of a preforked server after fork: drops the
+    samples inherited from the parent, then writes this process's samples
+    every interval seconds and whenever it renders.
+    """
+    REGISTRY.reset()
+    _multiprocess['directory'] = directory
+    
+    def run():
+        while True:
+            time.sleep(interval)
+            try:
+                flush()
+            except OSError as e:
+                print(f"Metrics flush failed: {e}")
+    threading.Thread(target=run, name='metrics-flush', daemon=True).start()
+
+def retire_process(directory, pid):
+    """Fold the last samples of an exited process into the retired totals; called by the arbiter"""
+    path = os.path.join(directory, f'{pid}.json')
+    retired = _read_json(os.path.join(directory, RETIRED_FILE)) or {'pids': [], 'metrics': {}, 'stats': {}}
+    samples = _read_json(path)
+    
+    if samples is not None:
+        metrics = REGISTRY.merge([_decode(retired['metrics']), _decode(samples['metrics'])])
+        retired['metrics'] = _encode(metrics)
+        for name, stats in samples['stats'].items():
+            retired['stats'][name] = _add_stats(retired['stats'].get(name, {}), stats['values'], stats['gauges'])
+    retired['pids'].append(pid)
+    
+    # Readers skip the process file once the retired totals list its pid
+    _write_json(os.path.join(directory, RETIRED_FILE), retired)
+    if os.path.exists(path):
+        os.remove(path)
+
+def _read_json(path):
+    try:
+        with open(path, 'r') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+def _read_processes(directory, attempts=3):
+    """Retired totals and the samples of every live process, read as one consistent set"""
+    for _ in range(attempts):
+        retired = _read_json(os.path.join(directory, RETIRED_FILE)) or {'pids': [], 'metrics': {}, 'stats': {}}
+        retired_pids = set(retired['pids'])
+        live = []
+        try:
+            for entry in os.listdir(directory):
+                if not entry.endswith('.json') or entry == RETIRED_FILE or int(entry[:-5]) in retired_pids:
+                    continue
+                with open(os.path.join(directory, entry), 'r') as f:
+                    live.append(json.load(f))
+        except FileNotFoundError:
+            # A process was retired while reading; read the new totals
+            continue
+        return retired, live
+    return retired, live
+
+def combined_stats(name):
+    """A registered stats dict summed over every process, live and exited"""
+    source, gauges = _stats_sources[name]
+    directory = _multiprocess['directory']
+    if directory is None:
+        return source()
+    
+    flush()
+    retired, live = _read_processes(directory)
+    total = dict(retired['stats'].get(name, {}))
+    for samples in live:
+        if name in samples['stats']:
+            _add_stats(total, samples['stats'][name]['values'])
+    total['processes'] = len(live)
+    return total
+
+def render():
+    """Every registered metric in the Prometheus text exposition format, summed over processes"""
+    directory = _multiprocess['directory']
+    if directory is None:
+        return REGISTRY.render()
+    
+    flush()
+    retired, live = _read_processes(directory)
+    parts = [_decode(retired['metrics'])] + [_decode(samples['metrics']) for samples in live]
+    return REGISTRY.render(REGISTRY.merge(parts))
@@ -0,0 +1,141 @@
+# model_precision.py
+import argparse
+import copy
+import numpy as np
+from scipy.sparse import csr_matrix
+
+# Storage precisions of the item neighbor index, from full to smallest
+SIMILARITY_PRECISIONS = ('float64', 'float32', 'int8')
+
+# Largest code of 8-bit similarities; similarities are non-negative, so codes are unsigned
+CODE_MAX = np.iinfo(np.uint8).max
+
+def smallest_int_dtype(max_value):
+    """Narrowest signed integer type holding values up to max_value"""
+    for dtype in (np.int8, np.int16, np.int32):
+        if max_value <= np.iinfo(dtype).max:
+            return dtype
+    return np.int64
+
+def compact_csr(matrix, dtype=None):
+    """CSR matrix with data cast to dtype (when given) and int32 indices where they fit"""
+    matrix = matrix.tocsr()
+    index_type = np.int32 if max(matrix.nnz, max(matrix.shape)) < 2 ** 31 else np.int64
+    data = matrix.data if dtype is None else matrix.data.astype(dtype, copy=False)
+    return csr_matrix((data, matrix.indices.astype(index_type, copy=False),
+                       matrix.indptr.astype(index_type, copy=False)), shape=matrix.shape, copy=False)
+
+def compact_interactions(matrix):
+    """User-item matrix with the narrowest integer type that holds its summed weights"""
+    max_weight = matrix.data.max() if matrix.nnz else 0
+    if np.any(matrix.data != np.round(matrix.data)):
+        return compact_csr(matrix)
+    return compact_csr(matrix, smallest_int_dtype(max_weight))
+
+def quantize_similarity(matrix, precision='float64'):
+    """
+    Store a similarity matrix at the given precision; returns (matrix, row_scale)
+    
+    float64 and float32 keep the values as they are (row_scale is None).
+    int8 stores each row as 8-bit codes of its values divided by the row
+    maximum, with that maximum / 255 as the row's scale. Every stored
+    neighbor keeps a code of at least 1, so no neighbor drops out.
+    """
+    if precision not in SIMILARITY_PRECISIONS:
+        raise ValueError(f"Unknown similarity precision: {precision}")
+    if precision != 'int8':
+        return compact_csr(matrix, np.dtype(precision)), None
+    
+    matrix = matrix.tocsr()
+    row_max = np.zeros(matrix.shape[0])
+    nonempty = np.diff(matrix.indptr) > 0
+    row_max[nonempty] = np.maximum.reduceat(matrix.data, matrix.indptr[:-1][nonempty])
+    scale = (row_max / CODE_MAX).astype(np.float32)
+    
+    row_ids = np.repeat(np.arange(matrix.shape[0]), np.diff(matrix.indptr))
+    codes = np.divide(matrix.data, scale[row_ids], out=np.zeros(matrix.nnz), where=scale[row_ids] > 0)
+    codes = np.clip(np.rint(codes), 1, CODE_MAX).astype(np.uint8)
+    return compact_csr(csr_matrix((codes, matrix.indices, matrix.indptr), shape=matrix.shape)), scale
+
+def dequantize_rows(block, row_scale):
+    """Float values of a block of similarity rows; row_scale holds the block rows' scales, or None"""
+    if row_scale is None:
+        return block
+    # Scale the stored values in place of a diagonal product, which scans every column
+    data = block.data.astype(np.float32) * np.repeat(row_scale, np.diff(block.indptr))
+    return csr_matrix((data, block.indices, block.indptr), shape=block.shape)
+
+def csr_nbytes(matrix):
+    return matrix.data.nbytes + matrix.indices.nbytes + matrix.indptr.nbytes
+
+def _overlap(reference, candidate):
+    """Mean share of each reference top-N list found in the candidate list, over non-empty lists"""
+    shares = [len(set(ref) & set(cand)) / len(ref) for ref, cand in zip(reference, candidate) if len(ref)]
+    return float(np.mean(shares)) if shares else 1.0
+
+def precision_report(collaborative, precisions=SIMILARITY_PRECISIONS, num_recommendations=10,
+                     num_users=1000, num_items=1000, seed=42):
+    """
+    Model memory and ranking agreement of each precision against full precision
+    
+    Scores a sample of users and items with the float64 model and with a
+    copy stored at each precision (with compacted interaction data), and
+    reports the mean top-N overlap, the share of identical top-N lists and
+    the bytes of the two matrices.
+    """
+    rng = np.random.default_rng(seed)
+    users = collaborative.users.ids
+    items = collaborative.items.ids
+    users = users[rng.permutation(len(users))[:num_users]]
+    items = items[rng.permutation(len(items))[:num_items]]
+    
+    def rankings(model):
+        user_lists = [pids.tolist() for _, pids, _ in model.iter_top_n_for_users(users, num_recommendations)]
+        item_lists = [pids.tolist() for _, pids, _ in model.iter_top_n_similar_items(items, num_recommendations)]
+        return user_lists, item_lists
+    
+    reference = copy.copy(collaborative).quantize('float64', compact=False)
+    ref_users, ref_items = rankings(reference)
+    
+    report = []
+    for precision in precisions:
+        model = copy.copy(collaborative).quantize(precision)
+        user_lists, item_lists = rankings(model)
+        report.append({
+            'precision': precision,
+            'similarity_bytes': model.similarity_nbytes,
+            'interaction_bytes': csr_nbytes(model.user_item_matrix),
+            'user_overlap': _overlap(ref_users, user_lists),
+            'item_overlap': _overlap(ref_items, item_lists),
+            'identical_user_lists': float(np.mean([a == b for a, b in zip(ref_users, user_lists)])),
+            'identical_item_lists': float(np.mean([a == b for a, b in zip(ref_items, item_lists)]))
+        })
+    return report
+
+def print_report(report, num_recommendations=10):
+    base = report[0]['similarity_bytes'] + report[0]['interaction_bytes']
+    print(f"\n{'precision':<10} {'model MB':>9} {'ratio':>6} {'user@' + str(num_recommendations):>8} "
+          f"{'item@' + str(num_recommendations):>8} {'same user':>10} {'same item':>10}")
+    for row in report:
+        total = row['similarity_bytes'] + row['interaction_bytes']
+        print(f"{row['precision']:<10} {total / 1e6:>9.2f} {base / total:>5.1f}x {row['user_overlap']:>8.3f} "
+              f"{row['item_overlap']:>8.3f} {row['identical_user_lists']:>10.3f} {row['identical_item_lists']:>10.3f}")
+
+# Compare storage precisions on a model snapshot or the sample data
+if __name__ == '__main__':
+    from collaborative_filtering import CollaborativeFilteringRecommender
+    
+    parser = argparse.ArgumentParser(description='Top-N agreement of reduced-precision models with full precision')
+    parser.add_argument('--model', default=None, help='model snapshot directory (default: build from interactions)')
+    parser.add_argument('--top-n', type=int, default=10)
+    parser.add_argument('--sample', type=int, default=1000, help='users and items to compare')
+    args = parser.parse_args()
+    
+    if args.model:
+        cf_recommender = CollaborativeFilteringRecommender.load(args.model)
+    else:
+        cf_recommender = CollaborativeFilteringRecommender()
+        cf_recommender.build_matrix().compute_item_similarity()
+    
+    print_report(precision_report(cf_recommender, num_recommendations=args.top_n,
+                                  num_users=args.sample, num_items=args.sample), args.top_n)
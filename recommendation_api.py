@@ -1,69 +1,260 @@
 # recommendation_api.py
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify
 from hybrid_recommender import HybridRecommender
+from interaction_store import InteractionLog
+from response_cache import ResponseCache
+import functools
+import json
 import logging
+import metrics
+import os
+import threading
+import time
 
 app = Flask(__name__)
 logging.basicConfig(level=logging.INFO)
 
-# Initialize recommender
-recommender = HybridRecommender()
+def create_recommender(**overrides):
+    """
+    Build a recommender from the environment
+    
+    Loads from a saved snapshot when RECOMMENDER_MODEL_PATH points at one,
+    scores with the CF engine named by RECOMMENDER_BACKEND: item_knn or als,
+    and takes similar products from CONTENT_SOURCE: the local content engine
+    or Solr MoreLikeThis. TRENDING_HALF_LIFE_DAYS ranks trending by
+    time-decayed interactions instead of sales, read from
+    RECOMMENDER_INTERACTIONS_FILE when the model comes from a snapshot.
+    Top-N lists precomputed by materialized_store.py are served from
+    RECOMMENDER_MATERIALIZED_PATH for the model version they were built
+    from, except for users and items that online updates have touched.
+    RECOMMENDER_SIMILARITY_PRECISION (float32 or int8) stores the model
+    at reduced precision.
+    """
+    half_life = os.environ.get('TRENDING_HALF_LIFE_DAYS')
+    params = {
+        'model_path': os.environ.get('RECOMMENDER_MODEL_PATH'),
+        'materialized_path': os.environ.get('RECOMMENDER_MATERIALIZED_PATH'),
+        'backend': os.environ.get('RECOMMENDER_BACKEND', 'item_knn'),
+        'content_source': os.environ.get('CONTENT_SOURCE', 'local'),
+        'trending_half_life_days': float(half_life) if half_life else None,
+        'similarity_precision': os.environ.get('RECOMMENDER_SIMILARITY_PRECISION'),
+        'interactions_file': os.environ.get('RECOMMENDER_INTERACTIONS_FILE', 'interactions.json'),
+        **overrides
+    }
+    return HybridRecommender(**params)
+
+# The live recommender; requests take a reference once, so a swap never splits one
+recommender = None
+model_status = {'status': 'loading', 'model_version': None, 'loaded_at': None, 'error': None}
+
+# Seconds a replaced recommender keeps its threads for requests still using it
+RETIRE_DELAY = 30
+
+def install_recommender(new_recommender, retire_delay=RETIRE_DELAY):
+    """Atomically swap in a loaded recommender and retire the previous one after retire_delay seconds"""
+    global recommender
+    old, recommender = recommender, new_recommender
+    model_status.update(status='ready', model_version=new_recommender.model_version,
+                        loaded_at=time.time(), error=None)
+    
+    if old is not None and retire_delay is not None:
+        retire = threading.Timer(retire_delay, old.close)
+        retire.daemon = True
+        retire.start()
+    return new_recommender
+
+def load_recommender(**overrides):
+    """Build a recommender from the environment and swap it in; the old one serves until then"""
+    try:
+        return install_recommender(create_recommender(**overrides))
+    except Exception as e:
+        model_status.update(status='failed' if recommender is None else 'ready', error=str(e))
+        raise
+
+# Set by serve.py so a reload request rolls every worker process instead of this one
+reload_hook = None
+
+# Cache responses per loaded model; a reload drops every entry, posted events
+# drop the entries of their users and items, and the rest age out by TTL
+cache = ResponseCache(max_entries=int(os.environ.get('RECOMMENDER_CACHE_SIZE', 10000)))
+metrics.register_stats('response_cache', cache.stats, gauges=('size',))
+
+def instrumented(endpoint):
+    """
+    Count and time every request to an endpoint
+    
+    With ?profile=1 (or the older ?debug=1) the request is profiled: every
+    stage timed while serving it is collected and returned as timings_ms.
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            if recommender is None:
+                return jsonify({'error': 'Model not loaded', 'status': model_status['status']}), 503
+            
+            start = time.perf_counter()
+            switch = request.args.get('profile') or request.args.get('debug') or ''
+            with metrics.profile(enabled=switch.lower() in ('1', 'true')):
+                response = view(*args, **kwargs)
+            status = response[1] if isinstance(response, tuple) else response.status_code
+            metrics.record_request(endpoint, status, time.perf_counter() - start)
+            return response
+        return wrapper
+    return decorator
+
+def cached(endpoint, key, rec, compute, tags=()):
+    """Serve from the response cache, except for profiled requests, whose stage timings must be real"""
+    if metrics.current_profile() is not None:
+        return compute()
+    return cache.get_or_compute(endpoint, key, rec.loaded_version, compute, tags)
+
+def request_filters():
+    """
+    Attribute filters from the query string, or None
+    
+    in_stock=1, category and brand (repeated or comma-separated, any of
+    them matches), tags (all of them must match), min_price and max_price.
+    """
+    def values(name):
+        return [v for arg in request.args.getlist(name) for v in arg.split(',') if v]
+    
+    filters = {field: values(field) for field in ('category', 'brand', 'tags')}
+    if 'in_stock' in request.args:
+        filters['in_stock'] = request.args['in_stock'].lower() in ('1', 'true')
+    for bound in ('min_price', 'max_price'):
+        if bound in request.args:
+            filters[bound] = float(request.args[bound])
+    
+    filters = {field: value for field, value in filters.items() if value not in (None, [])}
+    return filters or None
+
+def filter_key(filters):
+    return tuple(sorted((field, str(value)) for field, value in (filters or {}).items()))
+
+def respond(payload):
+    """JSON response with serialization timed; profiled requests also get their stage breakdown"""
+    with metrics.stage('api', 'serialize'):
+        response = jsonify(payload)
+    
+    stages = metrics.current_profile()
+    if stages is not None:
+        response = jsonify({**payload, 'timings_ms': dict(stages)})
+    return response
 
 @app.route('/api/recommendations/similar/<product_id>', methods=['GET'])
+@instrumented('similar')
 def get_similar_products(product_id):
     """Get similar products"""
     try:
+        rec = recommender
         num_recs = int(request.args.get('limit', 10))
         user_id = request.args.get('user_id')
+        filters = request_filters()
         
-        recommendations = recommender.hybrid_recommend(
-            product_id, 
-            user_id=user_id,
-            num_recommendations=num_recs
+        recommendations = cached(
+            'similar', (product_id, user_id, num_recs, filter_key(filters)), rec,
+            lambda: rec.hybrid_recommend(
+                product_id, 
+                user_id=user_id,
+                num_recommendations=num_recs,
+                filters=filters
+            ),
+            tags=[('item', product_id)] + ([('user', user_id)] if user_id else [])
         )
         
-        return jsonify({
+        return respond({
             'product_id': product_id,
             'recommendations': recommendations,
             'count': len(recommendations)
         })
     
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/recommendations/user/<user_id>', methods=['GET'])
+@instrumented('user')
 def get_user_recommendations(user_id):
     """Get personalized recommendations for user"""
     try:
+        rec = recommender
         num_recs = int(request.args.get('limit', 10))
+        filters = request_filters()
         
-        recommendations = recommender.personalized_recommendations(
-            user_id,
-            num_recommendations=num_recs
+        recommendations = cached(
+            'user', (user_id, num_recs, filter_key(filters)), rec,
+            lambda: rec.personalized_recommendations(
+                user_id,
+                num_recommendations=num_recs,
+                filters=filters
+            ),
+            tags=[('user', user_id)]
         )
         
-        return jsonify({
+        return respond({
             'user_id': user_id,
             'recommendations': recommendations,
             'count': len(recommendations)
         })
     
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+# Largest batch accepted in one request, and the number of ids scored per block
+MAX_BATCH_SIZE = int(os.environ.get('RECOMMENDER_MAX_BATCH_SIZE', 1000000))
+BATCH_BLOCK_SIZE = 1000
+
+@app.route('/api/recommendations/batch', methods=['POST'])
+@instrumented('batch')
+def get_batch_recommendations():
+    """
+    Recommendations for many users and/or products, streamed as NDJSON
+    
+    Takes {"user_ids": [...], "product_ids": [...], "limit": 10} and writes
+    one JSON line per user, then per product, as each block is scored.
+    """
+    rec = recommender
+    try:
+        payload = request.get_json(force=True)
+        user_ids = [str(u) for u in payload.get('user_ids') or []]
+        product_ids = [str(p) for p in payload.get('product_ids') or []]
+        num_recs = int(payload.get('limit', request.args.get('limit', 10)))
+    except Exception as e:
+        return jsonify({'error': f'Invalid batch request: {e}'}), 400
+    
+    if len(user_ids) + len(product_ids) > MAX_BATCH_SIZE:
+        return jsonify({'error': f'Batch too large: at most {MAX_BATCH_SIZE} ids per request'}), 413
+    
+    def generate():
+        start = time.perf_counter()
+        for result in rec.iter_batch_recommendations(user_ids, product_ids, num_recs, BATCH_BLOCK_SIZE):
+            yield json.dumps(result) + '\n'
+        metrics.record_stage('api', 'batch_stream', time.perf_counter() - start)
+    
+    return Response(generate(), mimetype='application/x-ndjson',
+                    headers={'X-Model-Version': str(rec.model_version)})
+
 @app.route('/api/recommendations/trending', methods=['GET'])
+@instrumented('trending')
 def get_trending():
     """Get trending products"""
     try:
+        rec = recommender
         category = request.args.get('category')
         num_recs = int(request.args.get('limit', 10))
         
-        trending = recommender.trending_products(
-            category=category,
-            num_recommendations=num_recs
+        trending = cached(
+            'trending', (category, num_recs), rec,
+            lambda: rec.trending_products(
+                category=category,
+                num_recommendations=num_recs
+            )
         )
         
-        return jsonify({
+        return respond({
             'category': category,
             'trending': trending,
             'count': len(trending)
@@ -72,9 +263,139 @@ def get_trending():
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+# Set by serve.py: events posted to any worker are appended to this shared
+# EventLog, and every worker applies what any of them appended
+event_log = None
+
+def apply_events(rec, events):
+    """Fold interaction events into this process's CF model, decayed trending and response cache"""
+    rec.collaborative.add_interactions(events)
+    if rec.trending_index:
+        rec.trending_index.add_events(events)
+    cache.invalidate([('user', str(event['user_id'])) for event in events] +
+                     [('item', str(event['product_id'])) for event in events])
+
+@app.route('/api/events', methods=['POST'])
+@instrumented('events')
+def post_events():
+    """Fold new interaction events into the CF model, the session buffers and decayed trending"""
+    try:
+        rec = recommender
+        payload = request.get_json(force=True)
+        events = payload.get('events', []) if isinstance(payload, dict) else payload
+        
+        if event_log is not None:
+            # Reject bad events before they reach the log every worker replays;
+            # catching up applies this batch here and anything the others logged
+            InteractionLog.from_records(events)
+            event_log.append(events)
+            event_log.catch_up(lambda logged: apply_events(rec, logged))
+        else:
+            apply_events(rec, events)
+        # Session buffers are shared between workers already
+        buffered = rec.sessions.add_events(events)
+        
+        return jsonify({
+            'accepted': len(events),
+            'session_events': buffered,
+            'model_version': rec.collaborative.model_version
+        })
+    
+    except (KeyError, TypeError, ValueError) as e:
+        return jsonify({'error': f'Invalid events: {e}'}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/recommendations/session/<session_id>', methods=['GET'])
+@instrumented('session')
+def get_session_recommendations(session_id):
+    """Get recommendations for a live session from its recent events"""
+    try:
+        rec = recommender
+        num_recs = int(request.args.get('limit', 10))
+        
+        # Sessions change with every event, so these are never cached
+        recommendations = rec.session_recommendations(session_id, num_recommendations=num_recs)
+        
+        return respond({
+            'session_id': session_id,
+            'session_items': rec.sessions.session_items(session_id),
+            'recommendations': recommendations,
+            'count': len(recommendations)
+        })
+    
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/sessions/<session_id>/events', methods=['POST'])
+@instrumented('session_events')
+def post_session_events(session_id):
+    """Buffer a session's events for session recommendations only, without updating the CF model"""
+    try:
+        rec = recommender
+        payload = request.get_json(force=True)
+        events = payload.get('events', [payload]) if isinstance(payload, dict) else payload
+        
+        buffered = sum(
+            rec.sessions.add_event(session_id, event['product_id'], event.get('interaction_type', 'view'))
+            for event in events
+        )
+        
+        return jsonify({'session_id': session_id, 'accepted': len(events), 'buffered': buffered})
+    
+    except (KeyError, TypeError, AttributeError) as e:
+        return jsonify({'error': f'Invalid events: {e}'}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/cache/stats', methods=['GET'])
+def get_cache_stats():
+    """Response cache hit/miss counters, summed over the workers of a preforked server"""
+    stats = metrics.combined_stats('response_cache')
+    lookups = stats['hits'] + stats['misses']
+    stats['hit_rate'] = stats['hits'] / lookups if lookups else 0.0
+    stats['model_version'] = cache.stats()['model_version']
+    return jsonify(stats)
+
+@app.route('/api/metrics', methods=['GET'])
+def get_metrics():
+    """Latency histograms and counters in the Prometheus text format"""
+    return Response(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+@app.route('/api/model/reload', methods=['POST'])
+def reload_model():
+    """Load the model again from its configured source and swap it in while serving continues"""
+    if reload_hook is not None:
+        reload_hook()
+        return jsonify({'status': 'reloading', 'pid': os.getpid()}), 202
+    
+    try:
+        rec = load_recommender()
+    except Exception as e:
+        return jsonify({'error': f'Reload failed: {e}', 'model_version': model_status['model_version']}), 500
+    return jsonify({'status': 'ready', 'model_version': rec.model_version})
+
+@app.route('/api/ready', methods=['GET'])
+def readiness_check():
+    """Readiness: 200 once a model is loaded and serving, 503 before"""
+    rec = recommender
+    body = {
+        **model_status,
+        'model_version': rec.model_version if rec is not None else None,
+        'backend': rec.backend if rec is not None else None,
+        'materialized_version': rec.materialized.model_version if rec is not None and rec.materialized else None,
+        'pid': os.getpid()
+    }
+    return jsonify(body), 200 if rec is not None else 503
+
 @app.route('/api/health', methods=['GET'])
 def health_check():
     return jsonify({'status': 'healthy', 'service': 'recommendation-engine'})
 
+# Load at import for the development server and WSGI hosts; serve.py sets
+# RECOMMENDER_PRELOAD=0 and loads the model itself before forking workers
+if os.environ.get('RECOMMENDER_PRELOAD', '1') != '0':
+    load_recommender()
+
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=5000, debug=True)
\ No newline at end of file
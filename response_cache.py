@@ -0,0 +1,138 @@
+# response_cache.py
+import threading
+import time
+from collections import OrderedDict
+
+# Seconds each endpoint's responses stay fresh
+DEFAULT_TTLS = {
+    'similar': 300,
+    'user': 60,
+    'trending': 120
+}
+
+class ResponseCache:
+    """
+    In-process LRU cache for recommendation responses
+    
+    Entries are keyed on endpoint, request key and model version and expire
+    after the endpoint's TTL. Concurrent misses for the same key wait for a
+    single computation. Seeing a new model version drops every entry, so
+    callers pass the version of a reload, not of each online update; an
+    update drops just the entries tagged with its users and items instead.
+    """
+    
+    def __init__(self, max_entries=10000, ttls=None, default_ttl=60):
+        self.max_entries = max_entries
+        self.ttls = {**DEFAULT_TTLS, **(ttls or {})}
+        self.default_ttl = default_ttl
+        
+        self._entries = OrderedDict()
+        self._inflight = {}
+        self._tagged = {}
+        # Tags of the keys being computed, and those an invalidation raced, which are not stored
+        self._inflight_tags = {}
+        self._stale = set()
+        self._version = None
+        self._lock = threading.Lock()
+        
+        self.hits = 0
+        self.misses = 0
+        self.collapsed = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self.invalidated = 0
+    
+    def get_or_compute(self, endpoint, key, version, compute, tags=()):
+        """Return the cached response for key, calling compute() at most once per miss"""
+        full_key = (endpoint, version) + tuple(key)
+        
+        while True:
+            with self._lock:
+                if version != self._version:
+                    self._invalidate(version)
+                
+                entry = self._entries.get(full_key)
+                if entry is not None and entry[1] > time.monotonic():
+                    self._entries.move_to_end(full_key)
+                    self.hits += 1
+                    return entry[0]
+                
+                pending = self._inflight.get(full_key)
+                if pending is None:
+                    # This caller computes; later callers wait on the event
+                    pending = self._inflight[full_key] = threading.Event()
+                    self._inflight_tags[full_key] = frozenset(tags)
+                    self.misses += 1
+                    break
+                self.collapsed += 1
+            
+            # Another thread is computing this key; wait and look again
+            pending.wait()
+        
+        try:
+            value = compute()
+            with self._lock:
+                if version == self._version and full_key not in self._stale:
+                    ttl = self.ttls.get(endpoint, self.default_ttl)
+                    self._entries[full_key] = (value, time.monotonic() + ttl, tuple(tags))
+                    self._entries.move_to_end(full_key)
+                    for tag in tags:
+                        self._tagged.setdefault(tag, set()).add(full_key)
+                    while len(self._entries) > self.max_entries:
+                        self._remove(next(iter(self._entries)))
+                        self.evictions += 1
+            return value
+        finally:
+            with self._lock:
+                self._inflight.pop(full_key, None)
+                self._inflight_tags.pop(full_key, None)
+                self._stale.discard(full_key)
+            pending.set()
+    
+    def _remove(self, full_key):
+        """Drop one entry and its tag references; called with the lock held"""
+        for tag in self._entries.pop(full_key)[2]:
+            keys = self._tagged[tag]
+            keys.discard(full_key)
+            if not keys:
+                del self._tagged[tag]
+    
+    def _invalidate(self, version):
+        """Drop every entry; called with the lock held when the model version changes"""
+        if self._version is not None:
+            self.invalidations += 1
+        self._entries.clear()
+        self._tagged.clear()
+        self._version = version
+    
+    def invalidate(self, tags):
+        """Drop the entries tagged with any of tags, such as the users and items of an update"""
+        tags = set(tags)
+        with self._lock:
+            for full_key, key_tags in self._inflight_tags.items():
+                if not key_tags.isdisjoint(tags):
+                    self._stale.add(full_key)
+            for tag in tags:
+                for full_key in list(self._tagged.get(tag, ())):
+                    self._remove(full_key)
+                    self.invalidated += 1
+    
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._tagged.clear()
+    
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'collapsed': self.collapsed,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations,
+                'invalidated': self.invalidated,
+                'size': len(self._entries),
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'model_version': self._version
+            }
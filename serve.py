@@ -0,0 +1,285 @@
+# serve.py
+import argparse
+import gc
+import os
+import shutil
+import signal
+import socket
+import sys
+import tempfile
+import threading
+import time
+
+# The arbiter loads the model itself, once, before forking workers
+os.environ['RECOMMENDER_PRELOAD'] = '0'
+
+import recommendation_api as api
+import metrics
+from interaction_store import EventLog
+from werkzeug.serving import make_server
+from werkzeug.wsgi import ClosingIterator
+
+# Events posted to any worker, in metrics_dir, applied by every process
+EVENT_LOG_FILE = 'events.jsonl'
+
+class InFlightCounter:
+    """WSGI middleware counting requests in progress, so a worker can drain before exiting"""
+    
+    def __init__(self, app):
+        self.app = app
+        self.active = 0
+        self._lock = threading.Lock()
+    
+    def __call__(self, environ, start_response):
+        with self._lock:
+            self.active += 1
+        try:
+            # The request stays in flight until its (possibly streamed) body is closed
+            return ClosingIterator(self.app(environ, start_response), self._finished)
+        except BaseException:
+            self._finished()
+            raise
+    
+    def _finished(self):
+        with self._lock:
+            self.active -= 1
+    
+    def wait_idle(self, timeout):
+        deadline = time.monotonic() + timeout
+        while self.active and time.monotonic() < deadline:
+            time.sleep(0.05)
+
+class Arbiter:
+    """
+    Preforking server for the recommendation API
+    
+    The arbiter loads the model, binds the listening socket and forks the
+    workers, so every worker shares the model's memory: snapshot arrays are
+    memory-mapped from the page cache, and anything built in the arbiter is
+    shared copy-on-write. Each worker runs a threaded WSGI server on the
+    shared socket and the kernel spreads connections across them.
+    
+    SIGHUP (or POST /api/model/reload on any worker) loads the model again
+    in the arbiter, forks a fresh set of workers with it and then drains
+    and stops the old ones, so the socket is never left without a worker.
+    SIGTERM or SIGINT stops everything after in-flight requests finish.
+    
+    Workers write their metrics and response cache counters to metrics_dir
+    (a temporary directory by default), so /api/metrics and
+    /api/cache/stats on any worker report the sum over all of them; the
+    arbiter folds in the last counts of every worker that exits, so
+    counters never go backwards across reloads.
+    
+    Events posted to /api/events are appended to a log in metrics_dir that
+    every worker follows, so all of them apply every event within a second,
+    and the worker that took the POST before it responds. The arbiter
+    replays the log onto every model it loads, so workers forked by a
+    reload start with the events posted since the server started. Session
+    buffers live in
+    shared memory allocated by the arbiter, so every worker sees every
+    session; a reload starts them empty, since item indices may change.
+    """
+    
+    def __init__(self, host='0.0.0.0', port=5000, workers=None, trending_refresh_interval=300,
+                 graceful_timeout=30, metrics_dir=None):
+        self.host = host
+        self.port = port
+        self.num_workers = workers or os.cpu_count()
+        self.trending_refresh_interval = trending_refresh_interval
+        self.graceful_timeout = graceful_timeout
+        self.metrics_dir = metrics_dir
+        self.event_log = None
+        
+        self.socket = None
+        self.workers = set()
+        self.retiring = {}
+        self._reload = False
+        self._stop = False
+    
+    def bind(self):
+        family = socket.AF_INET6 if ':' in self.host else socket.AF_INET
+        self.socket = socket.socket(family, socket.SOCK_STREAM)
+        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.socket.bind((self.host, self.port))
+        self.socket.listen(1024)
+        self.socket.set_inheritable(True)
+    
+    def load(self):
+        """Load the model in the arbiter; workers forked afterwards share it"""
+        start = time.perf_counter()
+        # Background threads do not survive fork, so trending refresh starts in each
+        # worker, and the replaced model is dropped rather than retired on a timer
+        recommender = api.create_recommender(trending_refresh_interval=None)
+        
+        # Replay the events posted since the server started; workers follow the log from here
+        event_log = EventLog(os.path.join(self.metrics_dir, EVENT_LOG_FILE))
+        replayed = event_log.catch_up(lambda events: api.apply_events(recommender, events))
+        if replayed:
+            print(f"Replayed {replayed} logged events")
+        
+        self.event_log = event_log
+        api.install_recommender(recommender, retire_delay=None)
+        gc.collect()
+        print(f"Loaded model {api.recommender.model_version} in {time.perf_counter() - start:.1f}s")
+    
+    def spawn(self):
+        pid = os.fork()
+        if pid:
+            self.workers.add(pid)
+            return pid
+        
+        # Worker process
+        status = 0
+        try:
+            self.run_worker()
+        except BaseException as e:
+            print(f"Worker {os.getpid()} failed: {e}", file=sys.stderr)
+            status = 1
+        finally:
+            os._exit(status)
+    
+    def run_worker(self):
+        arbiter_pid = os.getppid()
+        for sig in (signal.SIGHUP, signal.SIGINT):
+            signal.signal(sig, signal.SIG_IGN)
+        
+        metrics.enable_multiprocess(self.metrics_dir)
+        
+        recommender = api.recommender
+        if recommender.trending_index and self.trending_refresh_interval:
+            recommender.trending_index.refresh_interval = self.trending_refresh_interval
+            recommender.trending_index.start()
+        
+        # Reload requests are handled by the arbiter, for every worker at once
+        api.reload_hook = lambda: os.kill(arbiter_pid, signal.SIGHUP)
+        
+        # Posted events go through the shared log, so every worker applies them
+        api.event_log = self.event_log.follow(lambda events: api.apply_events(api.recommender, events))
+        
+        app = InFlightCounter(api.app)
+        server = make_server(self.host, self.port, app, threaded=True, fd=self.socket.fileno())
+        
+        def stop(signum, frame):
+            # shutdown() waits for serve_forever to return, so call it off the main thread
+            threading.Thread(target=server.shutdown, daemon=True).start()
+        signal.signal(signal.SIGTERM, stop)
+        
+        print(f"Worker {os.getpid()} serving model {recommender.model_version}")
+        server.serve_forever()
+        app.wait_idle(self.graceful_timeout)
+        metrics.flush()
+    
+    def reap(self):
+        """Collect exited workers; returns the pids of unexpected exits"""
+        crashed = []
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                break
+            if not pid:
+                break
+            metrics.retire_process(self.metrics_dir, pid)
+            if pid in self.retiring:
+                del self.retiring[pid]
+            elif pid in self.workers:
+                self.workers.discard(pid)
+                crashed.append(pid)
+        return crashed
+    
+    def reload(self):
+        """Load a new model, start workers on it, then retire the old workers"""
+        try:
+            self.load()
+        except Exception as e:
+            print(f"Model reload failed, keeping current workers: {e}", file=sys.stderr)
+            return
+        
+        old_workers = set(self.workers)
+        self.workers = set()
+        for _ in range(self.num_workers):
+            self.spawn()
+        self.retire(old_workers)
+    
+    def retire(self, pids):
+        deadline = time.monotonic() + self.graceful_timeout
+        for pid in pids:
+            self.retiring[pid] = deadline
+            self._signal(pid, signal.SIGTERM)
+    
+    def _signal(self, pid, sig):
+        try:
+            os.kill(pid, sig)
+        except ProcessLookupError:
+            pass
+    
+    def run(self):
+        # Start from empty totals and no logged events: both restart with the server
+        owns_metrics_dir = self.metrics_dir is None
+        self.metrics_dir = self.metrics_dir or tempfile.mkdtemp(prefix='recommender-metrics-')
+        os.makedirs(self.metrics_dir, exist_ok=True)
+        for entry in os.listdir(self.metrics_dir):
+            if entry.endswith('.json') or entry == EVENT_LOG_FILE:
+                os.remove(os.path.join(self.metrics_dir, entry))
+        
+        self.bind()
+        self.load()
+        
+        def request_reload(signum, frame):
+            self._reload = True
+        def request_stop(signum, frame):
+            self._stop = True
+        signal.signal(signal.SIGHUP, request_reload)
+        signal.signal(signal.SIGTERM, request_stop)
+        signal.signal(signal.SIGINT, request_stop)
+        
+        for _ in range(self.num_workers):
+            self.spawn()
+        print(f"Serving on {self.host}:{self.port} with {self.num_workers} workers (arbiter {os.getpid()})")
+        
+        while not self._stop:
+            for pid in self.reap():
+                print(f"Worker {pid} exited unexpectedly, restarting", file=sys.stderr)
+                self.spawn()
+            
+            if self._reload:
+                self._reload = False
+                self.reload()
+            
+            # Kill workers that did not drain in time
+            now = time.monotonic()
+            for pid, deadline in list(self.retiring.items()):
+                if now > deadline:
+                    self._signal(pid, signal.SIGKILL)
+            
+            time.sleep(0.2)
+        
+        self.retire(self.workers)
+        self.workers = set()
+        while self.retiring:
+            self.reap()
+            now = time.monotonic()
+            for pid, deadline in list(self.retiring.items()):
+                if now > deadline:
+                    self._signal(pid, signal.SIGKILL)
+            time.sleep(0.1)
+        self.socket.close()
+        if owns_metrics_dir:
+            shutil.rmtree(self.metrics_dir, ignore_errors=True)
+        print("Server stopped")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Preforking production server for the recommendation API')
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=5000)
+    parser.add_argument('--workers', type=int, default=None, help='worker processes (default: one per core)')
+    parser.add_argument('--trending-refresh', type=float, default=300,
+                        help='seconds between trending index refreshes in each worker')
+    parser.add_argument('--graceful-timeout', type=float, default=30)
+    parser.add_argument('--metrics-dir', default=None,
+                        help='directory where workers share their metrics and posted events '
+                             '(default: a temporary directory)')
+    args = parser.parse_args()
+    
+    Arbiter(args.host, args.port, args.workers, args.trending_refresh, args.graceful_timeout,
+            args.metrics_dir).run()
@@ -0,0 +1,307 @@
+# session_recommender.py
+import hashlib
+import mmap
+import multiprocessing
+import time
+import numpy as np
+from collaborative_filtering import _top_n
+from interaction_store import INTERACTION_TYPES, INTERACTION_WEIGHTS, TYPE_CODES
+import metrics
+
+# Session table markers: a never-used position, and one whose session was released
+EMPTY, TOMBSTONE = -1, -2
+
+# Fields of the shared header: ends of the least-recently-active list, free slots,
+# live sessions, evictions and tombstones in the session table
+HEAD, TAIL, FREE, SESSIONS, EVICTIONS, TOMBSTONES = range(6)
+
+def _shared_array(shape, dtype, fill=0):
+    """Array in anonymous shared memory, shared with every process forked after it is created"""
+    dtype = np.dtype(dtype)
+    count = int(np.prod(shape))
+    array = np.frombuffer(mmap.mmap(-1, max(count * dtype.itemsize, 1)), dtype=dtype, count=count).reshape(shape)
+    if fill:
+        array[...] = fill
+    return array
+
+def _session_key(session_id):
+    """Stable 64-bit key of a session id, the same in every process; 0 marks a free slot"""
+    digest = hashlib.blake2b(str(session_id).encode(), digest_size=8).digest()
+    return int.from_bytes(digest, 'little') or 1
+
+class SessionRecommender:
+    """
+    Real-time recommendations from the items seen in the current session
+    
+    Each live session owns one slot of preallocated ring buffers holding
+    its last buffer_size item indices, interaction type codes and arrival
+    times, so an event is a few array writes and memory is fixed at
+    max_sessions slots. Sessions idle for idle_timeout seconds are evicted,
+    and when every slot is taken the least recently active session makes
+    room.
+    
+    The buffers, the table from session keys to slots and the
+    least-recently-active list all live in shared memory behind a
+    process-shared lock, so the workers a preforked server forks after
+    creating the recommender (see serve.py) see every session's events,
+    whichever worker received them. Only items of the model as it was
+    loaded are buffered: items added online by one worker are unknown to
+    the others.
+    
+    A session is scored by summing the CF neighbor rows of its buffered
+    items, each weighted by its interaction type weight and halved every
+    half_life seconds since it happened. Items already in the buffer are
+    excluded.
+    """
+    
+    def __init__(self, collaborative, max_sessions=100000, buffer_size=20, idle_timeout=1800,
+                 half_life=600):
+        self.collaborative = collaborative
+        self.max_sessions = max_sessions
+        self.buffer_size = buffer_size
+        self.idle_timeout = idle_timeout
+        self.half_life = half_life
+        self.num_items = len(collaborative.items)
+        
+        self.items = _shared_array((max_sessions, buffer_size), np.int32, fill=-1)
+        self.types = _shared_array((max_sessions, buffer_size), np.int8)
+        self.times = _shared_array((max_sessions, buffer_size), np.float64)
+        self.heads = _shared_array(max_sessions, np.int32)
+        
+        # Open-addressing table from session key to slot, at most half full
+        self._capacity = 1 << max(2 * max_sessions - 1, 1).bit_length()
+        self._table = _shared_array(self._capacity, np.int32, fill=EMPTY)
+        
+        # Per slot: its session's key, last activity and links in the
+        # least-recently-active list; then a stack of free slots
+        self._keys = _shared_array(max_sessions, np.uint64)
+        self._last_seen = _shared_array(max_sessions, np.float64)
+        self._prev = _shared_array(max_sessions, np.int32, fill=-1)
+        self._next = _shared_array(max_sessions, np.int32, fill=-1)
+        self._free = _shared_array(max_sessions, np.int32)
+        self._free[:] = np.arange(max_sessions - 1, -1, -1)
+        
+        self._header = _shared_array(6, np.int64)
+        self._header[[HEAD, TAIL, FREE]] = [-1, -1, max_sessions]
+        self._lock = multiprocessing.Lock()
+    
+    def __len__(self):
+        return int(self._header[SESSIONS])
+    
+    @property
+    def evictions(self):
+        return int(self._header[EVICTIONS])
+    
+    def _find(self, key):
+        """
+        Table position and slot of a session key
+        
+        When the key is absent the slot is -1 and the position is where it
+        would be inserted. Called with the lock held, as are all the
+        table and list helpers below.
+        """
+        mask = self._capacity - 1
+        pos = key & mask
+        reusable = -1
+        while True:
+            slot = int(self._table[pos])
+            if slot == EMPTY:
+                return (pos if reusable < 0 else reusable), -1
+            if slot == TOMBSTONE:
+                if reusable < 0:
+                    reusable = pos
+            elif int(self._keys[slot]) == key:
+                return pos, slot
+            pos = (pos + 1) & mask
+    
+    def _rehash(self):
+        """Rebuild the table without tombstones, so probe sequences stay short"""
+        self._table[:] = EMPTY
+        for slot in np.flatnonzero(self._keys).tolist():
+            pos, _ = self._find(int(self._keys[slot]))
+            self._table[pos] = slot
+        self._header[TOMBSTONES] = 0
+    
+    def _unlink(self, slot):
+        prev, next_ = int(self._prev[slot]), int(self._next[slot])
+        if prev >= 0:
+            self._next[prev] = next_
+        else:
+            self._header[HEAD] = next_
+        if next_ >= 0:
+            self._prev[next_] = prev
+        else:
+            self._header[TAIL] = prev
+    
+    def _append(self, slot):
+        """Make a slot the most recently active"""
+        tail = int(self._header[TAIL])
+        self._prev[slot], self._next[slot] = tail, -1
+        if tail >= 0:
+            self._next[tail] = slot
+        else:
+            self._header[HEAD] = slot
+        self._header[TAIL] = slot
+    
+    def _release(self, slot):
+        pos, _ = self._find(int(self._keys[slot]))
+        self._table[pos] = TOMBSTONE
+        self._header[TOMBSTONES] += 1
+        self._unlink(slot)
+        
+        self._keys[slot] = 0
+        self.items[slot] = -1
+        self.heads[slot] = 0
+        self._free[self._header[FREE]] = slot
+        self._header[FREE] += 1
+        self._header[SESSIONS] -= 1
+        self._header[EVICTIONS] += 1
+    
+    def _evict_idle(self, now):
+        """Free the slots of sessions idle past the timeout, least recently active first"""
+        while self._header[HEAD] >= 0:
+            slot = int(self._header[HEAD])
+            if now - self._last_seen[slot] < self.idle_timeout:
+                break
+            self._release(slot)
+    
+    def _slot(self, key, now):
+        """Slot of a session, claiming one (and evicting if full) for a new session"""
+        pos, slot = self._find(key)
+        if slot < 0:
+            self._evict_idle(now)
+            if not self._header[FREE]:
+                self._release(int(self._header[HEAD]))
+            pos, _ = self._find(key)
+            
+            self._header[FREE] -= 1
+            slot = int(self._free[self._header[FREE]])
+            if self._table[pos] == TOMBSTONE:
+                self._header[TOMBSTONES] -= 1
+            self._table[pos] = slot
+            self._keys[slot] = key
+            self._header[SESSIONS] += 1
+            if self._header[TOMBSTONES] > self._capacity // 4:
+                self._rehash()
+        else:
+            self._unlink(slot)
+        self._append(slot)
+        self._last_seen[slot] = now
+        return slot
+    
+    def _live_slot(self, session_id, now):
+        """Slot of a session that has not timed out, or None; called with the lock held"""
+        _, slot = self._find(_session_key(session_id))
+        if slot < 0 or now - self._last_seen[slot] >= self.idle_timeout:
+            return None
+        return slot
+    
+    def add_event(self, session_id, product_id, interaction_type='view', now=None):
+        """Append one event to its session's buffer; returns False for items the model does not know"""
+        item_idx = self.collaborative.items.index(product_id)
+        if item_idx is None or item_idx >= self.num_items:
+            return False
+        
+        now = time.time() if now is None else now
+        type_code = TYPE_CODES.get(interaction_type, 0)
+        key = _session_key(session_id)
+        with self._lock:
+            slot = self._slot(key, now)
+            head = self.heads[slot]
+            self.items[slot, head] = item_idx
+            self.types[slot, head] = type_code
+            self.times[slot, head] = now
+            self.heads[slot] = (head + 1) % self.buffer_size
+        return True
+    
+    def add_events(self, events):
+        """Buffer the events that carry a session_id; returns how many were buffered"""
+        now = time.time()
+        added = 0
+        for event in events:
+            session_id = event.get('session_id')
+            if session_id and self.add_event(session_id, event['product_id'],
+                                             event.get('interaction_type', 'view'), now):
+                added += 1
+        return added
+    
+    def session_items(self, session_id):
+        """Product ids in a session's buffer, oldest first"""
+        with self._lock:
+            _, slot = self._find(_session_key(session_id))
+            if slot < 0:
+                return []
+            order = np.roll(self.items[slot], -int(self.heads[slot]))
+        return self.collaborative.item_ids[order[order >= 0]].tolist()
+    
+    def top_n_for_session(self, session_id, num_recommendations=10, now=None):
+        """Top-N items for a session as (product_ids, scores) arrays"""
+        now = time.time() if now is None else now
+        with self._lock:
+            slot = self._live_slot(session_id, now)
+            if slot is None:
+                return np.array([], dtype=str), np.array([])
+            items = self.items[slot].copy()
+            types = self.types[slot].copy()
+            times = self.times[slot].copy()
+        
+        with metrics.stage('session', 'scoring'):
+            # Items added since the last swap of the model matrices have no neighbor row yet
+            _, similarity = self.collaborative._model_matrices()
+            filled = (items >= 0) & (items < similarity.shape[0])
+            items, types, times = items[filled], types[filled], times[filled]
+            weights = INTERACTION_WEIGHTS[types] * 0.5 ** ((now - times) / self.half_life)
+            
+            # Concatenate the neighbor rows, gathered straight from the CSR arrays
+            rows, row_scale = similarity.take(items)
+            if row_scale is not None:
+                weights = weights * row_scale
+            neighbors = rows.indices
+            contributions = rows.data * np.repeat(weights, np.diff(rows.indptr))
+            
+            candidates, inverse = np.unique(neighbors, return_inverse=True)
+            scores = np.bincount(inverse, weights=contributions, minlength=len(candidates))
+            unseen = ~np.isin(candidates, items)
+            item_idx, scores = _top_n(candidates[unseen], scores[unseen], num_recommendations)
+        return self.collaborative.item_ids[item_idx], scores
+    
+    def recommend_for_session(self, session_id, num_recommendations=10):
+        """Recommend items for a session from its recent events"""
+        product_ids, scores = self.top_n_for_session(session_id, num_recommendations)
+        return [
+            {'product_id': pid, 'score': float(score)}
+            for pid, score in zip(product_ids.tolist(), scores)
+        ]
+    
+    def stats(self):
+        with self._lock:
+            return {
+                'sessions': len(self),
+                'max_sessions': self.max_sessions,
+                'buffer_size': self.buffer_size,
+                'evictions': self.evictions
+            }
+
+# Replay sessions from the interaction log and recommend for one
+if __name__ == '__main__':
+    from collaborative_filtering import CollaborativeFilteringRecommender
+    
+    cf_recommender = CollaborativeFilteringRecommender()
+    cf_recommender.build_matrix().compute_item_similarity()
+    sessions = SessionRecommender(cf_recommender)
+    
+    log = cf_recommender.interactions
+    order = np.argsort(log.timestamps, kind='stable')
+    start = time.perf_counter()
+    for i in order.tolist():
+        sessions.add_event(log.session_ids[log.session_codes[i]], log.item_ids[log.item_codes[i]],
+                           INTERACTION_TYPES[log.type_codes[i]])
+    elapsed = time.perf_counter() - start
+    print(f"Buffered {len(order)} events in {len(sessions)} sessions "
+          f"({elapsed / max(len(order), 1) * 1e6:.1f} µs per event)")
+    
+    session_id = log.session_ids[log.session_codes[order[-1]]]
+    print(f"\n=== Recommendations for {session_id} ===\n")
+    print(f"Session items: {sessions.session_items(session_id)}")
+    for i, rec in enumerate(sessions.recommend_for_session(session_id, 10), 1):
+        print(f"{i}. {rec['product_id']} (Score: {rec['score']:.4f})")
@@ -0,0 +1,124 @@
+# similarity_build.py
+import os
+import shutil
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from scipy.sparse import csr_matrix
+from collaborative_filtering import _similarity_block
+
+# Memory-mapped inputs of the worker processes, set by _init_worker
+_shared = {}
+
+def _save_csr(directory, name, matrix):
+    for part in ('data', 'indices', 'indptr'):
+        np.save(os.path.join(directory, f'{name}_{part}.npy'), getattr(matrix, part))
+
+def _load_csr(directory, name, shape, mmap_mode='r'):
+    parts = [np.load(os.path.join(directory, f'{name}_{part}.npy'), mmap_mode=mmap_mode)
+             for part in ('data', 'indices', 'indptr')]
+    return csr_matrix(tuple(parts), shape=shape, copy=False)
+
+# Inputs written once by the parent and mapped by every worker
+SHARED_MATRICES = ('item_user', 'user_item')
+
+def _init_worker(work_dir, shape):
+    """Map the item-user matrix, its transpose and the item norms once per worker process"""
+    _shared['item_user'] = _load_csr(work_dir, 'item_user', shape)
+    _shared['user_item'] = _load_csr(work_dir, 'user_item', shape[::-1])
+    _shared['item_norms'] = np.load(os.path.join(work_dir, 'item_norms.npy'), mmap_mode='r')
+    _shared['work_dir'] = work_dir
+
+def _build_shard(start, stop, top_k, min_similarity):
+    """Compute and prune one row block of the neighbor index and write it as a shard"""
+    similarity = _similarity_block(_shared['item_user'], _shared['item_norms'], np.arange(start, stop),
+                                   top_k, min_similarity, _shared['user_item'])
+    
+    shard_dir = os.path.join(_shared['work_dir'], f'shard-{start:012d}')
+    os.makedirs(shard_dir, exist_ok=True)
+    _save_csr(shard_dir, 'similarity', similarity)
+    return start, stop, similarity.nnz
+
+def _merge_shards(work_dir, shards, n_items, dtype):
+    """
+    Concatenate the shards into one CSR matrix backed by memory-mapped files in work_dir
+    
+    Shards are copied one at a time and deleted as they go, so the merge
+    holds a single shard in memory.
+    """
+    total = sum(nnz for _, _, nnz in shards)
+    index_type = np.int32 if max(total, n_items) < 2 ** 31 else np.int64
+    
+    data = np.lib.format.open_memmap(os.path.join(work_dir, 'item_similarity_data.npy'), mode='w+',
+                                     dtype=dtype, shape=(total,))
+    indices = np.lib.format.open_memmap(os.path.join(work_dir, 'item_similarity_indices.npy'), mode='w+',
+                                        dtype=index_type, shape=(total,))
+    indptr = np.zeros(n_items + 1, dtype=index_type)
+    
+    offset = 0
+    for start, stop, nnz in shards:
+        shard_dir = os.path.join(work_dir, f'shard-{start:012d}')
+        shard = _load_csr(shard_dir, 'similarity', (stop - start, n_items), mmap_mode=None)
+        data[offset:offset + nnz] = shard.data
+        indices[offset:offset + nnz] = shard.indices
+        indptr[start + 1:stop + 1] = offset + shard.indptr[1:]
+        offset += nnz
+        shutil.rmtree(shard_dir)
+    
+    data.flush()
+    indices.flush()
+    np.save(os.path.join(work_dir, 'item_similarity_indptr.npy'), indptr)
+    del data, indices
+    return _load_csr(work_dir, 'item_similarity', (n_items, n_items))
+
+def build_item_similarity(item_user_matrix, item_norms, top_k=100, min_similarity=0.0,
+                          block_size=1000, workers=None, work_dir=None):
+    """
+    Build the pruned item-item cosine neighbor index in a process pool
+    
+    The item-user matrix, its transpose and the item norms are written to
+    work_dir once and memory-mapped by every worker, so they are shared
+    through the page cache instead of being copied per process. Workers
+    compute row blocks of block_size items exactly as the serial build
+    does and write each pruned block as a shard; the shards are then
+    merged into the final index, memory-mapped from work_dir. Peak memory
+    per worker is bounded by one block's dot products.
+    
+    Without a work_dir a temporary directory is used and removed after the
+    merge; the mapped result stays readable until it is released.
+    """
+    workers = workers or os.cpu_count()
+    n_items = item_user_matrix.shape[0]
+    owns_dir = work_dir is None
+    work_dir = work_dir or tempfile.mkdtemp(prefix='item-similarity-')
+    os.makedirs(work_dir, exist_ok=True)
+    start_time = time.perf_counter()
+    
+    try:
+        shape = item_user_matrix.shape
+        _save_csr(work_dir, 'item_user', item_user_matrix)
+        _save_csr(work_dir, 'user_item', item_user_matrix.T.tocsr())
+        np.save(os.path.join(work_dir, 'item_norms.npy'), item_norms)
+        
+        starts = list(range(0, n_items, block_size))
+        stops = [min(start + block_size, n_items) for start in starts]
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                 initargs=(work_dir, shape)) as executor:
+            shards = list(executor.map(_build_shard, starts, stops,
+                                       [top_k] * len(starts), [min_similarity] * len(starts)))
+        
+        similarity = _merge_shards(work_dir, shards, n_items, np.float64)
+    finally:
+        inputs = [f'{name}_{part}.npy' for name in SHARED_MATRICES for part in ('data', 'indices', 'indptr')]
+        for filename in inputs + ['item_norms.npy']:
+            path = os.path.join(work_dir, filename)
+            if os.path.exists(path):
+                os.remove(path)
+        if owns_dir:
+            # Mapped files stay readable after unlinking on POSIX systems
+            shutil.rmtree(work_dir, ignore_errors=True)
+    
+    print(f"Built {len(starts)} similarity shards with {workers} workers "
+          f"in {time.perf_counter() - start_time:.1f}s")
+    return similarity
@@ -0,0 +1,98 @@
+# solr_client.py
+import asyncio
+import requests
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+import metrics
+
+SOLR_URL = "http://localhost:8983/solr/products"
+
+def query_type(params):
+    """Metrics label for the shape of a /select query"""
+    query = str(params.get('q', ''))
+    if params.get('mlt'):
+        return 'mlt'
+    if query.startswith('{!terms'):
+        return 'terms'
+    if query.startswith('id:'):
+        return 'get'
+    return 'filter'
+
+class SolrClient:
+    """Solr client with keep-alive connection pooling, timeouts and retries"""
+    
+    def __init__(self, solr_url=SOLR_URL, timeout=(1.0, 5.0), retries=2,
+                 backoff_factor=0.1, pool_size=20):
+        self.solr_url = solr_url
+        # (connect, read) timeout in seconds
+        self.timeout = timeout
+        
+        # Retry idempotent reads on connection errors and transient 5xx responses
+        retry = Retry(
+            total=retries,
+            backoff_factor=backoff_factor,
+            status_forcelist=(502, 503, 504),
+            allowed_methods=('GET', 'POST')
+        )
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=retry)
+        
+        self.session = requests.Session()
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+    
+    def select(self, params):
+        """Run a /select query and return the decoded JSON response"""
+        kind = query_type(params)
+        try:
+            with metrics.solr_query(kind):
+                response = self.session.get(
+                    f"{self.solr_url}/select",
+                    params={**params, 'wt': 'json'},
+                    timeout=self.timeout
+                )
+                response.raise_for_status()
+                result = response.json()
+        except Exception:
+            metrics.SOLR_QUERIES.labels(kind, 'error').inc()
+            raise
+        
+        metrics.SOLR_QUERIES.labels(kind, 'ok').inc()
+        return result
+    
+    def search(self, params):
+        """Run a /select query and return the matching docs"""
+        return self.select(params)['response']['docs']
+    
+    def close(self):
+        self.session.close()
+
+class AsyncSolrClient:
+    """
+    asyncio front end that runs many pooled Solr queries concurrently
+    
+    Each query runs the blocking SolrClient on a worker thread, so it keeps
+    the client's pooled keep-alive connections, timeouts and retries, and
+    up to max_concurrency queries are in flight without blocking the loop.
+    """
+    
+    def __init__(self, client=None, max_concurrency=20):
+        self.client = client or SolrClient(pool_size=max_concurrency)
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrency,
+                                            thread_name_prefix='solr')
+    
+    async def select(self, params):
+        """Run a /select query without blocking the event loop"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, self.client.select, params)
+    
+    async def search(self, params):
+        """Run a /select query and return the matching docs"""
+        return (await self.select(params))['response']['docs']
+    
+    async def gather(self, queries):
+        """Run several /select queries concurrently, returning responses in order"""
+        return await asyncio.gather(*(self.select(params) for params in queries))
+    
+    def close(self):
+        self._executor.shutdown(wait=False)
@@ -0,0 +1,68 @@
+# tests/test_collaborative_filtering.py
+import numpy as np
+import pytest
+import delta_matrix
+from collaborative_filtering import CollaborativeFilteringRecommender
+from interaction_store import INTERACTION_TYPES, InteractionLog
+
+TIMESTAMP = '2026-01-01T00:00:00Z'
+
+def _events(rng, n_events, n_users, n_items, prefix=''):
+    return [
+        {'user_id': f'{prefix}U{rng.integers(n_users):03d}', 'product_id': f'{prefix}P{rng.integers(n_items):03d}',
+         'interaction_type': INTERACTION_TYPES[rng.integers(len(INTERACTION_TYPES))], 'timestamp': TIMESTAMP}
+        for _ in range(n_events)
+    ]
+
+def _model(events):
+    model = CollaborativeFilteringRecommender(interactions_file=InteractionLog.from_records(events))
+    return model.build_matrix().compute_item_similarity(top_k=None)
+
+def _by_ids(model):
+    """Model state with rows and columns in id order, so models with different indices compare"""
+    users, items = np.argsort(model.users.ids), np.argsort(model.items.ids)
+    return {
+        'users': model.users.ids[users],
+        'items': model.items.ids[items],
+        'user_item': model.user_item_matrix.toarray()[users][:, items],
+        'similarity': model.item_similarity.toarray()[items][:, items],
+        'item_norms': model.item_norms[items],
+    }
+
+@pytest.mark.parametrize('merge_nnz', [delta_matrix.MERGE_NNZ, 50])
+def test_add_interactions_matches_full_rebuild(monkeypatch, merge_nnz):
+    # A low merge threshold folds the replaced rows into the base between updates
+    monkeypatch.setattr(delta_matrix, 'MERGE_NNZ', merge_nnz)
+    rng = np.random.default_rng(0)
+    events = _events(rng, 400, 40, 30)
+    model = _model(events)
+    
+    # Updates touch known users and items and add new ones
+    for batch in range(4):
+        update = _events(rng, 25, 40, 30) + _events(rng, 5, 5, 5, prefix=f'N{batch}')
+        model.add_interactions(update)
+        events += update
+    
+    incremental, rebuilt = _by_ids(model), _by_ids(_model(events))
+    np.testing.assert_array_equal(incremental['users'], rebuilt['users'])
+    np.testing.assert_array_equal(incremental['items'], rebuilt['items'])
+    np.testing.assert_array_equal(incremental['user_item'], rebuilt['user_item'])
+    np.testing.assert_allclose(incremental['item_norms'], rebuilt['item_norms'])
+    np.testing.assert_allclose(incremental['similarity'], rebuilt['similarity'], atol=1e-12)
+
+def test_add_interactions_recommendations_match_full_rebuild():
+    rng = np.random.default_rng(1)
+    events = _events(rng, 300, 30, 20)
+    model = _model(events)
+    update = _events(rng, 20, 30, 20) + _events(rng, 5, 3, 3, prefix='N')
+    model.add_interactions(update)
+    rebuilt = _model(events + update)
+    
+    for user_id in ['U000', 'U007', 'NU000']:
+        _, scores = model.top_n_for_user(user_id, 5)
+        _, expected_scores = rebuilt.top_n_for_user(user_id, 5)
+        np.testing.assert_allclose(scores, expected_scores, atol=1e-12)
+    users = ['U001', 'U002', 'NU001', 'UNKNOWN']
+    for (_, _, scores), (_, _, expected_scores) in zip(model.iter_top_n_for_users(users, 5),
+                                                      rebuilt.iter_top_n_for_users(users, 5)):
+        np.testing.assert_allclose(scores, expected_scores, atol=1e-12)
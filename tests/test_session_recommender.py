@@ -0,0 +1,114 @@
+# tests/test_session_recommender.py
+import multiprocessing
+import numpy as np
+import pytest
+from collaborative_filtering import CollaborativeFilteringRecommender
+from interaction_store import INTERACTION_TYPES, InteractionLog
+from session_recommender import SessionRecommender
+
+@pytest.fixture(scope='module')
+def collaborative():
+    rng = np.random.default_rng(0)
+    events = [
+        {'user_id': f'U{rng.integers(20):02d}', 'product_id': f'P{rng.integers(30):02d}',
+         'interaction_type': INTERACTION_TYPES[rng.integers(len(INTERACTION_TYPES))],
+         'timestamp': '2026-01-01T00:00:00Z'}
+        for _ in range(300)
+    ]
+    model = CollaborativeFilteringRecommender(interactions_file=InteractionLog.from_records(events))
+    return model.build_matrix().compute_item_similarity()
+
+def _product(collaborative, i):
+    return str(collaborative.item_ids[i % len(collaborative.item_ids)])
+
+def test_insert_and_update(collaborative):
+    sessions = SessionRecommender(collaborative, max_sessions=8, buffer_size=4)
+    p0, p1, p2 = (_product(collaborative, i) for i in range(3))
+    
+    assert sessions.add_event('a', p0, now=0)
+    assert sessions.add_event('b', p1, now=1)
+    assert sessions.add_event('a', p2, now=2)
+    assert not sessions.add_event('a', 'UNKNOWN', now=3)
+    
+    assert len(sessions) == 2
+    assert sessions.session_items('a') == [p0, p2]
+    assert sessions.session_items('b') == [p1]
+    assert sessions.session_items('c') == []
+    
+    product_ids, scores = sessions.top_n_for_session('a', 5, now=2)
+    assert p0 not in product_ids and p2 not in product_ids
+    assert np.all(np.diff(scores) <= 0)
+
+def test_idle_sessions_are_evicted(collaborative):
+    sessions = SessionRecommender(collaborative, max_sessions=8, idle_timeout=10)
+    product = _product(collaborative, 0)
+    sessions.add_event('old', product, now=0)
+    sessions.add_event('recent', product, now=5)
+    
+    # Idle sessions expire for scoring at once and are freed by the next new session
+    assert len(sessions.top_n_for_session('old', now=11)[0]) == 0
+    sessions.add_event('new', product, now=11)
+    assert len(sessions) == 2
+    assert sessions.evictions == 1
+    assert sessions.session_items('old') == []
+    assert sessions.session_items('recent') == [product]
+
+def test_least_recently_active_session_makes_room(collaborative):
+    sessions = SessionRecommender(collaborative, max_sessions=2)
+    product = _product(collaborative, 0)
+    sessions.add_event('a', product, now=0)
+    sessions.add_event('b', product, now=1)
+    sessions.add_event('a', product, now=2)
+    sessions.add_event('c', product, now=3)
+    
+    assert len(sessions) == 2
+    assert sessions.session_items('b') == []
+    assert sessions.session_items('a') == [product, product]
+    assert sessions.session_items('c') == [product]
+
+def test_ring_buffer_wraps_around(collaborative):
+    sessions = SessionRecommender(collaborative, max_sessions=4, buffer_size=3)
+    products = [_product(collaborative, i) for i in range(7)]
+    for t, product in enumerate(products):
+        sessions.add_event('a', product, now=t)
+    
+    # Only the last buffer_size events are kept, oldest first
+    assert sessions.session_items('a') == products[-3:]
+
+def test_table_survives_many_evictions(collaborative):
+    # Every new session past max_sessions evicts one, leaving tombstones to be rehashed away
+    sessions = SessionRecommender(collaborative, max_sessions=4)
+    for t in range(200):
+        sessions.add_event(f's{t}', _product(collaborative, t), now=t)
+    
+    assert len(sessions) == 4
+    assert sessions.evictions == 196
+    for t in range(196, 200):
+        assert sessions.session_items(f's{t}') == [_product(collaborative, t)]
+    assert sessions.session_items('s0') == []
+
+def _write_events(sessions, worker, products, count):
+    for i in range(count):
+        sessions.add_event(f'own-{worker}-{i % 5}', products[i % len(products)])
+        sessions.add_event('shared', products[i % len(products)])
+
+def test_concurrent_writers_in_two_processes(collaborative):
+    count = 200
+    sessions = SessionRecommender(collaborative, max_sessions=64, buffer_size=2 * count)
+    products = [_product(collaborative, i) for i in range(10)]
+    
+    context = multiprocessing.get_context('fork')
+    workers = [context.Process(target=_write_events, args=(sessions, worker, products, count))
+               for worker in range(2)]
+    for process in workers:
+        process.start()
+    for process in workers:
+        process.join()
+        assert process.exitcode == 0
+    
+    # Every event written by either process is visible here, none lost to a race
+    assert len(sessions) == 2 * 5 + 1
+    assert len(sessions.session_items('shared')) == 2 * count
+    for worker in range(2):
+        for i in range(5):
+            assert len(sessions.session_items(f'own-{worker}-{i}')) == count // 5
@@ -0,0 +1,83 @@
+# tests/test_solr_client.py
+import asyncio
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+import pytest
+import requests
+from solr_client import AsyncSolrClient, SolrClient
+
+# Seconds the fake Solr takes to answer each query
+QUERY_DELAY = 0.2
+
+class _FakeSolr(BaseHTTPRequestHandler):
+    """Answers /select with one doc echoing the query, after QUERY_DELAY; q=fail answers 500"""
+    
+    def do_GET(self):
+        url = urlparse(self.path)
+        params = parse_qs(url.query)
+        time.sleep(QUERY_DELAY)
+        if url.path != '/solr/products/select' or params['q'] == ['fail']:
+            self.send_response(500)
+            self.end_headers()
+            return
+        
+        body = json.dumps({'response': {'numFound': 1, 'docs': [{'id': params['q'][0]}]}}).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+    
+    def log_message(self, *args):
+        pass
+
+@pytest.fixture
+def solr_url():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), _FakeSolr)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f'http://127.0.0.1:{server.server_address[1]}/solr/products'
+    server.shutdown()
+    server.server_close()
+
+@pytest.fixture
+def client(solr_url):
+    client = AsyncSolrClient(SolrClient(solr_url, retries=0), max_concurrency=8)
+    yield client
+    client.close()
+    client.client.close()
+
+def test_search_returns_docs(client):
+    docs = asyncio.run(client.search({'q': 'id:PROD1'}))
+    assert docs == [{'id': 'id:PROD1'}]
+
+def test_gather_runs_queries_concurrently_in_order(client):
+    queries = [{'q': f'id:PROD{i}'} for i in range(8)]
+    
+    start = time.perf_counter()
+    responses = asyncio.run(client.gather(queries))
+    elapsed = time.perf_counter() - start
+    
+    assert [r['response']['docs'][0]['id'] for r in responses] == [q['q'] for q in queries]
+    # One at a time would take 8 delays
+    assert elapsed < 4 * QUERY_DELAY
+
+def test_select_does_not_block_the_event_loop(client):
+    async def run():
+        ticks = 0
+        query = asyncio.ensure_future(client.select({'q': 'id:PROD1'}))
+        while not query.done():
+            ticks += 1
+            await asyncio.sleep(QUERY_DELAY / 10)
+        return ticks, query.result()
+    
+    ticks, response = asyncio.run(run())
+    assert ticks >= 5
+    assert response['response']['numFound'] == 1
+
+def test_errors_propagate(client):
+    with pytest.raises(requests.HTTPError):
+        asyncio.run(client.search({'q': 'fail'}))
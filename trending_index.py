@@ -0,0 +1,175 @@
+# trending_index.py
+import json
+import threading
+import time
+import numpy as np
+from interaction_store import InteractionLog
+from vocabulary import Vocabulary
+
+def _grouped_order(groups, *keys):
+    """
+    Sort item indices within each group by keys, descending, first key most significant
+    
+    Returns {group_code: index array}, built from a single lexsort over all items.
+    """
+    order = np.lexsort(tuple(-k for k in reversed(keys)) + (groups,))
+    sorted_groups = groups[order]
+    bounds = np.flatnonzero(np.diff(sorted_groups)) + 1
+    return {int(groups[chunk[0]]): chunk for chunk in np.split(order, bounds) if len(chunk)}
+
+class TrendingIndex:
+    """
+    Pre-sorted trending and popularity rankings served by slicing
+    
+    Holds a global trending list plus per-category and per-brand lists,
+    rebuilt from the catalog on a background schedule. With a half life,
+    trending is ranked by a time-decayed interaction score instead of
+    sales_last_30_days: the interaction log and every later batch of
+    events are folded into one running score per item, decayed to the
+    newest event, and the next refresh ranks by it.
+    """
+    
+    def __init__(self, loader, refresh_interval=None, interactions=None, half_life_days=None):
+        self.loader = loader
+        self.refresh_interval = refresh_interval
+        self.half_life_days = half_life_days
+        
+        # Decayed interaction weight per item id, as of the newest event folded in
+        self._decayed = (Vocabulary(), np.zeros(0), None)
+        self._decay_lock = threading.Lock()
+        if half_life_days and interactions is not None:
+            self.add_log(interactions)
+        
+        self._state = None
+        self._stop = threading.Event()
+        self._thread = None
+    
+    @classmethod
+    def from_file(cls, filename='products_enriched.json', **kwargs):
+        def load():
+            with open(filename, 'r') as f:
+                return json.load(f)
+        return cls(load, **kwargs)
+    
+    def _decay(self, seconds):
+        return np.exp(-np.log(2) * seconds / 86400.0 / self.half_life_days)
+    
+    def add_log(self, log):
+        """Fold an interaction log into the decayed item scores"""
+        if not self.half_life_days or not len(log):
+            return self
+        
+        with self._decay_lock:
+            items, totals, newest = self._decayed
+            
+            # Decay relative to the newest event so scores never underflow
+            log_newest = int(log.timestamps.max())
+            reference = log_newest if newest is None else max(newest, log_newest)
+            decayed = log.weights * self._decay(reference - log.timestamps)
+            per_item = np.bincount(log.item_codes, weights=decayed, minlength=len(log.item_ids))
+            
+            items = items.extend(log.item_ids)
+            grown = np.zeros(len(items))
+            grown[:len(totals)] = totals * (self._decay(reference - newest) if newest is not None else 1.0)
+            grown[items.lookup(log.item_ids)] += per_item
+            self._decayed = (items, grown, reference)
+        return self
+    
+    def add_events(self, events):
+        """Fold new interaction events into the decayed scores; rankings pick them up at the next refresh"""
+        if self.half_life_days:
+            self.add_log(InteractionLog.from_records(events))
+        return self
+    
+    def decayed_scores(self, product_ids):
+        """Time-decayed interaction weight per product, aligned with product_ids"""
+        items, totals, _ = self._decayed
+        scores = np.zeros(len(product_ids))
+        if not len(items):
+            return scores
+        
+        item_to_catalog = Vocabulary(product_ids).lookup(items.ids)
+        known = item_to_catalog >= 0
+        scores[item_to_catalog[known]] = totals[known]
+        return scores
+    
+    def refresh(self):
+        """Reload the catalog and rebuild every ranking, then swap it in"""
+        products = self.loader()
+        product_ids = [p['id'] for p in products]
+        
+        sales = np.array([p.get('sales_last_30_days', 0) for p in products], dtype=float)
+        popularity = np.array([p.get('popularity_score', 0.0) for p in products], dtype=float)
+        rating = np.array([p.get('rating', 0.0) for p in products], dtype=float)
+        categories, category_codes = np.unique([p.get('category', '') for p in products], return_inverse=True)
+        brands, brand_codes = np.unique([p.get('brand', '') for p in products], return_inverse=True)
+        
+        # Trending: decayed interaction score when configured, else recent sales
+        if self.half_life_days:
+            trend_keys = (self.decayed_scores(product_ids), sales, popularity)
+        else:
+            trend_keys = (sales, popularity)
+        
+        def named(names, groups):
+            return {str(names[code]): ranking for code, ranking in groups.items()}
+        
+        self._state = {
+            'products': products,
+            'trending': _grouped_order(np.zeros(len(products), dtype=int), *trend_keys).get(0, []),
+            'trending_by_category': named(categories, _grouped_order(category_codes, *trend_keys)),
+            'by_category': named(categories, _grouped_order(category_codes, popularity, rating)),
+            'by_brand': named(brands, _grouped_order(brand_codes, popularity)),
+            'refreshed_at': time.time()
+        }
+        return self
+    
+    def start(self):
+        """Build now and keep refreshing every refresh_interval seconds in the background"""
+        if self._state is None:
+            self.refresh()
+        if self.refresh_interval and self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='trending-refresh', daemon=True)
+            self._thread.start()
+        return self
+    
+    def stop(self):
+        self._stop.set()
+    
+    def _run(self):
+        while not self._stop.wait(self.refresh_interval):
+            try:
+                self.refresh()
+            except Exception as e:
+                # Keep serving the previous rankings until the next attempt
+                print(f"Trending refresh failed: {e}")
+    
+    def _slice(self, state, ranking, num_recommendations, exclude_id=None):
+        """Copy the first products of a ranking, skipping exclude_id"""
+        docs = []
+        for idx in ranking[:num_recommendations + 1]:
+            product = state['products'][idx]
+            if product['id'] == exclude_id:
+                continue
+            docs.append(dict(product))
+            if len(docs) >= num_recommendations:
+                break
+        return docs
+    
+    def trending(self, category=None, num_recommendations=10):
+        """Top trending products, globally or within a category"""
+        state = self._state
+        if category:
+            ranking = state['trending_by_category'].get(category, [])
+        else:
+            ranking = state['trending']
+        return self._slice(state, ranking, num_recommendations)
+    
+    def top_by_category(self, category, exclude_id=None, num_recommendations=10):
+        """Most popular products in a category"""
+        state = self._state
+        return self._slice(state, state['by_category'].get(category, []), num_recommendations, exclude_id)
+    
+    def top_by_brand(self, brand, exclude_id=None, num_recommendations=10):
+        """Most popular products from a brand"""
+        state = self._state
+        return self._slice(state, state['by_brand'].get(brand, []), num_recommendations, exclude_id)
@@ -0,0 +1,143 @@
+# vocabulary.py
+import threading
+import numpy as np
+
+# Ids appended since the last merge are binary-searched through a small side
+# permutation; past this many they are merged into the main one, so extend()
+# never re-sorts the whole vocabulary
+MERGE_THRESHOLD = 1 << 16
+
+# Guards the append-in-place check of extend()
+_extend_lock = threading.Lock()
+
+def _argsort(ids):
+    """Permutation sorting ids, or None when they are already sorted"""
+    if len(ids) < 2 or np.all(ids[1:] > ids[:-1]):
+        return None
+    return np.argsort(ids, kind='stable')
+
+class Vocabulary:
+    """
+    Two-way mapping between string ids and dense integer indices
+    
+    ids[i] is the id with index i. Lookups binary-search the ids through a
+    sorted permutation, so the mapping is one fixed-width string array
+    (plus the permutation, when the ids are not already sorted) instead of
+    two dicts of Python strings, and whole arrays of ids translate at once.
+    Vocabularies are never modified; extend() returns a new, larger one
+    with every existing index unchanged.
+    
+    extend() appends into spare capacity of the ids buffer when it extends
+    the newest vocabulary on it, and keeps the new ids in a side
+    permutation that is merged into the main one every MERGE_THRESHOLD
+    ids, so its cost follows the number of new ids, amortized.
+    """
+    
+    def __init__(self, ids=()):
+        self.ids = np.asarray(ids, dtype=str)
+        # Backing buffer and the length claimed on it, shared by vocabularies extended in place
+        self._buffer = self.ids
+        self._end = [len(self.ids)]
+        
+        # Sorted vocabularies (the usual case) need no permutation; ids from
+        # _base on are ordered by the side permutation instead
+        self._base = len(self.ids)
+        self._sorter = _argsort(self.ids)
+        self._delta_sorter = np.empty(0, dtype=np.intp)
+    
+    @classmethod
+    def from_values(cls, values):
+        """Sorted vocabulary of the distinct values"""
+        return cls(np.unique(np.asarray(values, dtype=str)))
+    
+    def __len__(self):
+        return len(self.ids)
+    
+    def __contains__(self, id_):
+        return self.index(id_) is not None
+    
+    def __iter__(self):
+        return iter(self.ids.tolist())
+    
+    def __getitem__(self, idx):
+        """Id (or array of ids) at an index or array of indices"""
+        return self.ids[idx]
+    
+    @property
+    def nbytes(self):
+        sorter_bytes = self._sorter.nbytes if self._sorter is not None else 0
+        return self.ids.nbytes + sorter_bytes + self._delta_sorter.nbytes
+    
+    def _parts(self):
+        """(start, ids, sorter) for the main ids and the ids appended since the last merge"""
+        yield 0, self.ids[:self._base], self._sorter
+        if len(self.ids) > self._base:
+            yield self._base, self.ids[self._base:], self._delta_sorter
+    
+    def index(self, id_, default=None):
+        """Index of one id, or default when it is unknown"""
+        for start, ids, sorter in self._parts():
+            pos = int(np.searchsorted(ids, id_, sorter=sorter))
+            if pos == len(ids):
+                continue
+            idx = start + (pos if sorter is None else int(sorter[pos]))
+            if self.ids[idx] == id_:
+                return idx
+        return default
+    
+    def lookup(self, ids):
+        """Indices of an array of ids, -1 where an id is unknown"""
+        values = np.asarray(ids, dtype=str)
+        result = np.full(values.shape, -1, dtype=np.int64)
+        
+        for start, part, sorter in self._parts():
+            if not len(part):
+                continue
+            pos = np.minimum(np.searchsorted(part, values, sorter=sorter), len(part) - 1)
+            idx = start + (pos if sorter is None else sorter[pos])
+            result = np.where((result < 0) & (self.ids[idx] == values), idx, result)
+        return result
+    
+    def extend(self, ids):
+        """Vocabulary with the unknown ids appended in first-seen order"""
+        values = np.asarray(ids, dtype=str).ravel()
+        unknown = values[self.lookup(values) < 0]
+        if not len(unknown):
+            return self
+        
+        _, first = np.unique(unknown, return_index=True)
+        new_ids = unknown[np.sort(first)]
+        size, total = len(self.ids), len(self.ids) + len(new_ids)
+        
+        with _extend_lock:
+            buffer, end = self._buffer, self._end
+            # Append in place only to the newest vocabulary on the buffer, when the ids fit
+            if end[0] != size or total > len(buffer) or new_ids.dtype.itemsize > buffer.dtype.itemsize:
+                dtype = np.result_type(buffer.dtype, new_ids.dtype)
+                buffer = np.empty(max(2 * total, 1024), dtype=dtype)
+                buffer[:size] = self.ids
+                end = [size]
+            buffer[size:total] = new_ids
+            end[0] = total
+        
+        vocabulary = Vocabulary.__new__(Vocabulary)
+        vocabulary.ids = buffer[:total]
+        vocabulary._buffer, vocabulary._end = buffer, end
+        
+        # Merge the new ids into the side permutation of the ids since the last merge
+        delta_ids = vocabulary.ids[self._base:]
+        order = np.argsort(new_ids, kind='stable')
+        positions = np.searchsorted(delta_ids[:size - self._base], new_ids[order], sorter=self._delta_sorter)
+        delta_sorter = np.insert(self._delta_sorter, positions, size - self._base + order)
+        
+        base, sorter = self._base, self._sorter
+        if len(delta_sorter) > MERGE_THRESHOLD:
+            # Fold the side permutation into the main one, keeping sorted prefixes permutation-free
+            positions = np.searchsorted(vocabulary.ids[:base], delta_ids[delta_sorter], sorter=sorter)
+            if sorter is not None or positions[0] < base or np.any(delta_sorter[1:] < delta_sorter[:-1]):
+                main = np.arange(base) if sorter is None else sorter
+                sorter = np.insert(main, positions, base + delta_sorter)
+            base, delta_sorter = total, np.empty(0, dtype=np.intp)
+        
+        vocabulary._base, vocabulary._sorter, vocabulary._delta_sorter = base, sorter, delta_sorter
+        return vocabulary